@@ -0,0 +1,118 @@
+"""
+Vazão do envio de emails: uma conexão SMTP por email x lote pelo SMTPConnectionPool
+
+Sobe um servidor SMTP local de teste que atrasa a saudação de cada conexão (simulando
+o handshake/login de um provedor real) e envia o mesmo lote pelos dois caminhos.
+
+Uso (na raiz do repositório):
+    python benchmarks/smtp_pool.py --emails 300 --handshake-ms 20
+"""
+
+import argparse
+import os
+import smtplib
+import socketserver
+import sys
+import threading
+import time
+from email.mime.text import MIMEText
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.services.smtp_pool import SMTPConnectionPool
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    """Diálogo SMTP mínimo: aceita qualquer remetente, destinatário e mensagem"""
+
+    def handle(self):
+        time.sleep(self.server.handshake)
+        self.wfile.write(b'220 localhost ESMTP\r\n')
+        em_dados = False
+        while True:
+            linha = self.rfile.readline()
+            if not linha:
+                return
+            if em_dados:
+                if linha == b'.\r\n':
+                    em_dados = False
+                    self.server.recebidos += 1
+                    self.wfile.write(b'250 OK\r\n')
+                continue
+            comando = linha[:4].upper()
+            if comando == b'EHLO':
+                self.wfile.write(b'250-localhost\r\n250 8BITMIME\r\n')
+            elif comando == b'DATA':
+                em_dados = True
+                self.wfile.write(b'354 Envie a mensagem\r\n')
+            elif comando == b'QUIT':
+                self.wfile.write(b'221 Tchau\r\n')
+                return
+            else:
+                self.wfile.write(b'250 OK\r\n')
+
+
+class _Servidor(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, handshake: float):
+        super().__init__(('127.0.0.1', 0), _Handler)
+        self.handshake = handshake
+        self.recebidos = 0
+
+
+def _mensagens(total: int):
+    mensagens = []
+    for i in range(total):
+        msg = MIMEText(f'Lembrete do agendamento {i}', 'plain', 'utf-8')
+        msg['From'] = 'sistema@agendaonline.com'
+        msg['To'] = f'cliente{i}@exemplo.com'
+        msg['Subject'] = 'Lembrete - AgendaOnline'
+        mensagens.append(msg)
+    return mensagens
+
+
+def uma_conexao_por_email(porta: int, mensagens) -> float:
+    """Caminho anterior ao pool: conectar, EHLO, enviar e encerrar para cada email"""
+    inicio = time.perf_counter()
+    for msg in mensagens:
+        conn = smtplib.SMTP('127.0.0.1', porta, timeout=10)
+        conn.ehlo()
+        conn.send_message(msg)
+        conn.quit()
+    return time.perf_counter() - inicio
+
+
+def lote_pelo_pool(porta: int, mensagens) -> float:
+    pool = SMTPConnectionPool('127.0.0.1', porta, starttls=False, max_size=1)
+    inicio = time.perf_counter()
+    resultados = pool.send_messages(mensagens)
+    duracao = time.perf_counter() - inicio
+    pool.close_all()
+    assert all(r['success'] for r in resultados), 'falha no envio pelo pool'
+    return duracao
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--emails', type=int, default=300)
+    parser.add_argument('--handshake-ms', type=float, default=20.0, help='Atraso da saudação de cada conexão')
+    args = parser.parse_args()
+
+    servidor = _Servidor(args.handshake_ms / 1000)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    porta = servidor.server_address[1]
+    mensagens = _mensagens(args.emails)
+
+    try:
+        for nome, executar in (('uma conexão por email', uma_conexao_por_email), ('lote pelo pool', lote_pelo_pool)):
+            duracao = executar(porta, mensagens)
+            print(f'{nome:<22} {args.emails / duracao:8.0f} emails/s  ({duracao:.2f} s)')
+    finally:
+        servidor.shutdown()
+        servidor.server_close()
+
+
+if __name__ == '__main__':
+    main()
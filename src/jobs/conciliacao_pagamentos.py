@@ -0,0 +1,241 @@
+"""
+Job de conciliação de pagamentos pendentes
+Percorre em lotes os pagamentos pendentes há mais de X minutos, consulta os
+gateways em paralelo e grava as mudanças de status em massa. Só são conciliados
+os gateways com API configurada (<GATEWAY>_API_URL); os demais são contados
+como ignorados, já que sem API o status seria apenas simulado
+"""
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, Any, Iterator, List, Optional
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import bindparam, func, or_, update
+
+from ..models.pagamento import Pagamento
+from ..models.shards import shard_router
+from ..models.user import db
+from ..services.notification_service import notification_service
+from ..services.payment_service import payment_service
+from .metricas_plataforma import ler_checkpoint, gravar_checkpoint
+
+STATUS_PENDENTES = ['pendente', 'pending']
+
+
+def _filtro_pendentes(limite_criado_em: datetime):
+    return (
+        Pagamento.status.in_(STATUS_PENDENTES),
+        Pagamento.criado_em < limite_criado_em,
+        Pagamento.transacao_id_externo.isnot(None)
+    )
+
+
+def pagamentos_pendentes(limite_criado_em: datetime, gateways: List[str], ultimo_id: int = 0,
+                         lote: int = 500) -> Iterator[List[Dict[str, Any]]]:
+    """Percorre os pagamentos pendentes dos gateways informados por id (keyset), um lote por vez"""
+    if not gateways:
+        return
+
+    while True:
+        rows = db.session.query(
+            Pagamento.id,
+            Pagamento.gateway,
+            Pagamento.status,
+            Pagamento.transacao_id_externo
+        ).filter(
+            *_filtro_pendentes(limite_criado_em),
+            Pagamento.gateway.in_(gateways),
+            Pagamento.id > ultimo_id
+        ).order_by(Pagamento.id).limit(lote).all()
+
+        if not rows:
+            return
+
+        yield [dict(row._mapping) for row in rows]
+        ultimo_id = rows[-1].id
+
+
+def pendentes_ignorados(limite_criado_em: datetime, gateways: List[str]) -> Dict[str, int]:
+    """Pagamentos pendentes por gateway sem API configurada, que a conciliação não consulta"""
+    rows = db.session.query(Pagamento.gateway, func.count(Pagamento.id)).filter(
+        *_filtro_pendentes(limite_criado_em),
+        Pagamento.gateway.notin_(gateways)
+    ).group_by(Pagamento.gateway).all()
+    return {gateway: total for gateway, total in rows}
+
+
+def consultar_gateways(pagamentos: List[Dict[str, Any]], executor: ThreadPoolExecutor,
+                       limites: Dict[str, threading.BoundedSemaphore]) -> List[Dict[str, Any]]:
+    """Consulta o status de cada pagamento, respeitando o limite de concorrência do gateway"""
+
+    def consultar(pagamento):
+        with limites[pagamento['gateway']]:
+            try:
+                return payment_service.check_payment_status(pagamento['transacao_id_externo'], pagamento['gateway'])
+            except Exception as e:
+                return {'erro': str(e)}
+
+    return list(executor.map(consultar, pagamentos))
+
+
+def registrar_alteracoes(alteracoes: List[Dict[str, Any]]) -> int:
+    """
+    Grava as mudanças de status em um único UPDATE executado em massa por id
+
+    A condição de status pendente evita sobrescrever um webhook recebido durante a consulta.
+    """
+    if not alteracoes:
+        return 0
+
+    tabela = Pagamento.__table__
+    stmt = update(tabela).where(
+        tabela.c.id == bindparam('b_id'),
+        # IN expandido não é aceito em executemany
+        or_(*[tabela.c.status == status for status in STATUS_PENDENTES])
+    ).values(
+        status=bindparam('b_status'),
+        dados_gateway=func.json_patch(func.coalesce(tabela.c.dados_gateway, func.json_object()), bindparam('b_dados')),
+        processado_em=bindparam('b_agora'),
+        atualizado_em=bindparam('b_agora')
+    )
+    result = db.session.execute(stmt, alteracoes)
+    return result.rowcount
+
+
+def executar(minutos: int = 30, lote: int = 500, concorrencia: int = 4,
+             checkpoint: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Executa a conciliação
+
+    Args:
+        minutos: Idade mínima dos pagamentos pendentes a consultar
+        lote: Quantidade de pagamentos lidos e gravados por vez
+        concorrencia: Consultas simultâneas por gateway
+        checkpoint: Arquivo com o último id concluído; permite retomar uma execução interrompida
+
+    Returns:
+        Dict com o relatório da execução
+    """
+    estado = ler_checkpoint(checkpoint) if checkpoint else None
+    if estado:
+        limite = datetime.fromisoformat(estado['limite_criado_em'])
+        ultimo_id = estado['ultimo_id']
+        relatorio = estado['relatorio']
+    else:
+        limite = datetime.utcnow() - timedelta(minutes=minutos)
+        ultimo_id = 0
+        relatorio = {'consultados': 0, 'alterados': 0, 'erros': 0, 'por_gateway': {}, 'por_status': {}}
+
+    inicio = time.monotonic()
+    limites = {}
+    # Sem API configurada, check_payment_status só simula um status: não pode ser gravado
+    gateways = list(payment_service.gateway_clients)
+    relatorio['ignorados'] = pendentes_ignorados(limite, gateways)
+    executor = ThreadPoolExecutor(max_workers=max(concorrencia * len(gateways), 1))
+
+    try:
+        for pagamentos in pagamentos_pendentes(limite, gateways, ultimo_id, lote):
+            for pagamento in pagamentos:
+                limites.setdefault(pagamento['gateway'], threading.BoundedSemaphore(concorrencia))
+
+            resultados = consultar_gateways(pagamentos, executor, limites)
+
+            agora = datetime.utcnow()
+            alteracoes = []
+            pagos = []
+            for pagamento, resultado in zip(pagamentos, resultados):
+                por_gateway = relatorio['por_gateway'].setdefault(
+                    pagamento['gateway'], {'consultados': 0, 'alterados': 0, 'erros': 0}
+                )
+                por_gateway['consultados'] += 1
+                relatorio['consultados'] += 1
+
+                if 'erro' in resultado:
+                    por_gateway['erros'] += 1
+                    relatorio['erros'] += 1
+                    continue
+
+                status = resultado.get('status')
+                if not status or status in STATUS_PENDENTES:
+                    continue
+
+                alteracoes.append({
+                    'b_id': pagamento['id'],
+                    'b_status': status,
+                    'b_dados': json.dumps(resultado, default=str),
+                    'b_agora': agora
+                })
+                if status == 'paid':
+                    pagos.append(pagamento['id'])
+                por_gateway['alterados'] += 1
+                relatorio['por_status'][status] = relatorio['por_status'].get(status, 0) + 1
+
+            relatorio['alterados'] += registrar_alteracoes(alteracoes)
+            notification_service.enqueue_payment_notification(pagos, 'paid')
+            db.session.commit()
+
+            if checkpoint:
+                gravar_checkpoint(checkpoint, {
+                    'limite_criado_em': limite.isoformat(),
+                    'ultimo_id': pagamentos[-1]['id'],
+                    'relatorio': relatorio
+                })
+            db.session.expunge_all()
+    finally:
+        executor.shutdown(wait=True)
+
+    # Execução concluída: a próxima começa do zero
+    if checkpoint and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+
+    relatorio['limite_criado_em'] = limite.isoformat()
+    relatorio['duracao_segundos'] = round(time.monotonic() - inicio, 2)
+    return relatorio
+
+
+def executar_shards(minutos: int = 30, lote: int = 500, concorrencia: int = 4,
+                    checkpoint: Optional[str] = None) -> Dict[str, Any]:
+    """Executa a conciliação em cada shard (um checkpoint por shard) e soma os relatórios"""
+    if not shard_router.enabled:
+        return executar(minutos, lote, concorrencia, checkpoint)
+
+    relatorio = {'consultados': 0, 'alterados': 0, 'erros': 0, 'por_gateway': {}, 'por_status': {},
+                 'ignorados': {}, 'shards': {}}
+    for shard in shard_router.each():
+        parcial = executar(minutos, lote, concorrencia, f'{checkpoint}.shard{shard}' if checkpoint else None)
+        relatorio['shards'][shard] = parcial
+        for chave in ('consultados', 'alterados', 'erros'):
+            relatorio[chave] += parcial[chave]
+        for gateway, contagens in parcial['por_gateway'].items():
+            total = relatorio['por_gateway'].setdefault(gateway, {'consultados': 0, 'alterados': 0, 'erros': 0})
+            for chave, valor in contagens.items():
+                total[chave] += valor
+        for status, valor in parcial['por_status'].items():
+            relatorio['por_status'][status] = relatorio['por_status'].get(status, 0) + valor
+        for gateway, valor in parcial['ignorados'].items():
+            relatorio['ignorados'][gateway] = relatorio['ignorados'].get(gateway, 0) + valor
+    return relatorio
+
+
+@click.command('conciliar-pagamentos')
+@click.option('--minutos', default=30, show_default=True, help='Idade mínima, em minutos, dos pagamentos pendentes')
+@click.option('--lote', default=500, show_default=True, help='Pagamentos lidos e gravados por vez')
+@click.option('--concorrencia', default=4, show_default=True, help='Consultas simultâneas por gateway')
+@click.option('--checkpoint', type=click.Path(dir_okay=False), help='Arquivo de checkpoint para retomar a execução')
+@click.option('--relatorio', type=click.Path(dir_okay=False), help='Arquivo JSON para gravar o relatório')
+@with_appcontext
+def conciliar_pagamentos_command(minutos, lote, concorrencia, checkpoint, relatorio):
+    """Consulta nos gateways os pagamentos pendentes e grava as mudanças de status"""
+    resultado = executar_shards(minutos, lote, concorrencia, checkpoint)
+
+    if relatorio:
+        with open(relatorio, 'w', encoding='utf-8') as arquivo:
+            json.dump(resultado, arquivo, ensure_ascii=False, indent=2)
+
+    click.echo(json.dumps(resultado, ensure_ascii=False))
@@ -0,0 +1,58 @@
+"""
+Worker das exclusões em massa
+Executa as exclusões de empresas, clientes e profissionais pedidas pelas rotas
+DELETE, uma de cada vez, em lotes com um commit por lote
+"""
+
+import json
+import time
+
+import click
+from flask.cli import with_appcontext
+
+from ..models.shards import shard_router
+from ..services.bulk_delete import BulkDeleter
+
+
+def executar_worker(lote: int = 500, pausa: float = 0.05, intervalo: float = 5.0, uma_vez: bool = False):
+    """
+    Processa as exclusões pendentes, aguardando `intervalo` segundos quando não há nenhuma
+
+    Com o banco particionado, cada passada executa uma exclusão de cada shard.
+    """
+    deleter = BulkDeleter(chunk_size=lote, pause=pausa)
+    for _ in shard_router.each():
+        deleter.recover_interrupted()
+
+    while True:
+        executadas = 0
+        for _ in shard_router.each():
+            exclusao = deleter.claim()
+            if exclusao is None:
+                continue
+            deleter.run(exclusao)
+            click.echo(json.dumps({
+                'exclusao': exclusao.id,
+                'entidade': exclusao.entidade,
+                'entidade_id': exclusao.entidade_id,
+                'status': exclusao.status,
+                'total_excluido': exclusao.total_excluido,
+                'erro': exclusao.erro_detalhes
+            }, ensure_ascii=False))
+            executadas += 1
+
+        if uma_vez:
+            return executadas
+        if not executadas:
+            time.sleep(intervalo)
+
+
+@click.command('worker-exclusoes')
+@click.option('--lote', default=500, show_default=True, help='Linhas apagadas por transação')
+@click.option('--pausa', default=0.05, show_default=True, help='Segundos de espera entre os lotes')
+@click.option('--intervalo', default=5.0, show_default=True, help='Segundos de espera quando não há exclusões pendentes')
+@click.option('--uma-vez', is_flag=True, help='Executa uma exclusão (por shard) e termina')
+@with_appcontext
+def worker_exclusoes_command(lote, pausa, intervalo, uma_vez):
+    """Apaga em segundo plano as empresas, clientes e profissionais excluídos"""
+    executar_worker(lote, pausa, intervalo, uma_vez)
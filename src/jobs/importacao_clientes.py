@@ -0,0 +1,42 @@
+"""
+Importação de clientes pela linha de comando
+Mesma importação em lotes da rota /empresas/<id>/clientes/importar, para
+planilhas grandes de migração de novas empresas
+"""
+
+import json
+
+import click
+from flask.cli import with_appcontext
+
+from ..models.empresa import Empresa
+from ..models.shards import shard_router
+from ..models.user import db
+from ..services.client_import import ClientImporter
+
+
+@click.command('importar-clientes')
+@click.argument('empresa_id', type=int)
+@click.argument('arquivo', type=click.Path(exists=True, dir_okay=False))
+@click.option('--lote', default=1000, show_default=True, help='Linhas gravadas por vez')
+@click.option('--relatorio', type=click.Path(dir_okay=False), help='Arquivo JSON para gravar o relatório com os erros por linha')
+@with_appcontext
+def importar_clientes_command(empresa_id, arquivo, lote, relatorio):
+    """Importa os clientes de uma planilha CSV ou XLSX para a empresa"""
+    if shard_router.enabled:
+        shard_router.activate(shard_router.shard_for_empresa(empresa_id))
+    if not db.session.get(Empresa, empresa_id):
+        raise click.ClickException(f'Empresa {empresa_id} não encontrada')
+
+    importador = ClientImporter(chunk_size=lote)
+    with open(arquivo, 'rb') as planilha:
+        try:
+            resultado = importador.import_file(empresa_id, planilha, arquivo)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+
+    if relatorio:
+        with open(relatorio, 'w', encoding='utf-8') as saida:
+            json.dump(resultado, saida, ensure_ascii=False, indent=2)
+
+    click.echo(json.dumps({chave: valor for chave, valor in resultado.items() if chave != 'erros'}, ensure_ascii=False))
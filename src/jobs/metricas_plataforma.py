@@ -0,0 +1,235 @@
+"""
+Job noturno de métricas da plataforma
+Calcula as métricas diárias de todas as empresas em poucas passadas agrupadas
+sobre agendamentos, clientes e pagamentos, gravando o resultado em JSON Lines
+"""
+
+import json
+import os
+from datetime import datetime, date, timedelta
+from typing import Dict, Any, Iterator, Optional
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import func, case, distinct
+
+from ..models.agendamento import Agendamento
+from ..models.cliente import Cliente
+from ..models.empresa import Empresa
+from ..models.pagamento import Pagamento
+from ..models.profissional import Profissional
+from ..models.servico import Servico
+from ..models.shards import shard_router
+from ..models.user import db
+
+STATUS_REALIZADOS = ['confirmado', 'concluido']
+STATUS_PAGOS = ['aprovado', 'paid']
+
+
+def _metricas_vazias() -> Dict[str, Any]:
+    return {
+        'agendamentos': 0,
+        'agendamentos_realizados': 0,
+        'cancelamentos': 0,
+        'receita': 0.0,
+        'descontos': 0.0,
+        'clientes_ativos': 0,
+        'novos_clientes': 0,
+        'pagamentos': 0,
+        'pagamentos_aprovados': 0,
+        'valor_pago': 0.0
+    }
+
+
+def _em_todos_os_shards(calcular, *args) -> Dict[int, Dict[str, Any]]:
+    """Junta os resultados por empresa de cada shard (os ids de empresa não se repetem entre shards)"""
+    resultado = {}
+    for _ in shard_router.each():
+        resultado.update(calcular(*args))
+    return resultado
+
+
+def calcular_uso_planos() -> Dict[int, Dict[str, Any]]:
+    """Obtém o uso do plano de cada empresa (uma passada agrupada por tabela)"""
+    uso = {
+        row.id: {'plano': row.plano, 'clientes': 0, 'profissionais': 0, 'servicos': 0}
+        for row in db.session.query(Empresa.id, Empresa.plano)
+    }
+
+    contagens = [
+        ('clientes', Cliente.empresa_id, Cliente.ativo),
+        ('profissionais', Profissional.empresa_id, Profissional.ativo),
+        ('servicos', Servico.empresa_id, Servico.ativo),
+    ]
+    for chave, empresa_id, ativo in contagens:
+        query = db.session.query(empresa_id, func.count()).filter(ativo == True).group_by(empresa_id)
+        for id_empresa, total in query:
+            if id_empresa in uso:
+                uso[id_empresa][chave] = total
+
+    return uso
+
+
+def calcular_metricas_dia(dia: date) -> Dict[int, Dict[str, Any]]:
+    """Calcula as métricas de um dia para todas as empresas com movimento"""
+    inicio = datetime.combine(dia, datetime.min.time())
+    fim = inicio + timedelta(days=1)
+    metricas = {}
+
+    def metricas_empresa(empresa_id):
+        return metricas.setdefault(empresa_id, _metricas_vazias())
+
+    realizado = Agendamento.status.in_(STATUS_REALIZADOS)
+    agendamentos = db.session.query(
+        Agendamento.empresa_id,
+        func.count(Agendamento.id).label('total'),
+        func.sum(case((realizado, 1), else_=0)).label('realizados'),
+        func.sum(case((Agendamento.status == 'cancelado', 1), else_=0)).label('cancelamentos'),
+        func.sum(case((realizado, Agendamento.valor_total), else_=0)).label('receita'),
+        func.sum(case((realizado, Agendamento.valor_desconto), else_=0)).label('descontos'),
+        func.count(distinct(Agendamento.cliente_id)).label('clientes_ativos')
+    ).filter(
+        Agendamento.data_hora >= inicio,
+        Agendamento.data_hora < fim
+    ).group_by(Agendamento.empresa_id)
+
+    for row in agendamentos:
+        dados = metricas_empresa(row.empresa_id)
+        dados['agendamentos'] = row.total
+        dados['agendamentos_realizados'] = int(row.realizados or 0)
+        dados['cancelamentos'] = int(row.cancelamentos or 0)
+        dados['receita'] = float(row.receita or 0)
+        dados['descontos'] = float(row.descontos or 0)
+        dados['clientes_ativos'] = row.clientes_ativos
+
+    novos_clientes = db.session.query(
+        Cliente.empresa_id,
+        func.count(Cliente.id)
+    ).filter(
+        Cliente.criado_em >= inicio,
+        Cliente.criado_em < fim
+    ).group_by(Cliente.empresa_id)
+
+    for empresa_id, total in novos_clientes:
+        metricas_empresa(empresa_id)['novos_clientes'] = total
+
+    pago = Pagamento.status.in_(STATUS_PAGOS)
+    pagamentos = db.session.query(
+        Agendamento.empresa_id,
+        func.count(Pagamento.id).label('total'),
+        func.sum(case((pago, 1), else_=0)).label('aprovados'),
+        func.sum(case((pago, Pagamento.valor), else_=0)).label('valor_pago')
+    ).join(Agendamento, Agendamento.id == Pagamento.agendamento_id).filter(
+        Pagamento.criado_em >= inicio,
+        Pagamento.criado_em < fim
+    ).group_by(Agendamento.empresa_id)
+
+    for row in pagamentos:
+        dados = metricas_empresa(row.empresa_id)
+        dados['pagamentos'] = row.total
+        dados['pagamentos_aprovados'] = int(row.aprovados or 0)
+        dados['valor_pago'] = float(row.valor_pago or 0)
+
+    return metricas
+
+
+def gerar_linhas_dia(dia: date, uso_planos: Dict[int, Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    """Gera uma linha por empresa para o dia informado"""
+    metricas = _em_todos_os_shards(calcular_metricas_dia, dia)
+
+    for empresa_id in sorted(uso_planos):
+        linha = {'data': dia.isoformat(), 'empresa_id': empresa_id}
+        linha.update(metricas.get(empresa_id) or _metricas_vazias())
+        linha['uso_plano'] = uso_planos[empresa_id]
+        yield linha
+
+
+def ler_checkpoint(caminho: str) -> Optional[Dict[str, Any]]:
+    if not os.path.exists(caminho):
+        return None
+    with open(caminho, 'r', encoding='utf-8') as arquivo:
+        return json.load(arquivo)
+
+
+def gravar_checkpoint(caminho: str, dados: Dict[str, Any]):
+    """Grava o checkpoint de forma atômica (arquivo temporário + rename)"""
+    temporario = f"{caminho}.tmp"
+    with open(temporario, 'w', encoding='utf-8') as arquivo:
+        json.dump(dados, arquivo)
+        arquivo.flush()
+        os.fsync(arquivo.fileno())
+    os.replace(temporario, caminho)
+
+
+def executar(saida: str, checkpoint: str, desde: Optional[date] = None, ate: Optional[date] = None) -> Dict[str, Any]:
+    """
+    Executa o job de métricas da plataforma
+
+    Args:
+        saida: Arquivo JSON Lines de saída (aberto em modo append)
+        checkpoint: Arquivo com o último dia concluído e o tamanho da saída
+        desde: Primeiro dia a processar quando não há checkpoint (padrão: ontem)
+        ate: Último dia a processar, inclusive (padrão: ontem)
+
+    Returns:
+        Dict com o resumo da execução
+    """
+    ontem = date.today() - timedelta(days=1)
+    ate = ate or ontem
+    estado = ler_checkpoint(checkpoint)
+
+    if estado:
+        # Retomar do dia seguinte ao último concluído, descartando linhas
+        # de um dia que tenha sido interrompido no meio
+        dia = date.fromisoformat(estado['ultimo_dia']) + timedelta(days=1)
+        if os.path.exists(saida):
+            with open(saida, 'r+b') as arquivo:
+                arquivo.truncate(estado['bytes_saida'])
+    else:
+        dia = desde or ontem
+
+    uso_planos = _em_todos_os_shards(calcular_uso_planos)
+    dias_processados = 0
+    linhas = 0
+
+    with open(saida, 'a', encoding='utf-8') as arquivo:
+        while dia <= ate:
+            for linha in gerar_linhas_dia(dia, uso_planos):
+                arquivo.write(json.dumps(linha, ensure_ascii=False) + '\n')
+                linhas += 1
+
+            arquivo.flush()
+            os.fsync(arquivo.fileno())
+            gravar_checkpoint(checkpoint, {
+                'ultimo_dia': dia.isoformat(),
+                'bytes_saida': arquivo.tell()
+            })
+
+            # Liberar objetos carregados entre um dia e outro
+            db.session.expunge_all()
+            dias_processados += 1
+            dia += timedelta(days=1)
+
+    return {
+        'dias_processados': dias_processados,
+        'linhas_gravadas': linhas,
+        'empresas': len(uso_planos),
+        'ultimo_dia': (dia - timedelta(days=1)).isoformat() if dias_processados else None
+    }
+
+
+@click.command('metricas-plataforma')
+@click.option('--saida', required=True, type=click.Path(dir_okay=False), help='Arquivo JSON Lines de saída')
+@click.option('--checkpoint', type=click.Path(dir_okay=False), help='Arquivo de checkpoint (padrão: <saida>.checkpoint)')
+@click.option('--desde', type=click.DateTime(formats=['%Y-%m-%d']), help='Primeiro dia quando não há checkpoint')
+@click.option('--ate', type=click.DateTime(formats=['%Y-%m-%d']), help='Último dia a processar (padrão: ontem)')
+@with_appcontext
+def metricas_plataforma_command(saida, checkpoint, desde, ate):
+    """Calcula as métricas diárias de todas as empresas"""
+    resumo = executar(
+        saida,
+        checkpoint or f"{saida}.checkpoint",
+        desde.date() if desde else None,
+        ate.date() if ate else None
+    )
+    click.echo(json.dumps(resumo, ensure_ascii=False))
@@ -0,0 +1,211 @@
+"""
+Worker da fila de notificações
+Reserva em lotes as notificações vencidas, envia e registra o resultado em massa;
+falhas voltam para a fila com backoff exponencial até o limite de tentativas
+"""
+
+import json
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Any, List
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import Boolean, bindparam, case, func, literal, select, update
+
+from ..models.pagamento import Notificacao
+from ..models.shards import shard_router
+from ..models.user import db
+from ..services.notification_service import notification_service, seconds_after
+
+# Após MAX_TENTATIVAS envios com falha a notificação fica com status 'erro' (dead letter)
+MAX_TENTATIVAS = 5
+BACKOFF_BASE_SEGUNDOS = 30
+BACKOFF_MAXIMO_SEGUNDOS = 3600
+# Intervalo entre as recuperações de reservas abandonadas enquanto o worker roda
+RECUPERACAO_SEGUNDOS = 60
+
+
+def recuperar_reservas_expiradas(minutos: int = 10) -> int:
+    """Devolve para a fila notificações reservadas por um worker que parou no meio do lote"""
+    limite = datetime.now() - timedelta(minutes=minutos)
+    result = db.session.execute(
+        update(Notificacao).where(
+            Notificacao.status == 'processando',
+            Notificacao.atualizado_em < limite
+        ).values(status='pendente').execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+def reservar_lote(limite: int = 100) -> List[Dict[str, Any]]:
+    """
+    Reserva as notificações vencidas mais antigas em um único UPDATE ... RETURNING
+
+    A seleção usa o índice (status, enviar_em) e a troca para 'processando' impede
+    que outro worker reserve as mesmas linhas.
+    """
+    agora = datetime.now()
+    vencidas = select(Notificacao.id).where(
+        Notificacao.status == 'pendente',
+        Notificacao.enviar_em <= agora
+    ).order_by(Notificacao.enviar_em).limit(limite)
+
+    rows = db.session.execute(
+        update(Notificacao).where(Notificacao.id.in_(vencidas)).values(
+            status='processando',
+            atualizado_em=agora
+        ).returning(
+            Notificacao.id,
+            Notificacao.tipo,
+            Notificacao.canal,
+            Notificacao.destinatario,
+            Notificacao.assunto,
+            Notificacao.mensagem,
+            Notificacao.mensagem_html,
+            Notificacao.tentativas,
+            Notificacao.agendamento_id,
+            Notificacao.pagamento_id,
+            Notificacao.empresa_id
+        ).execution_options(synchronize_session=False)
+    ).mappings().all()
+    db.session.commit()
+
+    return [dict(row) for row in rows]
+
+
+def _atraso_backoff(tentativas):
+    """
+    Expressão SQL do atraso da próxima tentativa: base * 2^tentativas (limitado ao máximo),
+    com metade do valor sorteada por linha para espalhar as novas tentativas
+    """
+    atraso = func.min(BACKOFF_MAXIMO_SEGUNDOS, BACKOFF_BASE_SEGUNDOS * literal(1).bitwise_lshift(func.min(tentativas, 20)))
+    return atraso / 2 + func.abs(func.random()) % (atraso / 2 + 1)
+
+
+def registrar_resultados(notificacoes: List[Dict[str, Any]], resultados: List[Dict[str, Any]]) -> Dict[str, int]:
+    """
+    Registra o resultado do lote em um único UPDATE executado em massa por chave primária
+
+    Enviadas ficam como 'enviado'; falhas voltam para 'pendente' com enviar_em adiado
+    por backoff exponencial com jitter, ou vão para 'erro' ao atingir MAX_TENTATIVAS.
+    """
+    agora = datetime.now()
+    tabela = Notificacao.__table__
+    tentativas = func.coalesce(tabela.c.tentativas, 0) + 1
+    enviada = bindparam('b_enviada', type_=Boolean)
+    esgotada = tentativas >= MAX_TENTATIVAS
+
+    stmt = update(tabela).where(tabela.c.id == bindparam('b_id')).values(
+        status=case((enviada, 'enviado'), (esgotada, 'erro'), else_='pendente'),
+        tentativas=tentativas,
+        assunto=bindparam('b_assunto'),
+        mensagem=bindparam('b_mensagem'),
+        erro_detalhes=bindparam('b_erro'),
+        enviado_em=case((enviada, bindparam('b_agora')), else_=None),
+        enviar_em=case(
+            (enviada | esgotada, tabela.c.enviar_em),
+            else_=seconds_after(bindparam('b_agora'), _atraso_backoff(tabela.c.tentativas))
+        ),
+        atualizado_em=bindparam('b_agora')
+    )
+
+    parametros = []
+    resumo = {'enviadas': 0, 'reagendadas': 0, 'erros': 0}
+    for notificacao, resultado in zip(notificacoes, resultados):
+        sucesso = bool(resultado.get('success', False))
+        parametros.append({
+            'b_id': notificacao['id'],
+            'b_enviada': sucesso,
+            'b_assunto': notificacao['assunto'],
+            'b_mensagem': notificacao['mensagem'],
+            'b_erro': None if sucesso else resultado.get('error') or resultado.get('message'),
+            'b_agora': agora
+        })
+
+        if sucesso:
+            resumo['enviadas'] += 1
+        elif (notificacao['tentativas'] or 0) + 1 >= MAX_TENTATIVAS:
+            resumo['erros'] += 1
+        else:
+            resumo['reagendadas'] += 1
+
+    if parametros:
+        db.session.execute(stmt, parametros)
+        db.session.commit()
+
+    return resumo
+
+
+def processar_lote(limite: int = 100) -> Dict[str, Any]:
+    """Reserva, envia e registra um lote de notificações"""
+    notificacoes = reservar_lote(limite)
+    if not notificacoes:
+        return {'reservadas': 0, 'enviadas': 0, 'reagendadas': 0, 'erros': 0}
+
+    try:
+        notification_service.render_pending_messages(notificacoes)
+        resultados = notification_service.dispatch_batch(notificacoes)
+    except Exception as e:
+        # Falha inesperada no lote: as reservas voltam para a fila com backoff em vez de
+        # ficarem em 'processando'; linhas que sempre falham acabam em 'erro'
+        db.session.rollback()
+        resultados = [{'success': False, 'error': f'Falha ao processar o lote: {e}'}] * len(notificacoes)
+
+    resumo = registrar_resultados(notificacoes, resultados)
+    resumo['reservadas'] = len(notificacoes)
+    return resumo
+
+
+def executar_worker(limite: int = 100, intervalo: float = 5.0, uma_vez: bool = False):
+    """
+    Processa a fila continuamente, aguardando `intervalo` segundos quando ela está vazia
+
+    Com o banco particionado, cada passada processa um lote de cada shard. As reservas
+    abandonadas são devolvidas à fila a cada RECUPERACAO_SEGUNDOS, e um erro em um lote
+    ou shard é registrado sem interromper o worker.
+    """
+    recuperado_em = None
+
+    while True:
+        if recuperado_em is None or time.monotonic() - recuperado_em >= RECUPERACAO_SEGUNDOS:
+            for _ in shard_router.each():
+                try:
+                    recuperar_reservas_expiradas()
+                except Exception as e:
+                    db.session.rollback()
+                    click.echo(json.dumps({'erro': f'Falha ao recuperar reservas: {e}'}), err=True)
+            recuperado_em = time.monotonic()
+
+        resumo = {'reservadas': 0, 'enviadas': 0, 'reagendadas': 0, 'erros': 0}
+        cheios = 0
+        for shard in shard_router.each():
+            try:
+                lote = processar_lote(limite)
+            except Exception as e:
+                # Ex.: banco bloqueado ao reservar ou registrar; o worker segue para a próxima passada
+                db.session.rollback()
+                click.echo(json.dumps({'shard': shard, 'erro': str(e)}), err=True)
+                continue
+            for chave in resumo:
+                resumo[chave] += lote.get(chave, 0)
+            cheios += lote['reservadas'] >= limite
+
+        if resumo['reservadas']:
+            click.echo(json.dumps(resumo))
+
+        if uma_vez:
+            return resumo
+        if not cheios:
+            time.sleep(intervalo)
+
+
+@click.command('worker-notificacoes')
+@click.option('--lote', default=100, show_default=True, help='Quantidade de notificações reservadas por vez')
+@click.option('--intervalo', default=5.0, show_default=True, help='Segundos de espera quando a fila está vazia')
+@click.option('--uma-vez', is_flag=True, help='Processa um único lote e termina')
+@with_appcontext
+def worker_notificacoes_command(lote, intervalo, uma_vez):
+    """Envia as notificações pendentes da fila"""
+    executar_worker(lote, intervalo, uma_vez)
@@ -0,0 +1,144 @@
+"""
+Divisão do banco único em shards por empresa
+Copia cada empresa, com todas as linhas que dependem dela, para o arquivo
+shard_<empresa_id % N>.db; o banco de origem não é alterado. Depois de
+conferir o relatório, ative o particionamento com BANCO_SHARDS=N
+"""
+
+import json
+import os
+import sqlite3
+import time
+from typing import Dict, Any
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import create_engine
+
+from ..models.schema import criar_schema_shard, reconstruir_campos_indexados
+from ..models.shards import base_ids, shard_router
+from ..models.user import db
+
+# Derivada do JSON dos clientes: recalculada no shard em vez de copiada
+TABELAS_DERIVADAS = {'cliente_campos'}
+
+
+def filtros_por_tabela() -> Dict[str, str]:
+    """
+    Condição (sobre origem.<tabela>) que seleciona as linhas de um shard
+
+    Tabelas com empresa_id são filtradas por ela; as demais seguem a chave
+    estrangeira até uma tabela já resolvida. As que não chegam a uma empresa
+    (usuários, eventos de webhook) continuam só no banco principal.
+    """
+    filtros = {'empresas': 'id % :total = :shard'}
+    for tabela in db.metadata.sorted_tables:
+        if tabela.name in filtros:
+            continue
+        if 'empresa_id' in tabela.c:
+            filtros[tabela.name] = 'empresa_id % :total = :shard'
+            continue
+        for fk in tabela.foreign_keys:
+            pai = fk.column.table.name
+            if pai in filtros:
+                filtros[tabela.name] = (
+                    f'{fk.parent.name} IN (SELECT {fk.column.name} FROM origem.{pai} WHERE {filtros[pai]})'
+                )
+                break
+    return filtros
+
+
+def _colunas(conn: sqlite3.Connection, esquema: str, tabela: str):
+    return [row[1] for row in conn.execute(f'PRAGMA {esquema}.table_info({tabela})')]
+
+
+def dividir(origem: str, destino: str, total: int, substituir: bool = False) -> Dict[str, Any]:
+    """
+    Cria os N arquivos de shard a partir do banco único
+
+    Args:
+        origem: Arquivo SQLite atual
+        destino: Diretório dos shards
+        total: Quantidade de shards
+        substituir: Apaga arquivos de shard já existentes em vez de abortar
+
+    Returns:
+        Dict com as linhas copiadas por shard e tabela
+    """
+    inicio = time.monotonic()
+    filtros = filtros_por_tabela()
+    os.makedirs(destino, exist_ok=True)
+
+    caminhos = [os.path.join(destino, f'shard_{shard}.db') for shard in range(total)]
+    existentes = [caminho for caminho in caminhos if os.path.exists(caminho)]
+    if existentes and not substituir:
+        raise click.ClickException(f'Shards já existentes: {", ".join(existentes)} (use --substituir)')
+    if existentes:
+        shard_router.dispose()
+    for caminho in existentes:
+        for sufixo in ('', '-wal', '-shm'):
+            if os.path.exists(caminho + sufixo):
+                os.remove(caminho + sufixo)
+
+    relatorio = {
+        'origem': origem,
+        'shards': {},
+        'tabelas_globais': [t.name for t in db.metadata.sorted_tables if t.name not in filtros]
+    }
+
+    for shard, caminho in enumerate(caminhos):
+        engine = create_engine(f'sqlite:///{caminho}')
+        criar_schema_shard(engine, base_ids(shard))
+        engine.dispose()
+
+        copiadas = {}
+        conn = sqlite3.connect(caminho, isolation_level=None)
+        try:
+            conn.execute('ATTACH DATABASE ? AS origem', (origem,))
+            tabelas_origem = {row[0] for row in conn.execute("SELECT name FROM origem.sqlite_master WHERE type = 'table'")}
+
+            conn.execute('BEGIN')
+            for tabela in db.metadata.sorted_tables:
+                nome = tabela.name
+                if nome not in filtros or nome in TABELAS_DERIVADAS or nome not in tabelas_origem:
+                    continue
+                colunas_origem = set(_colunas(conn, 'origem', nome))
+                colunas = [c for c in _colunas(conn, 'main', nome) if c in colunas_origem]
+                lista = ', '.join(colunas)
+                cursor = conn.execute(
+                    f'INSERT INTO main.{nome} ({lista}) SELECT {lista} FROM origem.{nome} WHERE {filtros[nome]}',
+                    {'total': total, 'shard': shard}
+                )
+                copiadas[nome] = cursor.rowcount
+            conn.execute('COMMIT')
+            conn.execute('DETACH DATABASE origem')
+        finally:
+            conn.close()
+
+        engine = create_engine(f'sqlite:///{caminho}')
+        with engine.begin() as conexao:
+            reconstruir_campos_indexados(conexao)
+        engine.dispose()
+
+        relatorio['shards'][shard] = {'arquivo': caminho, 'linhas': copiadas}
+
+    relatorio['duracao_segundos'] = round(time.monotonic() - inicio, 2)
+    return relatorio
+
+
+@click.command('dividir-banco')
+@click.option('--shards', 'total', required=True, type=click.IntRange(min=1), help='Quantidade de arquivos de shard')
+@click.option('--origem', type=click.Path(exists=True, dir_okay=False), help='Banco único a dividir (padrão: o banco da aplicação)')
+@click.option('--destino', type=click.Path(file_okay=False), help='Diretório dos shards (padrão: BANCO_SHARDS_DIR)')
+@click.option('--substituir', is_flag=True, help='Recria os arquivos de shard já existentes')
+@click.option('--relatorio', type=click.Path(dir_okay=False), help='Arquivo JSON para gravar o relatório')
+@with_appcontext
+def dividir_banco_command(total, origem, destino, substituir, relatorio):
+    """Copia as empresas do banco único para N arquivos de shard"""
+    resultado = dividir(origem or db.engine.url.database, destino or shard_router.directory, total, substituir)
+
+    if relatorio:
+        with open(relatorio, 'w', encoding='utf-8') as arquivo:
+            json.dump(resultado, arquivo, ensure_ascii=False, indent=2)
+
+    click.echo(json.dumps(resultado, ensure_ascii=False))
@@ -0,0 +1,141 @@
+"""
+Job de normalização dos telefones de clientes
+Preenche em lotes o telefone_normalizado (E.164) dos cadastros existentes e
+relata os telefones inválidos e os clientes duplicados dentro de cada empresa
+"""
+
+import json
+import time
+from typing import Dict, Any
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import bindparam, tuple_, update
+
+from ..models.cliente import Cliente, normalizar_telefone
+from ..models.shards import shard_router
+from ..models.user import db
+
+
+def _ocupados(chaves) -> Dict[tuple, int]:
+    """Cliente que já tem cada (empresa_id, telefone_normalizado), em uma consulta"""
+    if not chaves:
+        return {}
+
+    rows = db.session.query(
+        Cliente.empresa_id, Cliente.telefone_normalizado, Cliente.id
+    ).filter(
+        tuple_(Cliente.empresa_id, Cliente.telefone_normalizado).in_(list(chaves))
+    )
+    return {(row.empresa_id, row.telefone_normalizado): row.id for row in rows}
+
+
+def executar(lote: int = 1000) -> Dict[str, Any]:
+    """
+    Normaliza os telefones ainda não migrados
+
+    Um telefone que já pertence a outro cliente da mesma empresa não é gravado
+    (o índice único não permitiria): o cliente entra no relatório de duplicados,
+    junto com o cadastro mantido, para a empresa decidir qual manter.
+
+    Args:
+        lote: Quantidade de clientes lidos e gravados por vez
+
+    Returns:
+        Dict com o relatório da execução
+    """
+    inicio = time.monotonic()
+    relatorio = {'analisados': 0, 'normalizados': 0, 'invalidos': [], 'duplicados': []}
+    duplicados = {}  # (empresa_id, telefone_normalizado) -> grupo do relatório
+
+    tabela = Cliente.__table__
+    stmt = update(tabela).where(tabela.c.id == bindparam('b_id')).values(
+        telefone_normalizado=bindparam('b_telefone')
+    )
+
+    ultimo_id = 0
+    while True:
+        clientes = db.session.query(
+            Cliente.id, Cliente.empresa_id, Cliente.telefone
+        ).filter(
+            Cliente.telefone_normalizado.is_(None),
+            Cliente.id > ultimo_id
+        ).order_by(Cliente.id).limit(lote).all()
+
+        if not clientes:
+            break
+        ultimo_id = clientes[-1].id
+        relatorio['analisados'] += len(clientes)
+
+        normalizados = []
+        for cliente in clientes:
+            telefone = normalizar_telefone(cliente.telefone)
+            if telefone:
+                normalizados.append((cliente, (cliente.empresa_id, telefone)))
+            else:
+                relatorio['invalidos'].append({
+                    'cliente_id': cliente.id,
+                    'empresa_id': cliente.empresa_id,
+                    'telefone': cliente.telefone
+                })
+
+        ocupados = _ocupados({chave for _, chave in normalizados})
+        alteracoes = []
+        for cliente, chave in normalizados:
+            mantido = ocupados.get(chave)
+            if mantido is None:
+                ocupados[chave] = cliente.id
+                alteracoes.append({'b_id': cliente.id, 'b_telefone': chave[1]})
+                continue
+
+            grupo = duplicados.get(chave)
+            if grupo is None:
+                grupo = duplicados[chave] = {
+                    'empresa_id': chave[0],
+                    'telefone_normalizado': chave[1],
+                    'cliente_mantido': mantido,
+                    'clientes_duplicados': []
+                }
+                relatorio['duplicados'].append(grupo)
+            grupo['clientes_duplicados'].append(cliente.id)
+
+        if alteracoes:
+            db.session.execute(stmt, alteracoes)
+        db.session.commit()
+        relatorio['normalizados'] += len(alteracoes)
+
+    relatorio['duracao_segundos'] = round(time.monotonic() - inicio, 2)
+    return relatorio
+
+
+def executar_shards(lote: int = 1000) -> Dict[str, Any]:
+    """Normaliza os telefones em cada shard e junta os relatórios"""
+    relatorio = {'analisados': 0, 'normalizados': 0, 'invalidos': [], 'duplicados': [], 'duracao_segundos': 0}
+    for _ in shard_router.each():
+        parcial = executar(lote)
+        for chave in relatorio:
+            relatorio[chave] += parcial[chave]
+    relatorio['duracao_segundos'] = round(relatorio['duracao_segundos'], 2)
+    return relatorio
+
+
+@click.command('normalizar-telefones')
+@click.option('--lote', default=1000, show_default=True, help='Clientes lidos e gravados por vez')
+@click.option('--relatorio', type=click.Path(dir_okay=False), help='Arquivo JSON para gravar o relatório completo')
+@with_appcontext
+def normalizar_telefones_command(lote, relatorio):
+    """Preenche o telefone normalizado dos clientes e relata inválidos e duplicados"""
+    resultado = executar_shards(lote)
+
+    if relatorio:
+        with open(relatorio, 'w', encoding='utf-8') as arquivo:
+            json.dump(resultado, arquivo, ensure_ascii=False, indent=2)
+
+    click.echo(json.dumps({
+        'analisados': resultado['analisados'],
+        'normalizados': resultado['normalizados'],
+        'invalidos': len(resultado['invalidos']),
+        'grupos_duplicados': len(resultado['duplicados']),
+        'clientes_duplicados': sum(len(g['clientes_duplicados']) for g in resultado['duplicados']),
+        'duracao_segundos': resultado['duracao_segundos']
+    }, ensure_ascii=False))
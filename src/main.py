@@ -6,6 +6,8 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 from flask import Flask, send_from_directory
 from flask_cors import CORS
 from src.models.user import db
+from src.models.shards import base_ids, shard_router
+from src.services.bulk_delete import bulk_deleter
 from src.routes.user import user_bp
 from src.routes.empresa import empresa_bp
 from src.routes.cliente import cliente_bp
@@ -15,6 +17,13 @@ from src.routes.agendamento import agendamento_bp
 from src.routes.pagamento import pagamento_bp
 from src.routes.notificacao import notificacao_bp
 from src.routes.analytics import analytics_bp
+from src.jobs.metricas_plataforma import metricas_plataforma_command
+from src.jobs.notificacoes import worker_notificacoes_command
+from src.jobs.conciliacao_pagamentos import conciliar_pagamentos_command
+from src.jobs.telefones_clientes import normalizar_telefones_command
+from src.jobs.importacao_clientes import importar_clientes_command
+from src.jobs.shards import dividir_banco_command
+from src.jobs.exclusoes import worker_exclusoes_command
 
 app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
 app.config['SECRET_KEY'] = 'asdf#FGSgvasgf$5$WGT'
@@ -33,21 +42,49 @@ app.register_blueprint(pagamento_bp, url_prefix='/api')
 app.register_blueprint(notificacao_bp, url_prefix='/api')
 app.register_blueprint(analytics_bp, url_prefix='/api')
 
+# Registrar comandos de linha de comando (flask --app src.main <comando>)
+app.cli.add_command(metricas_plataforma_command)
+app.cli.add_command(worker_notificacoes_command)
+app.cli.add_command(conciliar_pagamentos_command)
+app.cli.add_command(normalizar_telefones_command)
+app.cli.add_command(importar_clientes_command)
+app.cli.add_command(dividir_banco_command)
+app.cli.add_command(worker_exclusoes_command)
+
 # uncomment if you need to use database
 app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(os.path.dirname(__file__), 'database', 'app.db')}"
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# Particionamento opcional por empresa: BANCO_SHARDS=N arquivos em BANCO_SHARDS_DIR
+# (divida um banco existente com `flask dividir-banco --shards N` antes de ativar)
+shard_router.configure(
+    int(os.environ.get('BANCO_SHARDS', 0)),
+    os.environ.get('BANCO_SHARDS_DIR', os.path.join(os.path.dirname(__file__), 'database', 'shards'))
+)
+app.before_request(shard_router.select_for_request)
+app.before_request(bulk_deleter.reject_writes)
+
 # Importar todos os modelos para garantir que as tabelas sejam criadas
 from src.models.empresa import Empresa
 from src.models.profissional import Profissional
 from src.models.cliente import Cliente
 from src.models.servico import Servico, ServicoProfissional
 from src.models.agendamento import Agendamento
-from src.models.pagamento import Pagamento, Notificacao
+from src.models.pagamento import Pagamento, Notificacao, WebhookEvento
+from src.models.modelo_notificacao import ModeloNotificacao
+from src.models.taxa_gateway import TaxaGateway
+from src.models.campo_indexado import CampoIndexado, ClienteCampo
+from src.models.exclusao import Exclusao
+
+from src.models.schema import atualizar_schema, criar_schema_shard, trava_schema
 
 db.init_app(app)
-with app.app_context():
+# Um processo por vez: os workers do gunicorn importam este módulo ao mesmo tempo
+with app.app_context(), trava_schema(os.path.join(os.path.dirname(__file__), 'database', 'schema.lock')):
     db.create_all()
+    atualizar_schema()
+    for shard in range(shard_router.total):
+        criar_schema_shard(shard_router.engine(shard), base_ids(shard))
 
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
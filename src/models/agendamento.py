@@ -34,6 +34,17 @@ class Agendamento(db.Model):
     confirmado_em = db.Column(db.DateTime, nullable=True)
     cancelado_em = db.Column(db.DateTime, nullable=True)
     
+    # Índices para filtros por intervalo de data (consultas de agenda e analytics);
+    # o índice de receita cobre as somas de valor_total sem acessar a tabela
+    __table_args__ = (
+        db.Index('ix_agendamentos_empresa_data_hora', 'empresa_id', 'data_hora'),
+        db.Index('ix_agendamentos_receita', 'empresa_id', 'status', 'data_hora', 'valor_total', 'valor_desconto'),
+        db.Index('ix_agendamentos_profissional_data_hora', 'profissional_id', 'data_hora'),
+        db.Index('ix_agendamentos_data_hora', 'data_hora'),
+        # Histórico do cliente: a página segue a ordem do índice e o resumo é agregado sem ler a tabela
+        db.Index('ix_agendamentos_cliente_data_hora', 'cliente_id', 'data_hora', 'status', 'valor_total'),
+    )
+    
     # Relacionamentos
     pagamentos = db.relationship('Pagamento', backref='agendamento', lazy=True, cascade='all, delete-orphan')
     notificacoes = db.relationship('Notificacao', backref='agendamento', lazy=True, cascade='all, delete-orphan')
@@ -0,0 +1,57 @@
+from datetime import datetime
+from src.models.user import db
+
+# Colunas JSON do cliente cujas chaves podem ser indexadas
+ORIGENS_CAMPO = ('campos_personalizados', 'preferencias')
+
+class CampoIndexado(db.Model):
+    """Chave de campos_personalizados ou preferencias que a empresa filtra com frequência"""
+    __tablename__ = 'campos_indexados'
+
+    id = db.Column(db.Integer, primary_key=True)
+    empresa_id = db.Column(db.Integer, db.ForeignKey('empresas.id'), nullable=False)
+    campo = db.Column(db.String(50), nullable=False)  # Chave no JSON, ex.: plano, alergia
+    origem = db.Column(db.String(30), nullable=False, default='campos_personalizados')
+
+    # Timestamps
+    criado_em = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('empresa_id', 'campo', name='uq_campos_indexados_empresa_campo'),
+    )
+
+    def __repr__(self):
+        return f'<CampoIndexado {self.empresa_id} - {self.campo}>'
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'empresa_id': self.empresa_id,
+            'campo': self.campo,
+            'origem': self.origem,
+            'criado_em': self.criado_em.isoformat() if self.criado_em else None
+        }
+
+class ClienteCampo(db.Model):
+    """
+    Valores dos campos indexados de cada cliente (uma linha por chave/valor)
+
+    Mantida pelos triggers criados em models/schema.py a partir do JSON do
+    cliente; não deve ser gravada pela aplicação.
+    """
+    __tablename__ = 'cliente_campos'
+
+    id = db.Column(db.Integer, primary_key=True)
+    cliente_id = db.Column(db.Integer, db.ForeignKey('clientes.id'), nullable=False)
+    empresa_id = db.Column(db.Integer, nullable=False)
+    campo = db.Column(db.String(50), nullable=False)
+    valor = db.Column(db.String(255), nullable=True)  # Texto em minúsculas; listas geram uma linha por item
+
+    # O filtro campo=valor é respondido só pelo índice, que já traz o cliente_id
+    __table_args__ = (
+        db.Index('ix_cliente_campos_busca', 'empresa_id', 'campo', 'valor', 'cliente_id'),
+        db.Index('ix_cliente_campos_cliente', 'cliente_id'),
+    )
+
+    def __repr__(self):
+        return f'<ClienteCampo {self.cliente_id} - {self.campo}={self.valor}>'
@@ -1,7 +1,34 @@
+import json
+import re
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
+from sqlalchemy import case, func
+from sqlalchemy.orm import validates
 from src.models.user import db
 
+
+def normalizar_telefone(telefone, ddi_padrao='55'):
+    """
+    Converte o telefone para E.164 (+5511999999999)
+
+    Números sem DDI recebem o do Brasil; o zero de discagem à frente do DDD é descartado.
+    Retorna None quando a quantidade de dígitos não forma um telefone válido.
+    """
+    if not telefone:
+        return None
+
+    digitos = re.sub(r'\D', '', telefone)
+    if telefone.strip().startswith('+'):
+        return f'+{digitos}' if 8 <= len(digitos) <= 15 else None
+
+    digitos = digitos.lstrip('0')
+    if len(digitos) in (10, 11):
+        return f'+{ddi_padrao}{digitos}'
+    if len(digitos) in (12, 13) and digitos.startswith(ddi_padrao):
+        return f'+{digitos}'
+    return None
+
+
 class Cliente(db.Model):
     __tablename__ = 'clientes'
     
@@ -9,6 +36,7 @@ class Cliente(db.Model):
     nome = db.Column(db.String(100), nullable=False)
     email = db.Column(db.String(120), nullable=True)
     telefone = db.Column(db.String(20), nullable=False)
+    telefone_normalizado = db.Column(db.String(16), nullable=True)  # E.164, calculado ao gravar o telefone
     cpf = db.Column(db.String(14), nullable=True)
     data_nascimento = db.Column(db.Date, nullable=True)
     endereco = db.Column(db.Text, nullable=True)
@@ -31,9 +59,28 @@ class Cliente(db.Model):
     atualizado_em = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     ultimo_atendimento = db.Column(db.DateTime, nullable=True)
     
+    # Índices para contagem de novos clientes por período (por empresa e da plataforma)
+    __table_args__ = (
+        db.Index('ix_clientes_empresa_criado_em', 'empresa_id', 'criado_em'),
+        db.Index('ix_clientes_criado_em', 'criado_em'),
+        db.Index('ux_clientes_empresa_telefone_normalizado', 'empresa_id', 'telefone_normalizado', unique=True),
+    )
+    
     # Relacionamentos
     agendamentos = db.relationship('Agendamento', backref='cliente', lazy=True)
 
+    @validates('campos_personalizados', 'preferencias')
+    def _serializar_json(self, key, valor):
+        # Aceita o objeto enviado na API; a coluna guarda o texto JSON lido pelos campos indexados
+        if isinstance(valor, (dict, list)):
+            return json.dumps(valor, ensure_ascii=False)
+        return valor
+
+    @validates('telefone')
+    def _normalizar_telefone(self, key, telefone):
+        self.telefone_normalizado = normalizar_telefone(telefone)
+        return telefone
+
     def __repr__(self):
         return f'<Cliente {self.nome}>'
 
@@ -43,6 +90,7 @@ class Cliente(db.Model):
             'nome': self.nome,
             'email': self.email,
             'telefone': self.telefone,
+            'telefone_normalizado': self.telefone_normalizado,
             'cpf': self.cpf,
             'data_nascimento': self.data_nascimento.isoformat() if self.data_nascimento else None,
             'endereco': self.endereco,
@@ -56,7 +104,88 @@ class Cliente(db.Model):
             'ultimo_atendimento': self.ultimo_atendimento.isoformat() if self.ultimo_atendimento else None
         }
 
-    def get_historico_agendamentos(self):
-        """Retorna o histórico de agendamentos do cliente"""
-        return [agendamento.to_dict() for agendamento in self.agendamentos]
+    def get_historico_agendamentos(self, page=1, per_page=20, status=None):
+        """
+        Retorna uma página do histórico de agendamentos do cliente, do mais recente ao mais antigo
+
+        Lê pelo índice (cliente_id, data_hora) e traz apenas os nomes do profissional
+        e do serviço, em vez dos objetos relacionados completos.
+        """
+        from src.models.agendamento import Agendamento
+        from src.models.profissional import Profissional
+        from src.models.servico import Servico
+
+        query = db.session.query(
+            Agendamento.id,
+            Agendamento.data_hora,
+            Agendamento.data_fim,
+            Agendamento.status,
+            Agendamento.valor_servico,
+            Agendamento.valor_desconto,
+            Agendamento.valor_total,
+            Agendamento.observacoes_cliente,
+            Agendamento.profissional_id,
+            Profissional.nome.label('profissional_nome'),
+            Agendamento.servico_id,
+            Servico.nome.label('servico_nome')
+        ).join(
+            Profissional, Profissional.id == Agendamento.profissional_id
+        ).join(
+            Servico, Servico.id == Agendamento.servico_id
+        ).filter(Agendamento.cliente_id == self.id)
+
+        if status:
+            query = query.filter(Agendamento.status == status)
+
+        rows = query.order_by(
+            Agendamento.data_hora.desc(), Agendamento.id.desc()
+        ).limit(per_page).offset((page - 1) * per_page)
+
+        return [{
+            'id': row.id,
+            'data_hora': row.data_hora.isoformat() if row.data_hora else None,
+            'data_fim': row.data_fim.isoformat() if row.data_fim else None,
+            'status': row.status,
+            'valor_servico': float(row.valor_servico) if row.valor_servico else 0.0,
+            'valor_desconto': float(row.valor_desconto) if row.valor_desconto else 0.0,
+            'valor_total': float(row.valor_total) if row.valor_total else 0.0,
+            'observacoes_cliente': row.observacoes_cliente,
+            'profissional_id': row.profissional_id,
+            'profissional_nome': row.profissional_nome,
+            'servico_id': row.servico_id,
+            'servico_nome': row.servico_nome
+        } for row in rows]
+
+    def get_resumo_agendamentos(self):
+        """Totais do histórico do cliente em uma única agregação, coberta pelo índice (cliente_id, data_hora)"""
+        from src.models.agendamento import Agendamento
+
+        realizado = Agendamento.status.in_(['confirmado', 'concluido'])
+        rows = db.session.query(
+            Agendamento.status,
+            func.count().label('total'),
+            func.sum(case((realizado, Agendamento.valor_total), else_=0)).label('valor_gasto'),
+            func.min(Agendamento.data_hora).label('primeiro'),
+            func.max(case((realizado, Agendamento.data_hora), else_=None)).label('ultimo_realizado')
+        ).filter(
+            Agendamento.cliente_id == self.id
+        ).group_by(Agendamento.status).all()
+
+        por_status = {row.status: row.total for row in rows}
+        realizados = sum(por_status.get(status, 0) for status in ('confirmado', 'concluido'))
+        valor_gasto = float(sum(row.valor_gasto or 0 for row in rows))
+        primeiros = [row.primeiro for row in rows if row.primeiro]
+        ultimos = [row.ultimo_realizado for row in rows if row.ultimo_realizado]
+
+        return {
+            'total_agendamentos': sum(por_status.values()),
+            'por_status': por_status,
+            'agendamentos_realizados': realizados,
+            'cancelamentos': por_status.get('cancelado', 0),
+            'faltas': por_status.get('nao_compareceu', 0),
+            'valor_gasto': round(valor_gasto, 2),
+            'ticket_medio': round(valor_gasto / realizados, 2) if realizados else 0.0,
+            'primeiro_agendamento': min(primeiros).isoformat() if primeiros else None,
+            'ultimo_atendimento': max(ultimos).isoformat() if ultimos else None
+        }
 
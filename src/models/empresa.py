@@ -30,10 +30,18 @@ class Empresa(db.Model):
     email_ativo = db.Column(db.Boolean, default=True)
     whatsapp_token = db.Column(db.String(255), nullable=True)
     
+    # Recebimento via PIX (o nome da empresa e a cidade entram no BR Code)
+    chave_pix = db.Column(db.String(77), nullable=True)
+    cidade = db.Column(db.String(60), nullable=True)
+    
     # Timestamps
     criado_em = db.Column(db.DateTime, default=datetime.utcnow)
     atualizado_em = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # Incrementada pelo SQLAlchemy a cada alteração; invalida o cache de configurações
+    versao = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    __mapper_args__ = {'version_id_col': versao}
+    
     # Relacionamentos
     profissionais = db.relationship('Profissional', backref='empresa', lazy=True, cascade='all, delete-orphan')
     servicos = db.relationship('Servico', backref='empresa', lazy=True, cascade='all, delete-orphan')
@@ -60,7 +68,30 @@ class Empresa(db.Model):
             'plano': self.plano,
             'whatsapp_ativo': self.whatsapp_ativo,
             'email_ativo': self.email_ativo,
+            'chave_pix': self.chave_pix,
+            'cidade': self.cidade,
+            'versao': self.versao,
             'criado_em': self.criado_em.isoformat() if self.criado_em else None,
             'atualizado_em': self.atualizado_em.isoformat() if self.atualizado_em else None
         }
 
+    def get_configuracoes(self):
+        """Configurações de estilo e funcionamento usadas pelas páginas de agendamento"""
+        return {
+            'estilo': {
+                'cor_primaria': self.cor_primaria,
+                'cor_secundaria': self.cor_secundaria,
+                'cor_acento': self.cor_acento,
+                'logo_url': self.logo_url
+            },
+            'funcionamento': {
+                'horario_abertura': self.horario_abertura.strftime('%H:%M') if self.horario_abertura else None,
+                'horario_fechamento': self.horario_fechamento.strftime('%H:%M') if self.horario_fechamento else None,
+                'dias_funcionamento': self.dias_funcionamento
+            },
+            'notificacoes': {
+                'whatsapp_ativo': self.whatsapp_ativo,
+                'email_ativo': self.email_ativo
+            },
+            'plano': self.plano
+        }
@@ -0,0 +1,65 @@
+import json
+from datetime import datetime
+from src.models.user import db
+
+# Entidades cuja exclusão é feita em segundo plano, com tudo o que depende delas
+ENTIDADES_EXCLUSAO = ('empresa', 'cliente', 'profissional')
+
+class Exclusao(db.Model):
+    """
+    Exclusão em massa de uma empresa, cliente ou profissional, executada pelo worker-exclusoes
+
+    empresa_id não é chave estrangeira: o registro continua disponível para
+    consulta do progresso depois que a empresa foi apagada.
+    """
+    __tablename__ = 'exclusoes'
+
+    id = db.Column(db.Integer, primary_key=True)
+    entidade = db.Column(db.String(20), nullable=False)  # empresa, cliente, profissional
+    entidade_id = db.Column(db.Integer, nullable=False)
+    empresa_id = db.Column(db.Integer, nullable=True)
+
+    # Status
+    status = db.Column(db.String(20), default='pendente')  # pendente, processando, concluida, erro
+    etapa = db.Column(db.String(50), nullable=True)  # Tabela sendo apagada no momento
+    total_estimado = db.Column(db.Integer, default=0)
+    total_excluido = db.Column(db.Integer, default=0)
+    progresso = db.Column(db.Text, nullable=True)  # JSON: [{tabela, estimado, excluido}] na ordem de exclusão
+    erro_detalhes = db.Column(db.Text, nullable=True)
+
+    # Timestamps
+    criado_em = db.Column(db.DateTime, default=datetime.utcnow)
+    iniciado_em = db.Column(db.DateTime, nullable=True)
+    concluido_em = db.Column(db.DateTime, nullable=True)
+    atualizado_em = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    # Reserva da próxima exclusão pelo worker e detecção de pedidos repetidos
+    __table_args__ = (
+        db.Index('ix_exclusoes_fila', 'status', 'criado_em'),
+        db.Index('ix_exclusoes_entidade', 'entidade', 'entidade_id', 'status'),
+    )
+
+    def __repr__(self):
+        return f'<Exclusao {self.entidade} {self.entidade_id} - {self.status}>'
+
+    def to_dict(self):
+        percentual = 100.0 if self.status == 'concluida' else (
+            round(min(self.total_excluido / self.total_estimado, 1) * 100, 1) if self.total_estimado else 0.0
+        )
+        return {
+            'id': self.id,
+            'entidade': self.entidade,
+            'entidade_id': self.entidade_id,
+            'empresa_id': self.empresa_id,
+            'status': self.status,
+            'etapa': self.etapa,
+            'total_estimado': self.total_estimado,
+            'total_excluido': self.total_excluido,
+            'percentual': percentual,
+            'progresso': json.loads(self.progresso) if self.progresso else [],
+            'erro_detalhes': self.erro_detalhes,
+            'criado_em': self.criado_em.isoformat() if self.criado_em else None,
+            'iniciado_em': self.iniciado_em.isoformat() if self.iniciado_em else None,
+            'concluido_em': self.concluido_em.isoformat() if self.concluido_em else None,
+            'atualizado_em': self.atualizado_em.isoformat() if self.atualizado_em else None
+        }
@@ -0,0 +1,37 @@
+from datetime import datetime
+from src.models.user import db
+
+class ModeloNotificacao(db.Model):
+    __tablename__ = 'modelos_notificacao'
+
+    id = db.Column(db.Integer, primary_key=True)
+    empresa_id = db.Column(db.Integer, db.ForeignKey('empresas.id'), nullable=False)
+    tipo = db.Column(db.String(50), nullable=False)  # confirmacao, lembrete, pagamento_aprovado, pagamento_problema
+    canal = db.Column(db.String(20), nullable=False)  # email, whatsapp
+
+    # Templates Jinja2 (o assunto só é usado no canal email)
+    assunto = db.Column(db.String(200), nullable=True)
+    corpo = db.Column(db.Text, nullable=False)
+
+    # Timestamps
+    criado_em = db.Column(db.DateTime, default=datetime.utcnow)
+    atualizado_em = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('empresa_id', 'tipo', 'canal', name='uq_modelos_notificacao_empresa_tipo_canal'),
+    )
+
+    def __repr__(self):
+        return f'<ModeloNotificacao {self.empresa_id} - {self.tipo}/{self.canal}>'
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'empresa_id': self.empresa_id,
+            'tipo': self.tipo,
+            'canal': self.canal,
+            'assunto': self.assunto,
+            'corpo': self.corpo,
+            'criado_em': self.criado_em.isoformat() if self.criado_em else None,
+            'atualizado_em': self.atualizado_em.isoformat() if self.atualizado_em else None
+        }
@@ -11,11 +11,12 @@ class Pagamento(db.Model):
     status = db.Column(db.String(20), default='pendente')  # pendente, aprovado, rejeitado, cancelado, estornado
     
     # IDs externos das integrações
-    transacao_id_externo = db.Column(db.String(100), nullable=True)
-    gateway = db.Column(db.String(20), nullable=True)  # mercado_pago, pagseguro, pix
+    transacao_id_externo = db.Column(db.String(100), nullable=True)  # payment_id retornado pelo gateway
+    gateway = db.Column(db.String(20), nullable=True)  # mercadopago, pagseguro, pix
     
     # Dados do pagamento
     dados_pagamento = db.Column(db.Text, nullable=True)  # JSON com dados específicos do gateway
+    dados_gateway = db.Column(db.JSON, nullable=True)  # Respostas do gateway (criação, consultas e webhooks)
     
     # Relacionamento
     agendamento_id = db.Column(db.Integer, db.ForeignKey('agendamentos.id'), nullable=False)
@@ -24,6 +25,13 @@ class Pagamento(db.Model):
     criado_em = db.Column(db.DateTime, default=datetime.utcnow)
     processado_em = db.Column(db.DateTime, nullable=True)
     atualizado_em = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_pagamentos_criado_em', 'criado_em'),
+        db.Index('ix_pagamentos_transacao_id_externo', 'transacao_id_externo', unique=True),
+        db.Index('ix_pagamentos_status', 'status'),
+        db.Index('ix_pagamentos_agendamento', 'agendamento_id'),  # exclusão dos pagamentos de um lote de agendamentos
+    )
 
     def __repr__(self):
         return f'<Pagamento {self.id} - {self.valor} - {self.status}>'
@@ -37,12 +45,43 @@ class Pagamento(db.Model):
             'transacao_id_externo': self.transacao_id_externo,
             'gateway': self.gateway,
             'dados_pagamento': self.dados_pagamento,
+            'dados_gateway': self.dados_gateway,
             'agendamento_id': self.agendamento_id,
             'criado_em': self.criado_em.isoformat() if self.criado_em else None,
             'processado_em': self.processado_em.isoformat() if self.processado_em else None,
             'atualizado_em': self.atualizado_em.isoformat() if self.atualizado_em else None
         }
 
+class WebhookEvento(db.Model):
+    __tablename__ = 'webhook_eventos'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    gateway = db.Column(db.String(20), nullable=False)
+    evento_id = db.Column(db.String(100), nullable=False)  # id do evento no gateway ou hash do corpo
+    transacao_id_externo = db.Column(db.String(100), nullable=True)
+    status = db.Column(db.String(20), nullable=True)
+    
+    # Timestamps
+    recebido_em = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Entregas repetidas do mesmo evento são descartadas pela chave única
+    __table_args__ = (
+        db.UniqueConstraint('gateway', 'evento_id', name='uq_webhook_eventos_gateway_evento'),
+    )
+
+    def __repr__(self):
+        return f'<WebhookEvento {self.gateway} - {self.evento_id}>'
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'gateway': self.gateway,
+            'evento_id': self.evento_id,
+            'transacao_id_externo': self.transacao_id_externo,
+            'status': self.status,
+            'recebido_em': self.recebido_em.isoformat() if self.recebido_em else None
+        }
+
 class Notificacao(db.Model):
     __tablename__ = 'notificacoes'
     
@@ -54,9 +93,11 @@ class Notificacao(db.Model):
     # Conteúdo da notificação
     assunto = db.Column(db.String(200), nullable=True)
     mensagem = db.Column(db.Text, nullable=False)
+    mensagem_html = db.Column(db.Text, nullable=True)  # Versão HTML de emails avulsos
+    hash_conteudo = db.Column(db.String(64), nullable=True)  # SHA-256 de empresa, canal, destinatário e conteúdo
     
     # Status
-    status = db.Column(db.String(20), default='pendente')  # pendente, enviado, erro, entregue
+    status = db.Column(db.String(20), default='pendente')  # pendente, processando, enviado, erro, entregue, agrupada, duplicada
     tentativas = db.Column(db.Integer, default=0)
     erro_detalhes = db.Column(db.Text, nullable=True)
     
@@ -64,12 +105,26 @@ class Notificacao(db.Model):
     enviar_em = db.Column(db.DateTime, nullable=False)
     
     # Relacionamento
-    agendamento_id = db.Column(db.Integer, db.ForeignKey('agendamentos.id'), nullable=False)
+    agendamento_id = db.Column(db.Integer, db.ForeignKey('agendamentos.id'), nullable=True)  # vazio em mensagens avulsas
+    empresa_id = db.Column(db.Integer, db.ForeignKey('empresas.id'), nullable=True)
+    pagamento_id = db.Column(db.Integer, db.ForeignKey('pagamentos.id'), nullable=True)  # notificações de pagamento
+    agrupada_em_id = db.Column(db.Integer, db.ForeignKey('notificacoes.id'), nullable=True)  # notificação que absorveu esta
     
     # Timestamps
     criado_em = db.Column(db.DateTime, default=datetime.utcnow)
     enviado_em = db.Column(db.DateTime, nullable=True)
     atualizado_em = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    # Índices usados pelo worker para reservar as notificações vencidas,
+    # pela geração de lembretes e avisos de pagamento para detectar os já existentes e pelo
+    # agrupamento de mensagens por destinatário
+    __table_args__ = (
+        db.Index('ix_notificacoes_fila', 'status', 'enviar_em'),
+        db.Index('ix_notificacoes_agendamento_tipo', 'agendamento_id', 'tipo', 'canal'),
+        db.Index('ix_notificacoes_pagamento_tipo', 'pagamento_id', 'tipo', 'canal'),
+        db.Index('ix_notificacoes_destinatario', 'empresa_id', 'canal', 'destinatario', 'status', 'enviar_em'),
+        db.Index('ix_notificacoes_hash_conteudo', 'hash_conteudo', 'criado_em'),
+    )
 
     def __repr__(self):
         return f'<Notificacao {self.id} - {self.tipo} - {self.status}>'
@@ -82,11 +137,16 @@ class Notificacao(db.Model):
             'destinatario': self.destinatario,
             'assunto': self.assunto,
             'mensagem': self.mensagem,
+            'mensagem_html': self.mensagem_html,
+            'hash_conteudo': self.hash_conteudo,
             'status': self.status,
             'tentativas': self.tentativas,
             'erro_detalhes': self.erro_detalhes,
             'enviar_em': self.enviar_em.isoformat() if self.enviar_em else None,
             'agendamento_id': self.agendamento_id,
+            'empresa_id': self.empresa_id,
+            'pagamento_id': self.pagamento_id,
+            'agrupada_em_id': self.agrupada_em_id,
             'criado_em': self.criado_em.isoformat() if self.criado_em else None,
             'enviado_em': self.enviado_em.isoformat() if self.enviado_em else None,
             'atualizado_em': self.atualizado_em.isoformat() if self.atualizado_em else None
@@ -0,0 +1,298 @@
+"""
+Atualização incremental do schema do banco de dados
+O db.create_all() só cria tabelas inexistentes; colunas e índices novos
+em tabelas já existentes são aplicados aqui, assim como os objetos que o
+SQLAlchemy não declara (índice de busca textual e seus triggers)
+"""
+
+import os
+from contextlib import contextmanager
+
+from sqlalchemy import Integer, MetaData, inspect, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.schema import CreateTable
+from src.models.user import db
+
+try:
+    import fcntl
+except ImportError:  # Windows: sem trava entre processos (um único servidor de desenvolvimento)
+    fcntl = None
+
+
+@contextmanager
+def trava_schema(caminho: str):
+    """
+    Trava exclusiva entre processos durante a atualização do schema
+
+    Cada worker do gunicorn importa src.main e atualiza o schema; sem a trava, dois
+    workers executariam o mesmo ALTER TABLE ou CREATE ao mesmo tempo e um deles
+    falharia. Com ela o primeiro aplica as mudanças e os demais não encontram nada a fazer.
+    """
+    if fcntl is None:
+        yield
+        return
+
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+    with open(caminho, 'a') as arquivo:
+        fcntl.flock(arquivo, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(arquivo, fcntl.LOCK_UN)
+
+
+def _somente_digitos(coluna: str) -> str:
+    """Expressão SQL que remove a formatação usual de um telefone"""
+    expr = f"coalesce({coluna}, '')"
+    for caractere in (' ', '-', '(', ')', '+', '.'):
+        expr = f"replace({expr}, '{caractere}', '')"
+    return expr
+
+
+def _telefone_busca(coluna: str) -> str:
+    """Número completo e os 9 e 8 últimos dígitos, para achar o telefone digitado sem DDI/DDD"""
+    digitos = _somente_digitos(coluna)
+    return f"{digitos} || ' ' || substr({digitos}, -9) || ' ' || substr({digitos}, -8)"
+
+
+def criar_busca_clientes(engine=None):
+    """
+    Cria o índice FTS5 clientes_fts (nome, email e telefone só com dígitos)
+    e os triggers que o mantêm sincronizado com a tabela clientes
+
+    A empresa entra no índice como o termo e<id>, para que a busca de uma empresa
+    pequena não percorra os resultados das demais. Os prefixos de 1 a 4 caracteres
+    são indexados, o que mantém rápida a busca enquanto o usuário digita.
+    Na primeira criação o índice é preenchido com os clientes existentes.
+    """
+    engine = engine or db.engine
+    if engine.dialect.name != 'sqlite':
+        return
+
+    with engine.begin() as conn:
+        existe = conn.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'clientes_fts'"
+        )).scalar()
+
+        if not existe:
+            conn.execute(text("""
+                CREATE VIRTUAL TABLE clientes_fts USING fts5(
+                    nome, email, telefone, empresa,
+                    tokenize = 'unicode61 remove_diacritics 2',
+                    prefix = '1 2 3 4'
+                )
+            """))
+            conn.execute(text(f"""
+                INSERT INTO clientes_fts (rowid, nome, email, telefone, empresa)
+                SELECT id, nome, email, {_telefone_busca('telefone')}, 'e' || empresa_id FROM clientes
+            """))
+
+        inserir = f"""
+            INSERT INTO clientes_fts (rowid, nome, email, telefone, empresa)
+            VALUES (new.id, new.nome, new.email, {_telefone_busca('new.telefone')}, 'e' || new.empresa_id);
+        """
+        conn.execute(text(f"""
+            CREATE TRIGGER IF NOT EXISTS clientes_fts_ai AFTER INSERT ON clientes BEGIN
+                {inserir}
+            END
+        """))
+        conn.execute(text(f"""
+            CREATE TRIGGER IF NOT EXISTS clientes_fts_au AFTER UPDATE OF nome, email, telefone, empresa_id ON clientes BEGIN
+                DELETE FROM clientes_fts WHERE rowid = old.id;
+                {inserir}
+            END
+        """))
+        conn.execute(text("""
+            CREATE TRIGGER IF NOT EXISTS clientes_fts_ad AFTER DELETE ON clientes BEGIN
+                DELETE FROM clientes_fts WHERE rowid = old.id;
+            END
+        """))
+
+
+def _valores_campos_indexados(cliente: str, tabela: str = '') -> str:
+    """
+    SELECT com as linhas de cliente_campos do cliente `cliente` (new nos triggers,
+    ou o apelido de `tabela` quando lido da própria tabela clientes)
+
+    Cada campo declarado em campos_indexados é lido do JSON de origem; listas
+    geram uma linha por item, objetos e nulos são ignorados e JSON inválido
+    não gera linhas (nem erro).
+    """
+    documento = f"CASE ci.origem WHEN 'preferencias' THEN {cliente}.preferencias ELSE {cliente}.campos_personalizados END"
+    return f"""
+        SELECT {cliente}.id, {cliente}.empresa_id, ci.campo,
+               CASE j.type WHEN 'true' THEN 'true' WHEN 'false' THEN 'false'
+                           ELSE lower(trim(CAST(j.value AS TEXT))) END
+        FROM {tabela}campos_indexados ci,
+             json_each(CASE WHEN json_valid({documento}) THEN {documento} ELSE '{{}}' END,
+                       '$."' || ci.campo || '"') j
+        WHERE ci.empresa_id = {cliente}.empresa_id
+          AND j.type NOT IN ('object', 'array', 'null')
+    """
+
+
+def criar_campos_indexados(engine=None):
+    """
+    Cria os triggers que mantêm cliente_campos em dia com o JSON dos clientes
+
+    Funcionam também para gravações que não passam pelo ORM (importação em massa).
+    """
+    engine = engine or db.engine
+    if engine.dialect.name != 'sqlite':
+        return
+
+    inserir = f"INSERT INTO cliente_campos (cliente_id, empresa_id, campo, valor) {_valores_campos_indexados('new')};"
+    with engine.begin() as conn:
+        conn.execute(text(f"""
+            CREATE TRIGGER IF NOT EXISTS clientes_campos_ai AFTER INSERT ON clientes BEGIN
+                {inserir}
+            END
+        """))
+        conn.execute(text(f"""
+            CREATE TRIGGER IF NOT EXISTS clientes_campos_au
+            AFTER UPDATE OF campos_personalizados, preferencias, empresa_id ON clientes BEGIN
+                DELETE FROM cliente_campos WHERE cliente_id = old.id;
+                {inserir}
+            END
+        """))
+        conn.execute(text("""
+            CREATE TRIGGER IF NOT EXISTS clientes_campos_ad AFTER DELETE ON clientes BEGIN
+                DELETE FROM cliente_campos WHERE cliente_id = old.id;
+            END
+        """))
+
+
+def preencher_campo_indexado(empresa_id: int, campo: str):
+    """Indexa um campo recém-declarado para os clientes já cadastrados da empresa (um INSERT ... SELECT)"""
+    db.session.execute(text(f"""
+        INSERT INTO cliente_campos (cliente_id, empresa_id, campo, valor)
+        {_valores_campos_indexados('c', 'clientes c, ')}
+          AND c.empresa_id = :empresa_id AND ci.campo = :campo
+    """), {'empresa_id': empresa_id, 'campo': campo})
+
+
+def reconstruir_campos_indexados(conn):
+    """Recalcula cliente_campos de todos os clientes (após copiar dados entre bancos)"""
+    conn.execute(text('DELETE FROM cliente_campos'))
+    conn.execute(text(f"""
+        INSERT INTO cliente_campos (cliente_id, empresa_id, campo, valor)
+        {_valores_campos_indexados('c', 'clientes c, ')}
+    """))
+
+
+def criar_schema_shard(engine, base_id: int):
+    """
+    Cria ou atualiza o schema de um arquivo de shard
+
+    As tabelas do shard usam AUTOINCREMENT e têm a sequência iniciada em base_id,
+    para que os ids criados nele não colidam com os de outros shards nem com os
+    ids antigos copiados do banco único.
+    """
+    metadata = MetaData()
+    for tabela in db.metadata.sorted_tables:
+        copia = tabela.to_metadata(metadata)
+        chave = list(copia.primary_key.columns)
+        if len(chave) == 1 and isinstance(chave[0].type, Integer):
+            copia.dialect_kwargs['sqlite_autoincrement'] = True
+    metadata.create_all(engine)
+    atualizar_schema(engine)
+
+    with engine.begin() as conn:
+        for tabela in metadata.sorted_tables:
+            if not tabela.dialect_kwargs.get('sqlite_autoincrement'):
+                continue
+            conn.execute(text(
+                "INSERT INTO sqlite_sequence (name, seq) SELECT :nome, :base "
+                "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = :nome)"
+            ), {'nome': tabela.name, 'base': base_id})
+            conn.execute(text(
+                'UPDATE sqlite_sequence SET seq = :base WHERE name = :nome AND seq < :base'
+            ), {'nome': tabela.name, 'base': base_id})
+
+
+def _recriar_tabela(conn, tabela):
+    """
+    Recria a tabela com o DDL atual do modelo, copiando as linhas
+
+    O SQLite não altera restrições de colunas existentes (ex.: NOT NULL que passou
+    a ser opcional). AUTOINCREMENT e a sequência dos shards são preservados; os
+    índices são recriados em seguida por atualizar_schema.
+    """
+    ddl_atual = conn.execute(text(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :nome"
+    ), {'nome': tabela.name}).scalar()
+    autoincremento = 'AUTOINCREMENT' in ddl_atual.upper()
+
+    metadata = MetaData()
+    for modelo in db.metadata.sorted_tables:
+        modelo.to_metadata(metadata)
+    copia = metadata.tables[tabela.name]
+    if autoincremento:
+        copia.dialect_kwargs['sqlite_autoincrement'] = True
+
+    nova = f'{tabela.name}__nova'
+    ddl = str(CreateTable(copia).compile(dialect=conn.dialect))
+    conn.execute(text(ddl.replace(f'CREATE TABLE {tabela.name} ', f'CREATE TABLE {nova} ', 1)))
+
+    colunas = ', '.join(c.name for c in tabela.columns)
+    conn.execute(text(f'INSERT INTO {nova} ({colunas}) SELECT {colunas} FROM {tabela.name}'))
+
+    sequencia = None
+    if autoincremento:
+        sequencia = conn.execute(text(
+            'SELECT seq FROM sqlite_sequence WHERE name = :nome'
+        ), {'nome': tabela.name}).scalar()
+    conn.execute(text(f'DROP TABLE {tabela.name}'))
+    conn.execute(text(f'ALTER TABLE {nova} RENAME TO {tabela.name}'))
+    if sequencia is not None:
+        conn.execute(text(
+            'UPDATE sqlite_sequence SET seq = :seq WHERE name = :nome AND seq < :seq'
+        ), {'nome': tabela.name, 'seq': sequencia})
+
+
+def atualizar_schema(engine=None):
+    """Adiciona colunas e índices declarados nos modelos que ainda não existem no banco"""
+    engine = engine or db.engine
+    inspector = inspect(engine)
+    tabelas_existentes = set(inspector.get_table_names())
+    
+    with engine.begin() as conn:
+        for tabela in db.metadata.sorted_tables:
+            if tabela.name not in tabelas_existentes:
+                continue
+            
+            colunas_banco = inspector.get_columns(tabela.name)
+            colunas_existentes = {c['name'] for c in colunas_banco}
+            obrigatorias = {c['name'] for c in colunas_banco if not c['nullable']}
+            for coluna in tabela.columns:
+                if coluna.name in colunas_existentes:
+                    continue
+                tipo = coluna.type.compile(dialect=engine.dialect)
+                ddl = f'ALTER TABLE {tabela.name} ADD COLUMN {coluna.name} {tipo}'
+                if coluna.server_default is not None:
+                    # Preenche as linhas existentes (ex.: versao das empresas)
+                    padrao = coluna.server_default.arg
+                    padrao = padrao.text if hasattr(padrao, 'text') else "'" + str(padrao).replace("'", "''") + "'"
+                    ddl += f' DEFAULT {padrao}'
+                conn.execute(text(ddl))
+            
+            # Colunas que passaram a aceitar nulo (ex.: notificacoes.agendamento_id)
+            if engine.dialect.name == 'sqlite' and any(
+                coluna.nullable and not coluna.primary_key and coluna.name in obrigatorias
+                for coluna in tabela.columns
+            ):
+                _recriar_tabela(conn, tabela)
+    
+    for tabela in db.metadata.sorted_tables:
+        for indice in tabela.indexes:
+            try:
+                indice.create(bind=engine, checkfirst=True)
+            except IntegrityError as e:
+                # Índice único sobre dados legados duplicados: a aplicação não sobe sem a garantia
+                raise RuntimeError(
+                    f'Não foi possível criar o índice único {indice.name}: {e.orig}. '
+                    f'Corrija as linhas duplicadas em {tabela.name} e reinicie.'
+                ) from e
+    
+    criar_busca_clientes(engine)
+    criar_campos_indexados(engine)
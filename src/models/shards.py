@@ -0,0 +1,201 @@
+"""
+Particionamento opcional dos dados das empresas em vários arquivos SQLite
+Com BANCO_SHARDS=N, cada empresa e todos os seus dados ficam em um dos N
+arquivos database/shards/shard_<k>.db, cada um com o próprio bloqueio de escrita:
+uma empresa com muito movimento não trava as gravações das demais.
+
+A sessão do SQLAlchemy escolhe o arquivo pelo shard ativo (g.shard), definido
+antes de cada requisição a partir do empresa_id da URL ou da entidade
+referenciada (agendamento, cliente, profissional, serviço ou pagamento).
+Tabelas sem empresa (usuários) e requisições sem shard usam o banco principal.
+
+Os ids criados no shard k começam em (k + 1) << 40, de modo que o shard de uma
+linha nova sai do próprio id. Linhas que vieram da divisão de um banco único
+mantêm os ids originais e são localizadas procurando em todos os shards.
+"""
+
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from flask import g, has_app_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, text
+
+
+BITS_ID = 40
+
+# Parâmetros da rota, da query string e do corpo JSON que identificam a empresa, em ordem de preferência
+ROTEAMENTO = (
+    ('empresa_id', 'empresas'),
+    ('agendamento_id', 'agendamentos'),
+    ('cliente_id', 'clientes'),
+    ('profissional_id', 'profissionais'),
+    ('servico_id', 'servicos'),
+    ('pagamento_id', 'pagamentos'),
+    ('exclusao_id', 'exclusoes'),
+)
+
+
+def base_ids(shard: int) -> int:
+    """Maior id já "usado" em um shard novo: o primeiro id gravado nele é base_ids(shard) + 1"""
+    return (shard + 1) << BITS_ID
+
+
+class ShardRouter:
+    """Escolhe o arquivo de banco de cada empresa e mantém os engines dos shards"""
+
+    def __init__(self, max_cached: int = 10000):
+        self.total = 0
+        self.directory = None
+        self.max_cached = max_cached
+        self._engines = {}
+        self._localizados = OrderedDict()  # (tabela, coluna, valor) -> shard das linhas antigas
+        self._lock = threading.Lock()
+
+    def configure(self, total: int, directory: str):
+        self.total = total
+        self.directory = directory
+        if total:
+            os.makedirs(directory, exist_ok=True)
+
+    @property
+    def enabled(self) -> bool:
+        return self.total > 0
+
+    def path(self, shard: int) -> str:
+        return os.path.join(self.directory, f'shard_{shard}.db')
+
+    def engine(self, shard: int):
+        engine = self._engines.get(shard)
+        if engine is None:
+            with self._lock:
+                engine = self._engines.get(shard)
+                if engine is None:
+                    engine = self._engines[shard] = create_engine(f'sqlite:///{self.path(shard)}')
+        return engine
+
+    def dispose(self):
+        """Fecha as conexões dos shards e esquece as linhas localizadas (ex.: antes de recriar os arquivos)"""
+        with self._lock:
+            for engine in self._engines.values():
+                engine.dispose()
+            self._engines.clear()
+            self._localizados.clear()
+
+    def shard_for_empresa(self, empresa_id: int) -> int:
+        """Empresas criadas nos shards trazem o shard no id; as antigas ficam em empresa_id % N"""
+        if empresa_id >= 1 << BITS_ID:
+            return (empresa_id >> BITS_ID) - 1
+        return empresa_id % self.total
+
+    def shard_for_new_empresa(self, chave: str) -> int:
+        """Shard de uma empresa nova, distribuído pelo hash da chave (email)"""
+        return zlib.crc32(chave.strip().lower().encode('utf-8')) % self.total
+
+    def locate(self, tabela: str, valor, coluna: str = 'id') -> Optional[int]:
+        """
+        Shard que contém a linha, ou None se ela não existir em nenhum
+
+        Ids criados nos shards são decodificados sem consulta; os demais são
+        procurados em todos os shards (uma consulta por chave, por arquivo) e memorizados.
+        """
+        if coluna == 'id':
+            if tabela == 'empresas':
+                return self.shard_for_empresa(valor)
+            if valor >= 1 << BITS_ID:
+                return (valor >> BITS_ID) - 1
+
+        chave = (tabela, coluna, valor)
+        with self._lock:
+            if chave in self._localizados:
+                self._localizados.move_to_end(chave)
+                return self._localizados[chave]
+
+        for shard in range(self.total):
+            with self.engine(shard).connect() as conn:
+                encontrado = conn.execute(
+                    text(f'SELECT 1 FROM {tabela} WHERE {coluna} = :valor LIMIT 1'), {'valor': valor}
+                ).first()
+            if encontrado:
+                with self._lock:
+                    self._localizados[chave] = shard
+                    while len(self._localizados) > self.max_cached:
+                        self._localizados.popitem(last=False)
+                return shard
+        return None
+
+    @property
+    def current(self) -> Optional[int]:
+        return g.get('shard') if has_app_context() else None
+
+    def activate(self, shard: Optional[int]):
+        """Define o shard usado pela sessão até o fim do contexto da aplicação"""
+        g.shard = shard
+
+    @contextmanager
+    def use(self, shard: Optional[int]):
+        anterior = g.get('shard')
+        g.shard = shard
+        try:
+            yield shard
+        finally:
+            g.shard = anterior
+
+    def each(self) -> Iterator[Optional[int]]:
+        """
+        Percorre os shards, deixando cada um ativo durante sua iteração
+
+        Sem particionamento, há uma única iteração (None) no banco principal.
+        Usado pelos jobs e consultas administrativas que cruzam empresas.
+        """
+        if not self.enabled:
+            yield None
+            return
+        for shard in range(self.total):
+            with self.use(shard):
+                yield shard
+
+    def select_for_request(self):
+        """before_request: ativa o shard da empresa da URL (rota ou query string), do corpo ou da entidade referenciada"""
+        if not self.enabled:
+            return
+
+        corpo = request.get_json(silent=True) if request.is_json else None
+        referenciada = False
+        for origem in (request.view_args or {}, request.args, corpo if isinstance(corpo, dict) else {}):
+            for parametro, tabela in ROTEAMENTO:
+                valor = origem.get(parametro)
+                if isinstance(valor, str) and valor.isdigit():
+                    valor = int(valor)
+                if not isinstance(valor, int) or isinstance(valor, bool):
+                    continue
+
+                referenciada = True
+                shard = self.locate(tabela, valor)
+                if shard is not None:
+                    self.activate(shard)
+                    return
+
+        # Entidade que não existe em nenhum shard: a consulta vai a um shard e não encontra
+        # nada, em vez de ler a cópia antiga que a divisão deixou no banco principal
+        if referenciada:
+            self.activate(0)
+
+
+class ShardedSession(Session):
+    """Sessão do Flask-SQLAlchemy que usa o engine do shard ativo, quando houver"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and shard_router.enabled:
+            shard = shard_router.current
+            if shard is not None:
+                return shard_router.engine(shard)
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+# Instância global do roteamento entre shards
+shard_router = ShardRouter()
@@ -0,0 +1,39 @@
+from datetime import datetime
+from src.models.user import db
+
+class TaxaGateway(db.Model):
+    __tablename__ = 'taxas_gateway'
+
+    id = db.Column(db.Integer, primary_key=True)
+    empresa_id = db.Column(db.Integer, db.ForeignKey('empresas.id'), nullable=False)
+    gateway = db.Column(db.String(50), nullable=False)  # pix, pagseguro, mercadopago
+
+    # Taxa = valor * (percentual + acrescimo_parcela * (parcelas - 1)) / 100 + fixo
+    percentual = db.Column(db.Numeric(7, 4), nullable=False, default=0)
+    fixo = db.Column(db.Numeric(10, 2), nullable=False, default=0)
+    acrescimo_parcela = db.Column(db.Numeric(7, 4), nullable=False, default=0)
+    parcelas_max = db.Column(db.Integer, nullable=False, default=1)
+
+    # Timestamps
+    criado_em = db.Column(db.DateTime, default=datetime.utcnow)
+    atualizado_em = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('empresa_id', 'gateway', name='uq_taxas_gateway_empresa_gateway'),
+    )
+
+    def __repr__(self):
+        return f'<TaxaGateway {self.empresa_id} - {self.gateway}>'
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'empresa_id': self.empresa_id,
+            'gateway': self.gateway,
+            'percentual': str(self.percentual),
+            'fixo': str(self.fixo),
+            'acrescimo_parcela': str(self.acrescimo_parcela),
+            'parcelas_max': self.parcelas_max,
+            'criado_em': self.criado_em.isoformat() if self.criado_em else None,
+            'atualizado_em': self.atualizado_em.isoformat() if self.atualizado_em else None
+        }
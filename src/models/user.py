@@ -1,6 +1,8 @@
 from flask_sqlalchemy import SQLAlchemy
+from src.models.shards import ShardedSession
 
-db = SQLAlchemy()
+# A sessão usa o arquivo do shard ativo quando o banco está particionado (models/shards.py)
+db = SQLAlchemy(session_options={'class_': ShardedSession})
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
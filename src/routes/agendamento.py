@@ -75,10 +75,14 @@ def criar_agendamento(empresa_id):
         cliente = Cliente.query.get(dados['cliente_id'])
         if not cliente or cliente.empresa_id != empresa_id:
             return jsonify({'erro': 'Cliente não encontrado'}), 404
+        if not cliente.ativo:
+            return jsonify({'erro': 'Cliente inativo'}), 400
         
         profissional = Profissional.query.get(dados['profissional_id'])
         if not profissional or profissional.empresa_id != empresa_id:
             return jsonify({'erro': 'Profissional não encontrado'}), 404
+        if not profissional.ativo:
+            return jsonify({'erro': 'Profissional inativo'}), 400
         
         servico = Servico.query.get(dados['servico_id'])
         if not servico or servico.empresa_id != empresa_id:
@@ -253,12 +257,12 @@ def agenda_hoje(empresa_id):
     try:
         hoje = datetime.now().date()
         inicio_dia = datetime.combine(hoje, datetime.min.time())
-        fim_dia = datetime.combine(hoje, datetime.max.time())
+        fim_dia = inicio_dia + timedelta(days=1)
         
         agendamentos = Agendamento.query.filter(
             Agendamento.empresa_id == empresa_id,
             Agendamento.data_hora >= inicio_dia,
-            Agendamento.data_hora <= fim_dia
+            Agendamento.data_hora < fim_dia
         ).order_by(Agendamento.data_hora).all()
         
         return jsonify({
@@ -1,26 +1,41 @@
 from flask import Blueprint, request, jsonify
+from sqlalchemy.exc import IntegrityError
 from src.models.user import db
-from src.models.cliente import Cliente
+from src.models.cliente import Cliente, normalizar_telefone
+from src.models.empresa import Empresa
+from src.services.bulk_delete import bulk_deleter
+from src.services.client_fields import client_fields
+from src.services.client_import import client_importer, ImportTooLargeError
+from src.services.client_search import client_search
 from datetime import datetime
 
 cliente_bp = Blueprint('cliente', __name__)
 
 @cliente_bp.route('/empresas/<int:empresa_id>/clientes', methods=['GET'])
 def listar_clientes(empresa_id):
-    """Lista todos os clientes de uma empresa"""
+    """Lista os clientes de uma empresa, com busca textual e filtros por campos indexados"""
     try:
         page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', 20, type=int)
         busca = request.args.get('busca', '')
+        # Filtros por campos indexados: ?campo.plano=gold&campo.alergia=sim
+        filtros = {
+            chave[len('campo.'):]: request.args.getlist(chave)
+            for chave in request.args if chave.startswith('campo.')
+        }
         
-        query = Cliente.query.filter_by(empresa_id=empresa_id)
-        
+        query = Cliente.query
         if busca:
-            query = query.filter(
-                (Cliente.nome.contains(busca)) |
-                (Cliente.telefone.contains(busca)) |
-                (Cliente.email.contains(busca))
-            )
+            # Índice de busca textual (prefixos de nome, email e telefone), já restrito à empresa
+            query = client_search.filter_query(query, empresa_id, busca)
+        if filtros:
+            # Índice de cliente_campos, também já restrito à empresa
+            try:
+                query = client_fields.filter_query(query, empresa_id, filtros)
+            except ValueError as e:
+                return jsonify({'erro': str(e)}), 400
+        if not busca and not filtros:
+            query = query.filter_by(empresa_id=empresa_id)
         
         clientes = query.paginate(
             page=page, 
@@ -51,10 +66,14 @@ def criar_cliente(empresa_id):
         if not dados.get('telefone'):
             return jsonify({'erro': 'Telefone do cliente é obrigatório'}), 400
         
-        # Verificar se telefone já existe na empresa
-        cliente_existente = Cliente.query.filter_by(
+        telefone_normalizado = normalizar_telefone(dados['telefone'])
+        if not telefone_normalizado:
+            return jsonify({'erro': 'Telefone inválido'}), 400
+        
+        # Verificar se telefone já existe na empresa (qualquer formatação do mesmo número)
+        cliente_existente = db.session.query(Cliente.id).filter_by(
             empresa_id=empresa_id,
-            telefone=dados['telefone']
+            telefone_normalizado=telefone_normalizado
         ).first()
         
         if cliente_existente:
@@ -79,6 +98,44 @@ def criar_cliente(empresa_id):
         
         return jsonify(novo_cliente.to_dict()), 201
         
+    except IntegrityError:
+        # Cadastro simultâneo do mesmo telefone barrado pelo índice único
+        db.session.rollback()
+        return jsonify({'erro': 'Cliente com este telefone já cadastrado'}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'erro': str(e)}), 500
+
+@cliente_bp.route('/empresas/<int:empresa_id>/clientes/importar', methods=['POST'])
+def importar_clientes(empresa_id):
+    """
+    Importa clientes de uma planilha CSV ou XLSX (campo de formulário 'arquivo')
+    
+    As linhas válidas são gravadas em lotes; o relatório informa a linha e o
+    motivo de cada rejeição (dados inválidos ou telefone já cadastrado).
+    Planilhas acima de CLIENTES_IMPORTACAO_MAX_LINHAS são recusadas com 413, sem
+    gravar nada, para não estourar o timeout do worker: elas vão pelo comando
+    flask importar-clientes.
+    """
+    try:
+        if not Empresa.query.get(empresa_id):
+            return jsonify({'erro': 'Empresa não encontrada'}), 404
+        
+        arquivo = request.files.get('arquivo')
+        if not arquivo or not arquivo.filename:
+            return jsonify({'erro': 'Envie a planilha no campo arquivo'}), 400
+        
+        try:
+            relatorio = client_importer.import_file(empresa_id, arquivo.stream, arquivo.filename)
+        except ImportTooLargeError as e:
+            db.session.rollback()
+            return jsonify({'erro': str(e)}), 413
+        except (ValueError, UnicodeDecodeError) as e:
+            db.session.rollback()
+            return jsonify({'erro': str(e)}), 400
+        
+        return jsonify(relatorio), 200
+        
     except Exception as e:
         db.session.rollback()
         return jsonify({'erro': str(e)}), 500
@@ -99,6 +156,19 @@ def atualizar_cliente(cliente_id):
         cliente = Cliente.query.get_or_404(cliente_id)
         dados = request.get_json()
         
+        if 'telefone' in dados:
+            telefone_normalizado = normalizar_telefone(dados['telefone'])
+            if not telefone_normalizado:
+                return jsonify({'erro': 'Telefone inválido'}), 400
+            
+            duplicado = db.session.query(Cliente.id).filter(
+                Cliente.empresa_id == cliente.empresa_id,
+                Cliente.telefone_normalizado == telefone_normalizado,
+                Cliente.id != cliente.id
+            ).first()
+            if duplicado:
+                return jsonify({'erro': 'Cliente com este telefone já cadastrado'}), 400
+        
         # Atualizar campos permitidos
         campos_permitidos = [
             'nome', 'email', 'telefone', 'cpf', 'endereco',
@@ -117,19 +187,81 @@ def atualizar_cliente(cliente_id):
         
         return jsonify(cliente.to_dict()), 200
         
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'erro': 'Cliente com este telefone já cadastrado'}), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({'erro': str(e)}), 500
 
 @cliente_bp.route('/clientes/<int:cliente_id>', methods=['DELETE'])
 def deletar_cliente(cliente_id):
-    """Deleta um cliente"""
+    """
+    Desativa o cliente e agenda a exclusão dele e do seu histórico de agendamentos
+
+    Clientes com pagamentos registrados são apenas desativados: os pagamentos são mantidos.
+    """
     try:
-        cliente = Cliente.query.get_or_404(cliente_id)
-        db.session.delete(cliente)
-        db.session.commit()
+        cliente = db.session.get(Cliente, cliente_id)
+        if not cliente:
+            return jsonify({'erro': 'Cliente não encontrado'}), 404
+        
+        if bulk_deleter.has_payments('cliente', cliente_id):
+            cliente.ativo = False
+            db.session.commit()
+            return jsonify({
+                'mensagem': 'Cliente desativado: possui pagamentos registrados, que são mantidos',
+                'cliente': cliente.to_dict()
+            }), 200
+        
+        exclusao = bulk_deleter.schedule('cliente', cliente_id)
         
-        return jsonify({'mensagem': 'Cliente deletado com sucesso'}), 200
+        return jsonify({'mensagem': 'Exclusão do cliente agendada', 'exclusao': exclusao.to_dict()}), 202
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'erro': str(e)}), 500
+
+@cliente_bp.route('/empresas/<int:empresa_id>/clientes/campos-indexados', methods=['GET'])
+def listar_campos_indexados(empresa_id):
+    """Lista os campos personalizados indexados (filtráveis na listagem de clientes)"""
+    try:
+        return jsonify([campo.to_dict() for campo in client_fields.indexed_fields(empresa_id)]), 200
+    except Exception as e:
+        return jsonify({'erro': str(e)}), 500
+
+@cliente_bp.route('/empresas/<int:empresa_id>/clientes/campos-indexados', methods=['POST'])
+def criar_campo_indexado(empresa_id):
+    """Indexa um campo de campos_personalizados ou preferencias, inclusive para os clientes existentes"""
+    try:
+        if not Empresa.query.get(empresa_id):
+            return jsonify({'erro': 'Empresa não encontrada'}), 404
+        
+        dados = request.get_json() or {}
+        try:
+            campo = client_fields.declare(
+                empresa_id,
+                dados.get('campo'),
+                dados.get('origem', 'campos_personalizados')
+            )
+        except ValueError as e:
+            db.session.rollback()
+            return jsonify({'erro': str(e)}), 400
+        
+        return jsonify(campo.to_dict()), 201
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'erro': str(e)}), 500
+
+@cliente_bp.route('/empresas/<int:empresa_id>/clientes/campos-indexados/<campo>', methods=['DELETE'])
+def remover_campo_indexado(empresa_id, campo):
+    """Deixa de indexar um campo personalizado"""
+    try:
+        if not client_fields.remove(empresa_id, campo):
+            return jsonify({'erro': 'Campo não indexado'}), 404
+        
+        return jsonify({'mensagem': 'Campo removido dos índices'}), 200
         
     except Exception as e:
         db.session.rollback()
@@ -137,14 +269,26 @@ def deletar_cliente(cliente_id):
 
 @cliente_bp.route('/clientes/<int:cliente_id>/historico', methods=['GET'])
 def obter_historico_cliente(cliente_id):
-    """Obtém o histórico de agendamentos do cliente"""
+    """Obtém o histórico de agendamentos do cliente, paginado, com o resumo dos totais"""
     try:
         cliente = Cliente.query.get_or_404(cliente_id)
-        historico = cliente.get_historico_agendamentos()
+        page = max(request.args.get('page', 1, type=int), 1)
+        per_page = min(max(request.args.get('per_page', 20, type=int), 1), 100)
+        status = request.args.get('status')
+        
+        resumo = cliente.get_resumo_agendamentos()
+        historico = cliente.get_historico_agendamentos(page=page, per_page=per_page, status=status)
+        
+        # O total da paginação sai do resumo, sem um COUNT separado
+        total = resumo['por_status'].get(status, 0) if status else resumo['total_agendamentos']
         
         return jsonify({
             'cliente': cliente.to_dict(),
-            'historico': historico
+            'resumo': resumo,
+            'historico': historico,
+            'total': total,
+            'pages': (total + per_page - 1) // per_page,
+            'current_page': page
         }), 200
         
     except Exception as e:
@@ -152,18 +296,15 @@ def obter_historico_cliente(cliente_id):
 
 @cliente_bp.route('/empresas/<int:empresa_id>/clientes/buscar', methods=['GET'])
 def buscar_clientes(empresa_id):
-    """Busca clientes por nome ou telefone"""
+    """Busca clientes por prefixo de nome, email ou telefone, em ordem de relevância"""
     try:
         termo = request.args.get('termo', '')
+        limite = min(max(request.args.get('limite', 10, type=int), 1), 50)
         
         if not termo:
             return jsonify({'clientes': []}), 200
         
-        clientes = Cliente.query.filter(
-            Cliente.empresa_id == empresa_id,
-            (Cliente.nome.contains(termo)) |
-            (Cliente.telefone.contains(termo))
-        ).limit(10).all()
+        clientes = client_search.search(empresa_id, termo, limite)
         
         return jsonify({
             'clientes': [cliente.to_dict() for cliente in clientes]
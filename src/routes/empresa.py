@@ -1,16 +1,30 @@
 from flask import Blueprint, request, jsonify
+from sqlalchemy.orm.exc import StaleDataError
 from src.models.user import db
 from src.models.empresa import Empresa
+from src.models.exclusao import Exclusao
+from src.models.shards import shard_router
+from src.services.bulk_delete import bulk_deleter
+from src.services.tenant_cache import tenant_cache
 from datetime import datetime
 
 empresa_bp = Blueprint('empresa', __name__)
 
+def _carregar_empresa(empresa_id):
+    """Leitura do banco usada pelo cache: (versão, dados da empresa e configurações)"""
+    empresa = db.session.get(Empresa, empresa_id)
+    if not empresa:
+        return None
+    return empresa.versao, {'empresa': empresa.to_dict(), 'configuracoes': empresa.get_configuracoes()}
+
 @empresa_bp.route('/empresas', methods=['GET'])
 def listar_empresas():
-    """Lista todas as empresas"""
+    """Lista todas as empresas (de todos os shards, quando o banco está particionado)"""
     try:
-        empresas = Empresa.query.all()
-        return jsonify([empresa.to_dict() for empresa in empresas]), 200
+        empresas = []
+        for _ in shard_router.each():
+            empresas.extend(empresa.to_dict() for empresa in Empresa.query.all())
+        return jsonify(empresas), 200
     except Exception as e:
         return jsonify({'erro': str(e)}), 500
 
@@ -27,10 +41,15 @@ def criar_empresa():
         if not dados.get('email'):
             return jsonify({'erro': 'Email da empresa é obrigatório'}), 400
         
-        # Verificar se email já existe
-        empresa_existente = Empresa.query.filter_by(email=dados['email']).first()
-        if empresa_existente:
-            return jsonify({'erro': 'Email já cadastrado'}), 400
+        # Verificar se email já existe (em qualquer shard)
+        for _ in shard_router.each():
+            if Empresa.query.filter_by(email=dados['email']).first():
+                return jsonify({'erro': 'Email já cadastrado'}), 400
+        
+        # Com o banco particionado, a empresa nova vai para o shard do hash do email
+        # e recebe um id da faixa dele
+        if shard_router.enabled:
+            shard_router.activate(shard_router.shard_for_new_empresa(dados['email']))
         
         # Criar nova empresa
         nova_empresa = Empresa(
@@ -44,7 +63,9 @@ def criar_empresa():
             cor_acento=dados.get('cor_acento', '#28A745'),
             plano=dados.get('plano', 'basico'),
             whatsapp_ativo=dados.get('whatsapp_ativo', False),
-            email_ativo=dados.get('email_ativo', True)
+            email_ativo=dados.get('email_ativo', True),
+            chave_pix=dados.get('chave_pix'),
+            cidade=dados.get('cidade')
         )
         
         db.session.add(nova_empresa)
@@ -60,8 +81,10 @@ def criar_empresa():
 def obter_empresa(empresa_id):
     """Obtém uma empresa específica"""
     try:
-        empresa = Empresa.query.get_or_404(empresa_id)
-        return jsonify(empresa.to_dict()), 200
+        dados = tenant_cache.get(empresa_id, _carregar_empresa)
+        if not dados:
+            return jsonify({'erro': 'Empresa não encontrada'}), 404
+        return jsonify(dados['empresa']), 200
     except Exception as e:
         return jsonify({'erro': str(e)}), 500
 
@@ -77,7 +100,8 @@ def atualizar_empresa(empresa_id):
             'nome', 'telefone', 'endereco', 'logo_url',
             'cor_primaria', 'cor_secundaria', 'cor_acento',
             'horario_abertura', 'horario_fechamento', 'dias_funcionamento',
-            'plano', 'whatsapp_ativo', 'email_ativo', 'whatsapp_token'
+            'plano', 'whatsapp_ativo', 'email_ativo', 'whatsapp_token',
+            'chave_pix', 'cidade'
         ]
         
         for campo in campos_permitidos:
@@ -86,54 +110,75 @@ def atualizar_empresa(empresa_id):
         
         empresa.atualizado_em = datetime.utcnow()
         db.session.commit()
+        tenant_cache.invalidate(empresa.id, empresa.versao)
         
         return jsonify(empresa.to_dict()), 200
         
+    except StaleDataError:
+        # Outra requisição alterou a empresa entre a leitura e o UPDATE (versao mudou)
+        db.session.rollback()
+        return jsonify({'erro': 'A empresa foi alterada por outra requisição; tente novamente'}), 409
     except Exception as e:
         db.session.rollback()
         return jsonify({'erro': str(e)}), 500
 
 @empresa_bp.route('/empresas/<int:empresa_id>', methods=['DELETE'])
 def deletar_empresa(empresa_id):
-    """Deleta uma empresa"""
+    """
+    Agenda a exclusão da empresa e de todos os seus dados, inclusive pagamentos (feita em lotes pelo worker-exclusoes)
+
+    Até a conclusão, gravações que alcançam a empresa são recusadas com 409.
+    """
     try:
-        empresa = Empresa.query.get_or_404(empresa_id)
-        db.session.delete(empresa)
-        db.session.commit()
+        exclusao = bulk_deleter.schedule('empresa', empresa_id)
+        if not exclusao:
+            return jsonify({'erro': 'Empresa não encontrada'}), 404
         
-        return jsonify({'mensagem': 'Empresa deletada com sucesso'}), 200
+        return jsonify({
+            'mensagem': 'Exclusão da empresa agendada: todos os dados, inclusive pagamentos, serão apagados',
+            'exclusao': exclusao.to_dict()
+        }), 202
         
     except Exception as e:
         db.session.rollback()
         return jsonify({'erro': str(e)}), 500
 
+@empresa_bp.route('/empresas/<int:empresa_id>/exclusoes', methods=['GET'])
+def listar_exclusoes_empresa(empresa_id):
+    """Lista as exclusões em massa da empresa (a própria empresa, clientes e profissionais)"""
+    try:
+        exclusoes = Exclusao.query.filter_by(empresa_id=empresa_id).order_by(Exclusao.criado_em.desc()).limit(50).all()
+        return jsonify([exclusao.to_dict() for exclusao in exclusoes]), 200
+    except Exception as e:
+        return jsonify({'erro': str(e)}), 500
+
+@empresa_bp.route('/exclusoes/<int:exclusao_id>', methods=['GET'])
+def obter_exclusao(exclusao_id):
+    """Progresso de uma exclusão em massa: etapa atual e linhas apagadas por tabela"""
+    try:
+        exclusao = Exclusao.query.get_or_404(exclusao_id)
+        return jsonify(exclusao.to_dict()), 200
+    except Exception as e:
+        return jsonify({'erro': str(e)}), 500
+
 @empresa_bp.route('/empresas/<int:empresa_id>/configuracoes', methods=['GET'])
 def obter_configuracoes_empresa(empresa_id):
-    """Obtém as configurações de estilo e funcionamento da empresa"""
+    """Obtém as configurações de estilo e funcionamento da empresa (do cache compartilhado)"""
     try:
-        empresa = Empresa.query.get_or_404(empresa_id)
+        dados = tenant_cache.get(empresa_id, _carregar_empresa)
+        if not dados:
+            return jsonify({'erro': 'Empresa não encontrada'}), 404
         
-        configuracoes = {
-            'estilo': {
-                'cor_primaria': empresa.cor_primaria,
-                'cor_secundaria': empresa.cor_secundaria,
-                'cor_acento': empresa.cor_acento,
-                'logo_url': empresa.logo_url
-            },
-            'funcionamento': {
-                'horario_abertura': empresa.horario_abertura.strftime('%H:%M') if empresa.horario_abertura else None,
-                'horario_fechamento': empresa.horario_fechamento.strftime('%H:%M') if empresa.horario_fechamento else None,
-                'dias_funcionamento': empresa.dias_funcionamento
-            },
-            'notificacoes': {
-                'whatsapp_ativo': empresa.whatsapp_ativo,
-                'email_ativo': empresa.email_ativo
-            },
-            'plano': empresa.plano
-        }
-        
-        return jsonify(configuracoes), 200
+        return jsonify(dados['configuracoes']), 200
         
     except Exception as e:
         return jsonify({'erro': str(e)}), 500
 
+@empresa_bp.route('/empresas/cache/estatisticas', methods=['GET'])
+def obter_estatisticas_cache_empresas():
+    """Taxa de acerto (somando todos os workers) e espaço ocupado pelo cache de configurações"""
+    try:
+        return jsonify(tenant_cache.stats()), 200
+    except Exception as e:
+        return jsonify({'erro': str(e)}), 500
+
@@ -1,11 +1,22 @@
 """
 Rotas para gerenciamento de notificações
+
+Confirmações, lembretes, avisos de pagamento e mensagens avulsas passam pela
+fila (notificacoes), enviada pelo worker-notificacoes. Só /notificacoes/teste
+envia na hora, pelo pool SMTP e pelo dispatcher de WhatsApp: serve para conferir
+a configuração do canal, então precisa devolver o resultado na própria resposta.
 """
 
 from flask import Blueprint, request, jsonify
 from ..models.agendamento import Agendamento
 from ..models.cliente import Cliente
+from ..models.empresa import Empresa
+from ..models.modelo_notificacao import ModeloNotificacao
+from ..models.pagamento import Notificacao
+from ..models.user import db
 from ..services.notification_service import notification_service
+from ..services.template_service import template_registry, TIPOS, CANAIS
+from jinja2 import TemplateSyntaxError
 from datetime import datetime, timedelta
 
 notificacao_bp = Blueprint('notificacao', __name__)
@@ -13,92 +24,92 @@ notificacao_bp = Blueprint('notificacao', __name__)
 
 @notificacao_bp.route('/notificacoes/agendamento/<int:agendamento_id>/confirmacao', methods=['POST'])
 def enviar_confirmacao_agendamento(agendamento_id):
-    """Envia confirmação de agendamento"""
+    """Enfileira a confirmação de agendamento para envio pelo worker"""
     try:
-        agendamento = Agendamento.query.get_or_404(agendamento_id)
+        agendamento_data = notification_service.load_appointment_data([agendamento_id]).get(agendamento_id)
+        if not agendamento_data:
+            return jsonify({'erro': 'Agendamento não encontrado'}), 404
         
-        # Preparar dados do agendamento
-        agendamento_data = {
-            'id': agendamento.id,
-            'data_hora': agendamento.data_hora.isoformat(),
-            'cliente': {
-                'nome': agendamento.cliente.nome,
-                'email': agendamento.cliente.email,
-                'telefone': agendamento.cliente.telefone
-            },
-            'profissional': {
-                'nome': agendamento.profissional.nome
-            },
-            'servico': {
-                'nome': agendamento.servico.nome,
-                'preco': float(agendamento.servico.preco)
-            },
-            'empresa': {
-                'nome': agendamento.empresa.nome,
-                'endereco': agendamento.empresa.endereco
-            }
-        }
-        
-        # Enviar notificações
-        result = notification_service.send_appointment_confirmation(agendamento_data)
+        notificacoes = notification_service.enqueue_appointment_confirmation(agendamento_data)
+        db.session.commit()
         
         return jsonify({
             'agendamento_id': agendamento_id,
-            'notifications_sent': result['notifications_sent'],
-            'total_sent': result['total_sent']
-        })
+            'notificacoes_enfileiradas': [n.id for n in notificacoes],
+            'total_enfileiradas': len(notificacoes)
+        }), 202
         
     except Exception as e:
+        db.session.rollback()
         return jsonify({'erro': str(e)}), 500
 
 
 @notificacao_bp.route('/notificacoes/agendamento/<int:agendamento_id>/lembrete', methods=['POST'])
 def enviar_lembrete_agendamento(agendamento_id):
-    """Envia lembrete de agendamento"""
+    """Enfileira um lembrete de agendamento para envio imediato"""
     try:
         data = request.get_json() or {}
         hours_before = data.get('hours_before', 24)
         
         agendamento = Agendamento.query.get_or_404(agendamento_id)
         
-        # Preparar dados do agendamento
-        agendamento_data = {
-            'id': agendamento.id,
-            'data_hora': agendamento.data_hora.isoformat(),
-            'cliente': {
-                'nome': agendamento.cliente.nome,
-                'email': agendamento.cliente.email,
-                'telefone': agendamento.cliente.telefone
-            },
-            'profissional': {
-                'nome': agendamento.profissional.nome
-            },
-            'servico': {
-                'nome': agendamento.servico.nome,
-                'preco': float(agendamento.servico.preco)
-            },
-            'empresa': {
-                'nome': agendamento.empresa.nome,
-                'endereco': agendamento.empresa.endereco
-            }
-        }
-        
-        # Enviar lembretes
-        result = notification_service.send_appointment_reminder(agendamento_data, hours_before)
+        # Enviar agora, identificando o lembrete pela antecedência informada
+        result = notification_service.schedule_reminder(
+            agendamento_id,
+            agendamento.data_hora - timedelta(hours=hours_before)
+        )
+        db.session.query(Notificacao).filter(Notificacao.id.in_(result['reminder_ids'])).update(
+            {'enviar_em': datetime.now()}, synchronize_session=False
+        )
+        db.session.commit()
         
         return jsonify({
             'agendamento_id': agendamento_id,
-            'notifications_sent': result['notifications_sent'],
-            'total_sent': result['total_sent']
-        })
+            'notificacoes_enfileiradas': result['reminder_ids'],
+            'total_enfileiradas': len(result['reminder_ids'])
+        }), 202
         
     except Exception as e:
+        db.session.rollback()
         return jsonify({'erro': str(e)}), 500
 
 
+def _enfileirar_personalizada(data, canal, destinatario, mensagem, assunto=None, mensagem_html=None):
+    """
+    Enfileira uma mensagem personalizada; o worker faz o envio e as novas tentativas
+
+    agendamento_id e empresa_id são opcionais no corpo. A empresa do agendamento
+    prevalece e define o token de WhatsApp usado no envio.
+    """
+    if not mensagem:
+        return jsonify({'erro': 'A mensagem não pode ser vazia'}), 400
+    
+    agendamento_id = data.get('agendamento_id')
+    empresa_id = data.get('empresa_id')
+    if agendamento_id:
+        agendamento = db.session.get(Agendamento, agendamento_id)
+        if not agendamento:
+            return jsonify({'erro': 'Agendamento não encontrado'}), 404
+        empresa_id = agendamento.empresa_id
+    elif empresa_id and not db.session.get(Empresa, empresa_id):
+        return jsonify({'erro': 'Empresa não encontrada'}), 404
+    
+    try:
+        notificacao = notification_service.enqueue(
+            'personalizada', canal, destinatario, mensagem, agendamento_id or None, empresa_id or None,
+            assunto, mensagem_html=mensagem_html
+        )
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    
+    return jsonify({'enfileirada': True, 'notificacao': notificacao.to_dict()}), 202
+
+
 @notificacao_bp.route('/notificacoes/email', methods=['POST'])
 def enviar_email():
-    """Envia email personalizado"""
+    """Enfileira email personalizado"""
     try:
         data = request.get_json()
         
@@ -108,22 +119,17 @@ def enviar_email():
             if field not in data:
                 return jsonify({'erro': f'Campo {field} é obrigatório'}), 400
         
-        result = notification_service.send_email(
-            data['to_email'],
-            data['subject'],
-            data['body'],
-            data.get('html_body')
+        return _enfileirar_personalizada(
+            data, 'email', data['to_email'], data['body'], data['subject'], data.get('html_body')
         )
         
-        return jsonify(result)
-        
     except Exception as e:
         return jsonify({'erro': str(e)}), 500
 
 
 @notificacao_bp.route('/notificacoes/whatsapp', methods=['POST'])
 def enviar_whatsapp():
-    """Envia mensagem WhatsApp personalizada"""
+    """Enfileira mensagem WhatsApp personalizada"""
     try:
         data = request.get_json()
         
@@ -133,12 +139,7 @@ def enviar_whatsapp():
             if field not in data:
                 return jsonify({'erro': f'Campo {field} é obrigatório'}), 400
         
-        result = notification_service.send_whatsapp(
-            data['phone'],
-            data['message']
-        )
-        
-        return jsonify(result)
+        return _enfileirar_personalizada(data, 'whatsapp', data['phone'], data['message'])
         
     except Exception as e:
         return jsonify({'erro': str(e)}), 500
@@ -164,10 +165,12 @@ def agendar_lembrete():
         
         # Agendar lembrete
         result = notification_service.schedule_reminder(agendamento_id, send_at)
+        db.session.commit()
         
         return jsonify(result)
         
     except Exception as e:
+        db.session.rollback()
         return jsonify({'erro': str(e)}), 500
 
 
@@ -182,40 +185,155 @@ def configurar_lembretes_automaticos():
         if not empresa_id:
             return jsonify({'erro': 'Campo empresa_id é obrigatório'}), 400
         
-        # Buscar agendamentos futuros da empresa
-        now = datetime.now()
-        agendamentos = Agendamento.query.filter(
-            Agendamento.empresa_id == empresa_id,
-            Agendamento.data_hora > now,
-            Agendamento.status.in_(['agendado', 'confirmado'])
-        ).all()
-        
-        lembretes_agendados = []
-        
-        for agendamento in agendamentos:
-            for hours_before in hours_before_list:
-                send_at = agendamento.data_hora - timedelta(hours=hours_before)
-                
-                # Só agendar se a data de envio for no futuro
-                if send_at > now:
-                    result = notification_service.schedule_reminder(agendamento.id, send_at)
-                    lembretes_agendados.append({
-                        'agendamento_id': agendamento.id,
-                        'cliente_nome': agendamento.cliente.nome,
-                        'data_agendamento': agendamento.data_hora.isoformat(),
-                        'send_at': send_at.isoformat(),
-                        'hours_before': hours_before,
-                        'reminder_id': result['reminder_id']
-                    })
+        try:
+            hours_before_list = sorted({int(h) for h in hours_before_list}, reverse=True)
+        except (TypeError, ValueError):
+            return jsonify({'erro': 'Campo hours_before deve ser uma lista de horas'}), 400
+        
+        # Gera os lembretes em massa (INSERT ... SELECT), sem carregar os agendamentos
+        resumo = notification_service.schedule_automatic_reminders(empresa_id, hours_before_list)
+        db.session.commit()
         
         return jsonify({
             'empresa_id': empresa_id,
-            'total_agendamentos': len(agendamentos),
-            'total_lembretes': len(lembretes_agendados),
-            'lembretes_agendados': lembretes_agendados
+            'total_agendamentos': resumo['total_agendamentos'],
+            'total_lembretes': resumo['total_lembretes'],
+            'lembretes_por_antecedencia': resumo['lembretes_por_antecedencia']
         })
         
     except Exception as e:
+        db.session.rollback()
+        return jsonify({'erro': str(e)}), 500
+
+
+@notificacao_bp.route('/notificacoes/metricas', methods=['GET'])
+def metricas_notificacoes():
+    """Métricas da fila de notificações, incluindo os envios evitados por agrupamento e duplicidade"""
+    try:
+        empresa_id = request.args.get('empresa_id', type=int)
+        dias = request.args.get('dias', 30, type=int)
+        
+        metricas = notification_service.get_queue_metrics(
+            empresa_id=empresa_id,
+            since=datetime.utcnow() - timedelta(days=dias)
+        )
+        metricas.update({'empresa_id': empresa_id, 'dias': dias})
+        
+        return jsonify(metricas)
+        
+    except Exception as e:
+        return jsonify({'erro': str(e)}), 500
+
+
+@notificacao_bp.route('/notificacoes/falhas/reenviar', methods=['POST'])
+def reenviar_notificacoes_com_falha():
+    """Devolve para a fila as notificações que esgotaram as tentativas de envio"""
+    try:
+        data = request.get_json() or {}
+        
+        try:
+            janela_segundos = int(data.get('janela_segundos', 300))
+        except (TypeError, ValueError):
+            return jsonify({'erro': 'Campo janela_segundos deve ser um número de segundos'}), 400
+        
+        total = notification_service.requeue_dead_letters(
+            empresa_id=data.get('empresa_id'),
+            tipo=data.get('tipo'),
+            canal=data.get('canal'),
+            spread_seconds=janela_segundos
+        )
+        db.session.commit()
+        
+        return jsonify({
+            'total_reenfileiradas': total,
+            'janela_segundos': janela_segundos
+        })
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'erro': str(e)}), 500
+
+
+@notificacao_bp.route('/empresas/<int:empresa_id>/modelos-notificacao', methods=['GET'])
+def listar_modelos_notificacao(empresa_id):
+    """Lista os modelos de mensagem em uso pela empresa (personalizados ou padrão)"""
+    try:
+        Empresa.query.get_or_404(empresa_id)
+        
+        personalizados = {
+            (m.tipo, m.canal): m
+            for m in ModeloNotificacao.query.filter_by(empresa_id=empresa_id)
+        }
+        
+        modelos = []
+        for tipo in TIPOS:
+            for canal in CANAIS:
+                modelo = personalizados.get((tipo, canal))
+                if modelo:
+                    modelos.append(dict(modelo.to_dict(), padrao=False))
+                else:
+                    modelos.append(template_registry.modelo_padrao(tipo, canal))
+        
+        return jsonify(modelos)
+        
+    except Exception as e:
+        return jsonify({'erro': str(e)}), 500
+
+
+@notificacao_bp.route('/empresas/<int:empresa_id>/modelos-notificacao/<tipo>/<canal>', methods=['PUT'])
+def salvar_modelo_notificacao(empresa_id, tipo, canal):
+    """Cria ou atualiza o modelo de mensagem da empresa para um tipo e canal"""
+    try:
+        Empresa.query.get_or_404(empresa_id)
+        data = request.get_json() or {}
+        
+        if tipo not in TIPOS or canal not in CANAIS:
+            return jsonify({'erro': 'Tipo ou canal de notificação inválido'}), 400
+        if not data.get('corpo'):
+            return jsonify({'erro': 'Campo corpo é obrigatório'}), 400
+        
+        assunto = data.get('assunto') if canal == 'email' else None
+        try:
+            template_registry.validar(tipo, assunto, data['corpo'])
+        except TemplateSyntaxError as e:
+            return jsonify({'erro': f'Modelo inválido (linha {e.lineno}): {e.message}'}), 400
+        except ValueError as e:
+            return jsonify({'erro': str(e)}), 400
+        
+        modelo = ModeloNotificacao.query.filter_by(empresa_id=empresa_id, tipo=tipo, canal=canal).first()
+        if not modelo:
+            modelo = ModeloNotificacao(empresa_id=empresa_id, tipo=tipo, canal=canal)
+            db.session.add(modelo)
+        
+        modelo.assunto = assunto
+        modelo.corpo = data['corpo']
+        modelo.atualizado_em = datetime.utcnow()
+        db.session.commit()
+        
+        template_registry.invalidate(empresa_id, tipo, canal)
+        
+        return jsonify(modelo.to_dict())
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'erro': str(e)}), 500
+
+
+@notificacao_bp.route('/empresas/<int:empresa_id>/modelos-notificacao/<tipo>/<canal>', methods=['DELETE'])
+def remover_modelo_notificacao(empresa_id, tipo, canal):
+    """Remove o modelo personalizado, voltando a usar o modelo padrão"""
+    try:
+        modelo = ModeloNotificacao.query.filter_by(empresa_id=empresa_id, tipo=tipo, canal=canal).first_or_404()
+        
+        db.session.delete(modelo)
+        db.session.commit()
+        
+        template_registry.invalidate(empresa_id, tipo, canal)
+        
+        return jsonify({'message': 'Modelo removido, o modelo padrão voltará a ser usado'})
+        
+    except Exception as e:
+        db.session.rollback()
         return jsonify({'erro': str(e)}), 500
 
 
@@ -260,7 +378,7 @@ def atualizar_preferencias_notificacao(cliente_id):
 
 @notificacao_bp.route('/notificacoes/teste', methods=['POST'])
 def testar_notificacoes():
-    """Testa envio de notificações"""
+    """Testa o envio de notificações (síncrono: a resposta traz o resultado do canal)"""
     try:
         data = request.get_json()
         tipo = data.get('tipo', 'email')  # 'email' ou 'whatsapp'
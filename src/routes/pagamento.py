@@ -2,16 +2,37 @@
 Rotas para gerenciamento de pagamentos
 """
 
-from flask import Blueprint, request, jsonify
-from ..models.pagamento import Pagamento
+import json
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+import requests
+from flask import Blueprint, Response, request, jsonify
+from sqlalchemy import func, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from ..models.pagamento import Pagamento, WebhookEvento
+from ..models.shards import shard_router
 from ..models.agendamento import Agendamento
 from ..models.cliente import Cliente
+from ..models.empresa import Empresa
+from ..models.taxa_gateway import TaxaGateway
 from ..models.user import db
-from ..services.payment_service import payment_service
+from ..services.gateway_client import GatewayUnavailableError
+from ..services.payment_service import payment_service, FINAL_STATUSES, TAXAS_PADRAO
+from ..services.pix_service import QRCodeCache, qrcode_cache
 from ..services.notification_service import notification_service
 
 pagamento_bp = Blueprint('pagamento', __name__)
 
+# Método registrado para cada gateway quando a requisição não informa um
+METODOS_GATEWAY = {
+    'pix': 'pix',
+    'pagseguro': 'pagseguro',
+    'mercadopago': 'mercado_pago'
+}
+
+# Itens aceitos em uma única cotação de taxas
+MAX_ITENS_COTACAO = 1000
+
 
 @pagamento_bp.route('/pagamentos', methods=['POST'])
 def criar_pagamento():
@@ -30,6 +51,10 @@ def criar_pagamento():
         if not agendamento:
             return jsonify({'erro': 'Agendamento não encontrado'}), 404
         
+        empresa = agendamento.empresa
+        if data['gateway'] == 'pix' and not empresa.chave_pix:
+            return jsonify({'erro': 'Empresa sem chave PIX cadastrada'}), 400
+        
         # Preparar dados para o gateway
         payment_data = {
             'gateway': data['gateway'],
@@ -40,7 +65,13 @@ def criar_pagamento():
                 'email': agendamento.cliente.email,
                 'telefone': agendamento.cliente.telefone
             },
-            'agendamento_id': agendamento.id
+            'agendamento_id': agendamento.id,
+            'merchant': {
+                'empresa_id': empresa.id,
+                'chave_pix': empresa.chave_pix,
+                'nome': empresa.nome,
+                'cidade': empresa.cidade
+            }
         }
         
         # Criar pagamento no gateway
@@ -50,13 +81,25 @@ def criar_pagamento():
         pagamento = Pagamento(
             agendamento_id=agendamento.id,
             gateway=data['gateway'],
+            metodo=data.get('metodo') or METODOS_GATEWAY.get(data['gateway'], data['gateway']),
             valor=float(data['amount']),
             status='pendente',
-            payment_id=payment_result['payment_id'],
+            transacao_id_externo=payment_result['payment_id'],
             dados_gateway=payment_result
         )
         
         db.session.add(pagamento)
+        db.session.flush()
+        
+        # QR Code gerado localmente a partir do código Copia e Cola
+        if payment_result.get('pix_code'):
+            payment_result = dict(
+                payment_result,
+                qr_code_url=f"/api/pagamentos/{pagamento.id}/qrcode.png",
+                qr_code_svg_url=f"/api/pagamentos/{pagamento.id}/qrcode.svg"
+            )
+            pagamento.dados_gateway = payment_result
+        
         db.session.commit()
         
         return jsonify({
@@ -68,6 +111,9 @@ def criar_pagamento():
             'payment_data': payment_result
         }), 201
         
+    except (GatewayUnavailableError, requests.RequestException) as e:
+        db.session.rollback()
+        return jsonify({'erro': f'Falha na comunicação com o gateway: {e}'}), 503
     except Exception as e:
         db.session.rollback()
         return jsonify({'erro': str(e)}), 500
@@ -85,7 +131,7 @@ def obter_pagamento(pagamento_id):
             'gateway': pagamento.gateway,
             'valor': pagamento.valor,
             'status': pagamento.status,
-            'payment_id': pagamento.payment_id,
+            'payment_id': pagamento.transacao_id_externo,
             'dados_gateway': pagamento.dados_gateway,
             'criado_em': pagamento.criado_em.isoformat(),
             'atualizado_em': pagamento.atualizado_em.isoformat() if pagamento.atualizado_em else None
@@ -95,41 +141,66 @@ def obter_pagamento(pagamento_id):
         return jsonify({'erro': str(e)}), 500
 
 
+@pagamento_bp.route('/pagamentos/<int:pagamento_id>/qrcode.<formato>', methods=['GET'])
+def qrcode_pagamento(pagamento_id, formato):
+    """Imagem do QR Code PIX do pagamento (png ou svg), renderizada localmente"""
+    try:
+        if formato not in QRCodeCache.CONTENT_TYPES:
+            return jsonify({'erro': f'Formato não suportado: {formato}'}), 404
+        if not qrcode_cache.available():
+            return jsonify({'erro': 'Geração de QR Code indisponível: instale o pacote segno'}), 501
+        
+        pix_code = db.session.query(Pagamento.dados_gateway['pix_code'].as_string()).filter(
+            Pagamento.id == pagamento_id
+        ).scalar()
+        if not pix_code:
+            return jsonify({'erro': 'Pagamento sem código PIX'}), 404
+        
+        imagem = qrcode_cache.get(pagamento_id, pix_code, formato)
+        return Response(imagem, mimetype=QRCodeCache.CONTENT_TYPES[formato], headers={
+            'Cache-Control': 'private, max-age=1800'
+        })
+        
+    except Exception as e:
+        return jsonify({'erro': str(e)}), 500
+
+
 @pagamento_bp.route('/pagamentos/<int:pagamento_id>/status', methods=['GET'])
 def verificar_status_pagamento(pagamento_id):
     """Verifica status atual do pagamento no gateway"""
     try:
         pagamento = Pagamento.query.get_or_404(pagamento_id)
         
-        # Consultar status no gateway
-        status_result = payment_service.check_payment_status(
-            pagamento.payment_id,
+        # Status final não muda mais: responder sem consultar o gateway
+        if pagamento.status in FINAL_STATUSES:
+            return jsonify({
+                'id': pagamento.id,
+                'status': pagamento.status,
+                'gateway_status': {
+                    'payment_id': pagamento.transacao_id_externo,
+                    'gateway': pagamento.gateway,
+                    'status': pagamento.status,
+                    'final': True
+                }
+            })
+        
+        # Consultar status no gateway (com cache e coalescência de consultas simultâneas)
+        status_result = payment_service.get_payment_status(
+            pagamento.transacao_id_externo,
             pagamento.gateway
         )
         
-        # Atualizar status se mudou
+        # Atualizar status se mudou e enfileirar o aviso na mesma transação;
+        # o envio fica a cargo do worker de notificações
         if status_result['status'] != pagamento.status:
             pagamento.status = status_result['status']
-            pagamento.dados_gateway.update(status_result)
-            db.session.commit()
+            pagamento.dados_gateway = dict(pagamento.dados_gateway or {}, **status_result)
+            pagamento.processado_em = datetime.utcnow()
             
-            # Enviar notificação se foi pago
             if status_result['status'] == 'paid':
-                notification_service.send_payment_notification({
-                    'id': pagamento.id,
-                    'amount': pagamento.valor,
-                    'gateway': pagamento.gateway,
-                    'status': 'paid',
-                    'agendamento': {
-                        'id': pagamento.agendamento.id,
-                        'data_hora': pagamento.agendamento.data_hora.isoformat(),
-                        'cliente': {
-                            'nome': pagamento.agendamento.cliente.nome,
-                            'email': pagamento.agendamento.cliente.email,
-                            'telefone': pagamento.agendamento.cliente.telefone
-                        }
-                    }
-                })
+                notification_service.enqueue_payment_notification([pagamento.id], 'paid')
+            
+            db.session.commit()
         
         return jsonify({
             'id': pagamento.id,
@@ -137,53 +208,96 @@ def verificar_status_pagamento(pagamento_id):
             'gateway_status': status_result
         })
         
+    except (GatewayUnavailableError, requests.RequestException) as e:
+        db.session.rollback()
+        return jsonify({'erro': f'Falha na comunicação com o gateway: {e}'}), 503
     except Exception as e:
+        db.session.rollback()
         return jsonify({'erro': str(e)}), 500
 
 
 @pagamento_bp.route('/pagamentos/webhook/<gateway>', methods=['POST'])
 def webhook_pagamento(gateway):
-    """Recebe webhooks dos gateways de pagamento"""
+    """
+    Recebe webhooks dos gateways de pagamento
+    
+    Cada evento é registrado uma única vez por (gateway, evento_id); reentregas do
+    mesmo evento são confirmadas sem reprocessamento. A mudança de status é gravada
+    e a notificação enfileirada, respondendo rapidamente para que o gateway não
+    reenvie o webhook por timeout.
+    """
     try:
         data = request.get_json()
         
         # Processar webhook
         webhook_result = payment_service.process_webhook(gateway, data)
         
-        # Buscar pagamento
-        pagamento = Pagamento.query.filter_by(
-            payment_id=webhook_result['payment_id']
+        # Sem o id externo o UPDATE abaixo viraria "IS NULL" e alcançaria os pagamentos sem transação no gateway
+        if not webhook_result.get('payment_id'):
+            return jsonify({'erro': 'payment_id é obrigatório'}), 400
+        
+        # Banco particionado: o evento é gravado no shard do pagamento
+        if shard_router.enabled:
+            shard_router.activate(shard_router.locate(
+                'pagamentos', webhook_result['payment_id'], coluna='transacao_id_externo'
+            ))
+        
+        # Registrar o evento; INSERT OR IGNORE não insere nada se ele já foi recebido
+        registrado = db.session.execute(
+            sqlite_insert(WebhookEvento).values(
+                gateway=gateway,
+                evento_id=webhook_result['event_id'],
+                transacao_id_externo=webhook_result['payment_id'],
+                status=webhook_result['status'],
+                recebido_em=datetime.utcnow()
+            ).on_conflict_do_nothing(index_elements=['gateway', 'evento_id'])
+        )
+        if not registrado.rowcount:
+            db.session.rollback()
+            return jsonify({'status': 'ok', 'duplicado': True}), 200
+        
+        # Atualizar status e mesclar os dados do webhook em um único UPDATE pelo
+        # índice único do id externo; só retorna linha quando o status mudou. Um
+        # pagamento finalizado não volta atrás com eventos atrasados ou fora de ordem
+        alterado = db.session.execute(
+            update(Pagamento).where(
+                Pagamento.transacao_id_externo.isnot(None),
+                Pagamento.transacao_id_externo == webhook_result['payment_id'],
+                Pagamento.status != webhook_result['status'],
+                Pagamento.status.notin_(FINAL_STATUSES)
+            ).values(
+                status=webhook_result['status'],
+                dados_gateway=func.json_patch(
+                    func.coalesce(Pagamento.dados_gateway, func.json_object()),
+                    json.dumps(webhook_result, default=str)
+                ),
+                processado_em=datetime.utcnow()
+            ).returning(Pagamento.id).execution_options(synchronize_session=False)
         ).first()
         
-        if not pagamento:
-            return jsonify({'erro': 'Pagamento não encontrado'}), 404
-        
-        # Atualizar status
-        pagamento.status = webhook_result['status']
-        pagamento.dados_gateway.update(webhook_result)
-        db.session.commit()
+        if not alterado:
+            existe = db.session.query(Pagamento.id).filter(
+                Pagamento.transacao_id_externo == webhook_result['payment_id']
+            ).first()
+            if not existe:
+                # Descartar o registro do evento para aceitar uma nova entrega
+                db.session.rollback()
+                return jsonify({'erro': 'Pagamento não encontrado'}), 404
+            
+            # Novo evento com um status já registrado ou para um pagamento finalizado
+            db.session.commit()
+            return jsonify({'status': 'ok'}), 200
         
-        # Enviar notificação se foi pago
+        # Enfileirar notificação se foi pago
         if webhook_result['status'] == 'paid':
-            notification_service.send_payment_notification({
-                'id': pagamento.id,
-                'amount': pagamento.valor,
-                'gateway': pagamento.gateway,
-                'status': 'paid',
-                'agendamento': {
-                    'id': pagamento.agendamento.id,
-                    'data_hora': pagamento.agendamento.data_hora.isoformat(),
-                    'cliente': {
-                        'nome': pagamento.agendamento.cliente.nome,
-                        'email': pagamento.agendamento.cliente.email,
-                        'telefone': pagamento.agendamento.cliente.telefone
-                    }
-                }
-            })
+            notification_service.enqueue_payment_notification([alterado.id], 'paid')
+        
+        db.session.commit()
         
         return jsonify({'status': 'ok'}), 200
         
     except Exception as e:
+        db.session.rollback()
         return jsonify({'erro': str(e)}), 500
 
 
@@ -198,6 +312,16 @@ def listar_gateways():
         return jsonify({'erro': str(e)}), 500
 
 
+@pagamento_bp.route('/pagamentos/gateways/metricas', methods=['GET'])
+def metricas_gateways():
+    """Latência, erros e estado do circuit breaker de cada gateway neste processo"""
+    try:
+        return jsonify({'gateways': payment_service.get_gateway_metrics()})
+        
+    except Exception as e:
+        return jsonify({'erro': str(e)}), 500
+
+
 @pagamento_bp.route('/pagamentos/calcular-taxas', methods=['POST'])
 def calcular_taxas():
     """Calcula taxas para um pagamento"""
@@ -209,15 +333,121 @@ def calcular_taxas():
         
         fees = payment_service.calculate_fees(
             float(data['amount']),
-            data['gateway']
+            data['gateway'],
+            data.get('empresa_id')
         )
         
         return jsonify(fees)
         
+    except ValueError as e:
+        return jsonify({'erro': str(e)}), 400
+    except Exception as e:
+        return jsonify({'erro': str(e)}), 500
+
+
+@pagamento_bp.route('/pagamentos/cotacoes', methods=['POST'])
+def cotar_taxas():
+    """
+    Calcula em uma única chamada as taxas de vários valores, gateways e parcelamentos
+    
+    Body: {"empresa_id": 1, "itens": [{"amount": 150.0, "gateway": "pagseguro", "installments": 3}, ...]}
+    Os valores são retornados como strings decimais, com duas casas.
+    """
+    try:
+        data = request.get_json() or {}
+        itens = data.get('itens')
+        
+        if not isinstance(itens, list) or not itens:
+            return jsonify({'erro': 'Campo itens é obrigatório'}), 400
+        if len(itens) > MAX_ITENS_COTACAO:
+            return jsonify({'erro': f'Máximo de {MAX_ITENS_COTACAO} itens por cotação'}), 400
+        
+        cotacoes = payment_service.quote_fees(data.get('empresa_id'), itens)
+        
+        return jsonify({'empresa_id': data.get('empresa_id'), 'cotacoes': cotacoes})
+        
     except Exception as e:
         return jsonify({'erro': str(e)}), 500
 
 
+@pagamento_bp.route('/empresas/<int:empresa_id>/taxas-gateway', methods=['GET'])
+def listar_taxas_gateway(empresa_id):
+    """Tabela de taxas em uso pela empresa (personalizadas ou padrão)"""
+    try:
+        Empresa.query.get_or_404(empresa_id)
+        
+        personalizadas = {t.gateway for t in TaxaGateway.query.filter_by(empresa_id=empresa_id)}
+        tabela = payment_service.get_fee_table(empresa_id)
+        
+        return jsonify([
+            dict(taxas, gateway=gateway, padrao=gateway not in personalizadas)
+            for gateway, taxas in tabela.items()
+        ])
+        
+    except Exception as e:
+        return jsonify({'erro': str(e)}), 500
+
+
+@pagamento_bp.route('/empresas/<int:empresa_id>/taxas-gateway/<gateway>', methods=['PUT'])
+def salvar_taxa_gateway(empresa_id, gateway):
+    """Cria ou atualiza as taxas da empresa para um gateway"""
+    try:
+        Empresa.query.get_or_404(empresa_id)
+        data = request.get_json() or {}
+        
+        if gateway not in TAXAS_PADRAO:
+            return jsonify({'erro': f'Gateway não suportado: {gateway}'}), 400
+        
+        padrao = TAXAS_PADRAO[gateway]
+        try:
+            percentual = Decimal(str(data.get('percentual', padrao['percentual'])))
+            fixo = Decimal(str(data.get('fixo', padrao['fixo'])))
+            acrescimo_parcela = Decimal(str(data.get('acrescimo_parcela', padrao['acrescimo_parcela'])))
+            parcelas_max = int(data.get('parcelas_max', padrao['parcelas_max']))
+        except (InvalidOperation, TypeError, ValueError):
+            return jsonify({'erro': 'Valores de taxa inválidos'}), 400
+        
+        if min(percentual, fixo, acrescimo_parcela) < 0 or percentual >= 100 or parcelas_max < 1:
+            return jsonify({'erro': 'Valores de taxa fora do intervalo permitido'}), 400
+        
+        taxa = TaxaGateway.query.filter_by(empresa_id=empresa_id, gateway=gateway).first()
+        if not taxa:
+            taxa = TaxaGateway(empresa_id=empresa_id, gateway=gateway)
+            db.session.add(taxa)
+        
+        taxa.percentual = percentual
+        taxa.fixo = fixo
+        taxa.acrescimo_parcela = acrescimo_parcela
+        taxa.parcelas_max = parcelas_max
+        db.session.commit()
+        
+        payment_service.invalidate_fee_table(empresa_id)
+        
+        return jsonify(taxa.to_dict())
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'erro': str(e)}), 500
+
+
+@pagamento_bp.route('/empresas/<int:empresa_id>/taxas-gateway/<gateway>', methods=['DELETE'])
+def remover_taxa_gateway(empresa_id, gateway):
+    """Remove as taxas personalizadas, voltando a usar a tabela padrão"""
+    try:
+        taxa = TaxaGateway.query.filter_by(empresa_id=empresa_id, gateway=gateway).first_or_404()
+        
+        db.session.delete(taxa)
+        db.session.commit()
+        
+        payment_service.invalidate_fee_table(empresa_id)
+        
+        return jsonify({'message': 'Taxas removidas, a tabela padrão voltará a ser usada'})
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'erro': str(e)}), 500
+
+
 @pagamento_bp.route('/empresas/<int:empresa_id>/pagamentos', methods=['GET'])
 def listar_pagamentos_empresa(empresa_id):
     """Lista pagamentos de uma empresa"""
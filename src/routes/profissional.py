@@ -1,6 +1,7 @@
 from flask import Blueprint, request, jsonify
 from src.models.user import db
 from src.models.profissional import Profissional
+from src.services.bulk_delete import bulk_deleter
 from datetime import datetime
 
 profissional_bp = Blueprint('profissional', __name__)
@@ -92,13 +93,27 @@ def atualizar_profissional(profissional_id):
 
 @profissional_bp.route('/profissionais/<int:profissional_id>', methods=['DELETE'])
 def deletar_profissional(profissional_id):
-    """Deleta um profissional"""
+    """
+    Desativa o profissional e agenda a exclusão dele e dos seus agendamentos
+
+    Profissionais com pagamentos registrados são apenas desativados: os pagamentos são mantidos.
+    """
     try:
-        profissional = Profissional.query.get_or_404(profissional_id)
-        db.session.delete(profissional)
-        db.session.commit()
+        profissional = db.session.get(Profissional, profissional_id)
+        if not profissional:
+            return jsonify({'erro': 'Profissional não encontrado'}), 404
+        
+        if bulk_deleter.has_payments('profissional', profissional_id):
+            profissional.ativo = False
+            db.session.commit()
+            return jsonify({
+                'mensagem': 'Profissional desativado: possui pagamentos registrados, que são mantidos',
+                'profissional': profissional.to_dict()
+            }), 200
+        
+        exclusao = bulk_deleter.schedule('profissional', profissional_id)
         
-        return jsonify({'mensagem': 'Profissional deletado com sucesso'}), 200
+        return jsonify({'mensagem': 'Exclusão do profissional agendada', 'exclusao': exclusao.to_dict()}), 202
         
     except Exception as e:
         db.session.rollback()
@@ -131,7 +146,7 @@ def obter_agenda_profissional(profissional_id):
         agendamentos = Agendamento.query.filter(
             Agendamento.profissional_id == profissional_id,
             Agendamento.data_hora >= datetime.combine(data_inicio, datetime.min.time()),
-            Agendamento.data_hora <= datetime.combine(data_fim, datetime.max.time()),
+            Agendamento.data_hora < datetime.combine(data_fim + timedelta(days=1), datetime.min.time()),
             Agendamento.status.in_(['agendado', 'confirmado', 'em_andamento'])
         ).all()
         
@@ -5,7 +5,7 @@ Coleta e processa dados para dashboard e relatórios
 
 from datetime import datetime, timedelta
 from typing import Dict, Any, List, Optional
-from sqlalchemy import func, and_, or_
+from sqlalchemy import func, and_, or_, literal
 from ..models.agendamento import Agendamento
 from ..models.cliente import Cliente
 from ..models.pagamento import Pagamento
@@ -88,6 +88,7 @@ class AnalyticsService:
                 'total': receita_periodo,
                 'hoje': receita_hoje,
                 'crescimento': crescimento_receita,
+                'descontos': self._get_descontos_periodo(empresa_id, start_date, end_date),
                 'ticket_medio': receita_periodo / total_agendamentos if total_agendamentos > 0 else 0
             },
             'ocupacao': {
@@ -117,44 +118,22 @@ class AnalyticsService:
             start_date = end_date - timedelta(days=30)
             group_by = 'day'
         
-        if group_by == 'day':
-            # Agrupar por dia
-            query = db.session.query(
-                func.date(Agendamento.data_hora).label('periodo'),
+        # Cada período vira um filtro em intervalo semiaberto sobre data_hora, resolvido
+        # por busca no índice de receita, em vez de agrupar por strftime()
+        consultas = [
+            db.session.query(
+                literal(chave).label('periodo'),
                 func.count(Agendamento.id).label('total'),
-                func.sum(Servico.preco).label('receita')
-            ).join(Servico).filter(
+                func.sum(Agendamento.valor_total).label('receita')
+            ).filter(
                 Agendamento.empresa_id == empresa_id,
-                Agendamento.data_hora >= start_date,
-                Agendamento.data_hora <= end_date,
+                Agendamento.data_hora >= inicio,
+                Agendamento.data_hora < fim,
                 Agendamento.status.in_(['confirmado', 'concluido'])
-            ).group_by(func.date(Agendamento.data_hora)).all()
-            
-        elif group_by == 'week':
-            # Agrupar por semana
-            query = db.session.query(
-                func.strftime('%Y-W%W', Agendamento.data_hora).label('periodo'),
-                func.count(Agendamento.id).label('total'),
-                func.sum(Servico.preco).label('receita')
-            ).join(Servico).filter(
-                Agendamento.empresa_id == empresa_id,
-                Agendamento.data_hora >= start_date,
-                Agendamento.data_hora <= end_date,
-                Agendamento.status.in_(['confirmado', 'concluido'])
-            ).group_by(func.strftime('%Y-W%W', Agendamento.data_hora)).all()
-            
-        else:  # month
-            # Agrupar por mês
-            query = db.session.query(
-                func.strftime('%Y-%m', Agendamento.data_hora).label('periodo'),
-                func.count(Agendamento.id).label('total'),
-                func.sum(Servico.preco).label('receita')
-            ).join(Servico).filter(
-                Agendamento.empresa_id == empresa_id,
-                Agendamento.data_hora >= start_date,
-                Agendamento.data_hora <= end_date,
-                Agendamento.status.in_(['confirmado', 'concluido'])
-            ).group_by(func.strftime('%Y-%m', Agendamento.data_hora)).all()
+            )
+            for chave, inicio, fim in self._limites_periodos(start_date, end_date, group_by)
+        ]
+        query = consultas[0].union_all(*consultas[1:]).all()
         
         return [
             {
@@ -163,21 +142,32 @@ class AnalyticsService:
                 'receita': float(row.receita or 0)
             }
             for row in query
+            if row.total
         ]
     
     def get_servicos_mais_populares(self, empresa_id: int, limite: int = 10) -> List[Dict[str, Any]]:
         """Obtém serviços mais populares"""
-        query = db.session.query(
-            Servico.nome,
+        # Agregação direto em agendamentos; servicos só entra para buscar o nome dos selecionados
+        totais = db.session.query(
+            Agendamento.servico_id,
             func.count(Agendamento.id).label('total_agendamentos'),
-            func.sum(Servico.preco).label('receita_total'),
-            func.avg(Servico.preco).label('preco_medio')
-        ).join(Agendamento).filter(
+            func.sum(Agendamento.valor_total).label('receita_total'),
+            func.avg(Agendamento.valor_total).label('preco_medio')
+        ).filter(
             Agendamento.empresa_id == empresa_id,
             Agendamento.status.in_(['confirmado', 'concluido'])
-        ).group_by(Servico.id, Servico.nome).order_by(
+        ).group_by(Agendamento.servico_id).order_by(
             func.count(Agendamento.id).desc()
-        ).limit(limite).all()
+        ).limit(limite).subquery()
+        
+        query = db.session.query(
+            Servico.nome,
+            totais.c.total_agendamentos,
+            totais.c.receita_total,
+            totais.c.preco_medio
+        ).join(totais, Servico.id == totais.c.servico_id).order_by(
+            totais.c.total_agendamentos.desc()
+        ).all()
         
         return [
             {
@@ -191,16 +181,25 @@ class AnalyticsService:
     
     def get_profissionais_performance(self, empresa_id: int) -> List[Dict[str, Any]]:
         """Obtém performance dos profissionais"""
-        query = db.session.query(
-            Profissional.nome,
+        totais = db.session.query(
+            Agendamento.profissional_id,
             func.count(Agendamento.id).label('total_agendamentos'),
-            func.sum(Servico.preco).label('receita_total'),
-            func.avg(Servico.preco).label('ticket_medio')
-        ).join(Agendamento).join(Servico).filter(
+            func.sum(Agendamento.valor_total).label('receita_total'),
+            func.avg(Agendamento.valor_total).label('ticket_medio'),
+            func.sum(Agendamento.valor_desconto).label('descontos')
+        ).filter(
             Agendamento.empresa_id == empresa_id,
             Agendamento.status.in_(['confirmado', 'concluido'])
-        ).group_by(Profissional.id, Profissional.nome).order_by(
-            func.sum(Servico.preco).desc()
+        ).group_by(Agendamento.profissional_id).subquery()
+        
+        query = db.session.query(
+            Profissional.nome,
+            totais.c.total_agendamentos,
+            totais.c.receita_total,
+            totais.c.ticket_medio,
+            totais.c.descontos
+        ).join(totais, Profissional.id == totais.c.profissional_id).order_by(
+            totais.c.receita_total.desc()
         ).all()
         
         return [
@@ -208,7 +207,8 @@ class AnalyticsService:
                 'nome': row.nome,
                 'total_agendamentos': row.total_agendamentos,
                 'receita_total': float(row.receita_total or 0),
-                'ticket_medio': float(row.ticket_medio or 0)
+                'ticket_medio': float(row.ticket_medio or 0),
+                'descontos': float(row.descontos or 0)
             }
             for row in query
         ]
@@ -244,24 +244,33 @@ class AnalyticsService:
         ).filter(
             Agendamento.empresa_id == empresa_id,
             Agendamento.data_hora >= start_date,
-            Agendamento.data_hora <= end_date
+            Agendamento.data_hora < end_date
         ).group_by(Agendamento.status).all()
         
         return {row.status: row.total for row in query}
     
     def get_clientes_frequentes(self, empresa_id: int, limite: int = 10) -> List[Dict[str, Any]]:
         """Obtém clientes mais frequentes"""
-        query = db.session.query(
-            Cliente.nome,
-            Cliente.telefone,
+        totais = db.session.query(
+            Agendamento.cliente_id,
             func.count(Agendamento.id).label('total_agendamentos'),
-            func.sum(Servico.preco).label('valor_total'),
+            func.sum(Agendamento.valor_total).label('valor_total'),
             func.max(Agendamento.data_hora).label('ultimo_agendamento')
-        ).join(Agendamento).join(Servico).filter(
+        ).filter(
             Agendamento.empresa_id == empresa_id
-        ).group_by(Cliente.id, Cliente.nome, Cliente.telefone).order_by(
+        ).group_by(Agendamento.cliente_id).order_by(
             func.count(Agendamento.id).desc()
-        ).limit(limite).all()
+        ).limit(limite).subquery()
+        
+        query = db.session.query(
+            Cliente.nome,
+            Cliente.telefone,
+            totais.c.total_agendamentos,
+            totais.c.valor_total,
+            totais.c.ultimo_agendamento
+        ).join(totais, Cliente.id == totais.c.cliente_id).order_by(
+            totais.c.total_agendamentos.desc()
+        ).all()
         
         return [
             {
@@ -279,15 +288,16 @@ class AnalyticsService:
         return db.session.query(Agendamento).filter(
             Agendamento.empresa_id == empresa_id,
             Agendamento.data_hora >= start_date,
-            Agendamento.data_hora <= end_date,
+            Agendamento.data_hora < end_date,
             Agendamento.status.in_(['confirmado', 'concluido'])
         ).count()
     
     def _get_agendamentos_hoje(self, empresa_id: int) -> int:
-        hoje = datetime.now().date()
+        inicio_dia, fim_dia = self._intervalo_hoje()
         return db.session.query(Agendamento).filter(
             Agendamento.empresa_id == empresa_id,
-            func.date(Agendamento.data_hora) == hoje
+            Agendamento.data_hora >= inicio_dia,
+            Agendamento.data_hora < fim_dia
         ).count()
     
     def _get_total_clientes(self, empresa_id: int) -> int:
@@ -300,40 +310,44 @@ class AnalyticsService:
         return db.session.query(Cliente).join(Agendamento).filter(
             Agendamento.empresa_id == empresa_id,
             Agendamento.data_hora >= start_date,
-            Agendamento.data_hora <= end_date
+            Agendamento.data_hora < end_date
         ).distinct().count()
     
     def _get_novos_clientes(self, empresa_id: int, start_date: datetime, end_date: datetime) -> int:
         return db.session.query(Cliente).filter(
             Cliente.empresa_id == empresa_id,
             Cliente.criado_em >= start_date,
-            Cliente.criado_em <= end_date
+            Cliente.criado_em < end_date
         ).count()
     
     def _get_receita_periodo(self, empresa_id: int, start_date: datetime, end_date: datetime) -> float:
         result = db.session.query(
-            func.sum(Servico.preco)
-        ).join(Agendamento).filter(
+            func.sum(Agendamento.valor_total)
+        ).filter(
             Agendamento.empresa_id == empresa_id,
             Agendamento.data_hora >= start_date,
-            Agendamento.data_hora <= end_date,
+            Agendamento.data_hora < end_date,
             Agendamento.status.in_(['confirmado', 'concluido'])
         ).scalar()
         
         return float(result or 0)
     
-    def _get_receita_hoje(self, empresa_id: int) -> float:
-        hoje = datetime.now().date()
+    def _get_descontos_periodo(self, empresa_id: int, start_date: datetime, end_date: datetime) -> float:
         result = db.session.query(
-            func.sum(Servico.preco)
-        ).join(Agendamento).filter(
+            func.sum(Agendamento.valor_desconto)
+        ).filter(
             Agendamento.empresa_id == empresa_id,
-            func.date(Agendamento.data_hora) == hoje,
+            Agendamento.data_hora >= start_date,
+            Agendamento.data_hora < end_date,
             Agendamento.status.in_(['confirmado', 'concluido'])
         ).scalar()
         
         return float(result or 0)
     
+    def _get_receita_hoje(self, empresa_id: int) -> float:
+        inicio_dia, fim_dia = self._intervalo_hoje()
+        return self._get_receita_periodo(empresa_id, inicio_dia, fim_dia)
+    
     def _get_taxa_ocupacao(self, empresa_id: int, start_date: datetime, end_date: datetime) -> float:
         # Simplificado: assumir 8 horas de trabalho por dia
         dias_periodo = (end_date - start_date).days
@@ -349,6 +363,33 @@ class AnalyticsService:
         # Simplificado: 8 horários por dia
         return 8
     
+    def _intervalo_hoje(self):
+        """Retorna o intervalo semiaberto [início do dia, início do dia seguinte)"""
+        inicio_dia = datetime.combine(datetime.now().date(), datetime.min.time())
+        return inicio_dia, inicio_dia + timedelta(days=1)
+    
+    def _limites_periodos(self, start_date: datetime, end_date: datetime, group_by: str):
+        """Gera (chave, início, fim) de cada período do intervalo, alinhados ao calendário"""
+        inicio = datetime.combine(start_date.date(), datetime.min.time())
+        if group_by == 'week':
+            inicio -= timedelta(days=inicio.weekday())
+        elif group_by == 'month':
+            inicio = inicio.replace(day=1)
+        
+        while inicio < end_date:
+            if group_by == 'day':
+                proximo = inicio + timedelta(days=1)
+                chave = inicio.strftime('%Y-%m-%d')
+            elif group_by == 'week':
+                proximo = inicio + timedelta(days=7)
+                chave = inicio.strftime('%Y-W%W')
+            else:
+                proximo = (inicio + timedelta(days=32)).replace(day=1)
+                chave = inicio.strftime('%Y-%m')
+            
+            yield chave, max(inicio, start_date), min(proximo, end_date)
+            inicio = proximo
+    
     def _calcular_crescimento(self, valor_atual: float, valor_anterior: float) -> float:
         if valor_anterior > 0:
             return ((valor_atual - valor_anterior) / valor_anterior) * 100
@@ -0,0 +1,358 @@
+"""
+Exclusão em massa de empresas, clientes e profissionais
+O pedido vira um registro em exclusoes e o worker-exclusoes apaga as tabelas
+dependentes em lotes (DELETE ... WHERE id IN), das folhas até a própria
+entidade, com um commit por lote: o bloqueio de escrita do SQLite é liberado
+entre os lotes e o progresso é gravado na mesma transação de cada um.
+
+A exclusão de uma empresa apaga todos os seus dados, inclusive os pagamentos.
+Clientes e profissionais com pagamentos não são apagados, apenas desativados:
+os agendamentos pagos são registros financeiros e ficam no banco. Enquanto uma
+exclusão está pendente ou em andamento, gravações que referenciam a entidade
+são recusadas (reject_writes)
+"""
+
+import json
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from flask import jsonify, request
+from sqlalchemy import and_, delete, exists, or_, select, text, update
+
+from ..models.agendamento import Agendamento
+from ..models.cliente import Cliente
+from ..models.empresa import Empresa
+from ..models.exclusao import Exclusao, ENTIDADES_EXCLUSAO
+from ..models.pagamento import Pagamento
+from ..models.profissional import Profissional
+from ..models.servico import Servico
+from ..models.user import db
+from .tenant_cache import tenant_cache
+
+
+# Apagados junto com cada lote de agendamentos, pela chave estrangeira indicada
+_DEPENDENTES_AGENDAMENTO = (('notificacoes', 'agendamento_id'), ('pagamentos', 'agendamento_id'))
+
+# Clientes e profissionais: só agendamentos sem pagamento (os pagos impedem a exclusão)
+_SEM_PAGAMENTO = 'NOT EXISTS (SELECT 1 FROM pagamentos p WHERE p.agendamento_id = agendamentos.id)'
+
+# Etapas de cada exclusão, na ordem em que são executadas: (tabela, condição, dependentes).
+# As condições usam índices que começam pela coluna filtrada, para que cada lote
+# seja uma busca no índice e não uma varredura da tabela
+ETAPAS = {
+    'empresa': (
+        ('agendamentos', 'empresa_id = :id', _DEPENDENTES_AGENDAMENTO),
+        ('notificacoes', 'empresa_id = :id', ()),  # mensagens avulsas, sem agendamento
+        ('cliente_campos', 'empresa_id = :id', ()),
+        ('clientes', 'empresa_id = :id', ()),
+        ('servicos_profissionais',
+         'profissional_id IN (SELECT id FROM profissionais WHERE empresa_id = :id)'
+         ' OR servico_id IN (SELECT id FROM servicos WHERE empresa_id = :id)', ()),
+        ('profissionais', 'empresa_id = :id', ()),
+        ('servicos', 'empresa_id = :id', ()),
+        ('campos_indexados', 'empresa_id = :id', ()),
+        ('modelos_notificacao', 'empresa_id = :id', ()),
+        ('taxas_gateway', 'empresa_id = :id', ()),
+        ('empresas', 'id = :id', ()),
+    ),
+    'cliente': (
+        ('agendamentos', f'cliente_id = :id AND {_SEM_PAGAMENTO}', (('notificacoes', 'agendamento_id'),)),
+        ('cliente_campos', 'cliente_id = :id', ()),
+        ('clientes', 'id = :id', ()),
+    ),
+    'profissional': (
+        ('agendamentos', f'profissional_id = :id AND {_SEM_PAGAMENTO}', (('notificacoes', 'agendamento_id'),)),
+        ('servicos_profissionais', 'profissional_id = :id', ()),
+        ('profissionais', 'id = :id', ()),
+    ),
+}
+
+MODELOS = {'empresa': Empresa, 'cliente': Cliente, 'profissional': Profissional}
+
+# Exclusões que bloqueiam gravações nas entidades alcançadas
+STATUS_ATIVOS = ('pendente', 'processando')
+
+# Parâmetros da rota e do corpo JSON que identificam as entidades alcançadas por uma gravação
+_REFERENCIAS = ('empresa_id', 'cliente_id', 'profissional_id', 'servico_id', 'agendamento_id', 'pagamento_id')
+
+
+class BulkDeleter:
+    """Agendamento e execução em lotes das exclusões em massa"""
+
+    def __init__(self, chunk_size: int = 500, pause: float = 0.05):
+        self.chunk_size = chunk_size
+        # Espera entre os lotes, para que as gravações das requisições passem à frente
+        self.pause = pause
+
+    def has_payments(self, entidade: str, entidade_id: int) -> bool:
+        """Se o cliente ou profissional tem agendamentos com pagamento (e por isso não pode ser apagado)"""
+        coluna = Agendamento.cliente_id if entidade == 'cliente' else Agendamento.profissional_id
+        return db.session.query(exists().where(
+            Pagamento.agendamento_id == Agendamento.id,
+            coluna == entidade_id
+        )).scalar()
+
+    def schedule(self, entidade: str, entidade_id: int) -> Optional[Exclusao]:
+        """
+        Registra a exclusão para o worker; None se a entidade não existir
+
+        Um novo pedido para a mesma entidade devolve a exclusão em andamento
+        (ou retoma a que terminou com erro). Clientes e profissionais são
+        desativados na hora, antes de o worker apagá-los; os que têm pagamentos
+        devem ser apenas desativados (has_payments), o que as rotas verificam antes.
+        """
+        if entidade not in ENTIDADES_EXCLUSAO:
+            raise ValueError(f"Entidade inválida: use {', '.join(ENTIDADES_EXCLUSAO)}")
+
+        registro = db.session.get(MODELOS[entidade], entidade_id)
+        if registro is None:
+            return None
+
+        exclusao = Exclusao.query.filter(
+            Exclusao.entidade == entidade,
+            Exclusao.entidade_id == entidade_id,
+            Exclusao.status.in_(STATUS_ATIVOS + ('erro',))
+        ).first()
+        if exclusao:
+            if exclusao.status == 'erro':
+                exclusao.status = 'pendente'
+                exclusao.erro_detalhes = None
+                db.session.commit()
+            return exclusao
+
+        if entidade != 'empresa':
+            registro.ativo = False
+
+        exclusao = Exclusao(
+            entidade=entidade,
+            entidade_id=entidade_id,
+            empresa_id=registro.id if entidade == 'empresa' else registro.empresa_id,
+            status='pendente'
+        )
+        db.session.add(exclusao)
+        db.session.commit()
+        return exclusao
+
+    def claim(self) -> Optional[Exclusao]:
+        """Reserva a exclusão pendente mais antiga em um único UPDATE ... RETURNING"""
+        proxima = select(Exclusao.id).where(
+            Exclusao.status == 'pendente'
+        ).order_by(Exclusao.criado_em).limit(1)
+
+        exclusao_id = db.session.execute(
+            update(Exclusao).where(Exclusao.id.in_(proxima)).values(
+                status='processando',
+                atualizado_em=datetime.utcnow()
+            ).returning(Exclusao.id).execution_options(synchronize_session=False)
+        ).scalar()
+        db.session.commit()
+        return db.session.get(Exclusao, exclusao_id) if exclusao_id else None
+
+    def recover_interrupted(self, minutos: int = 10) -> int:
+        """Devolve para a fila exclusões sem progresso há `minutos` (worker parado no meio)"""
+        limite = datetime.utcnow() - timedelta(minutes=minutos)
+        result = db.session.execute(
+            update(Exclusao).where(
+                Exclusao.status == 'processando',
+                Exclusao.atualizado_em < limite
+            ).values(status='pendente').execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        return result.rowcount
+
+    def estimate(self, exclusao: Exclusao) -> List[Dict[str, object]]:
+        """Linhas a apagar por tabela, na ordem de exclusão (dependentes antes da tabela de cada etapa)"""
+        progresso = []
+        for tabela, condicao, dependentes in ETAPAS[exclusao.entidade]:
+            for filho, coluna in dependentes:
+                total = db.session.execute(
+                    text(f'SELECT count(*) FROM {filho} WHERE {coluna} IN (SELECT id FROM {tabela} WHERE {condicao})'),
+                    {'id': exclusao.entidade_id}
+                ).scalar()
+                progresso.append({'tabela': filho, 'estimado': total, 'excluido': 0})
+            total = db.session.execute(
+                text(f'SELECT count(*) FROM {tabela} WHERE {condicao}'), {'id': exclusao.entidade_id}
+            ).scalar()
+            progresso.append({'tabela': tabela, 'estimado': total, 'excluido': 0})
+        return progresso
+
+    def run(self, exclusao: Exclusao) -> Exclusao:
+        """
+        Executa (ou retoma) a exclusão, um lote por transação
+
+        Cada lote seleciona até chunk_size ids da tabela da etapa pelo índice,
+        apaga os dependentes desses ids e depois as próprias linhas. Como as
+        condições são reavaliadas a cada lote, uma exclusão interrompida pode ser
+        retomada do início sem repetir trabalho.
+        """
+        try:
+            if not exclusao.progresso:
+                progresso = self.estimate(exclusao)
+                exclusao.progresso = json.dumps(progresso)
+                exclusao.total_estimado = sum(item['estimado'] for item in progresso)
+                exclusao.iniciado_em = datetime.utcnow()
+                db.session.commit()
+
+            progresso = json.loads(exclusao.progresso)
+            etapas = ETAPAS[exclusao.entidade]
+            parametros = {'id': exclusao.entidade_id}
+
+            for tabela, condicao, dependentes in etapas[:-1]:
+                exclusao.etapa = tabela
+                selecionar = text(f'SELECT id FROM {tabela} WHERE {condicao} LIMIT :lote')
+
+                while True:
+                    ids = db.session.execute(selecionar, dict(parametros, lote=self.chunk_size)).scalars().all()
+                    if not ids:
+                        break
+
+                    for filho, coluna in dependentes:
+                        tabela_filho = db.metadata.tables[filho]
+                        apagadas = db.session.execute(
+                            delete(tabela_filho).where(tabela_filho.c[coluna].in_(ids))
+                        ).rowcount
+                        self._contar(progresso, filho, apagadas)
+
+                    tabela_etapa = db.metadata.tables[tabela]
+                    apagadas = db.session.execute(
+                        delete(tabela_etapa).where(tabela_etapa.c.id.in_(ids))
+                    ).rowcount
+                    self._contar(progresso, tabela, apagadas)
+
+                    exclusao.progresso = json.dumps(progresso)
+                    exclusao.total_excluido = sum(item['excluido'] for item in progresso)
+                    db.session.commit()
+
+                    if len(ids) < self.chunk_size:
+                        break
+                    time.sleep(self.pause)
+
+            # Última etapa: na mesma transação, repete as etapas anteriores (apaga o que foi
+            # gravado durante a exclusão, normalmente nada) e apaga a própria entidade
+            tabela, condicao, _ = etapas[-1]
+            exclusao.etapa = tabela
+            versao_empresa = None
+            if exclusao.entidade == 'empresa':
+                versao_empresa = db.session.execute(
+                    select(Empresa.versao).where(Empresa.id == exclusao.entidade_id)
+                ).scalar()
+
+            for anterior, condicao_anterior, dependentes in etapas[:-1]:
+                for filho, coluna in dependentes:
+                    apagadas = db.session.execute(text(
+                        f'DELETE FROM {filho} WHERE {coluna} IN (SELECT id FROM {anterior} WHERE {condicao_anterior})'
+                    ), parametros).rowcount
+                    self._contar(progresso, filho, apagadas)
+                apagadas = db.session.execute(
+                    text(f'DELETE FROM {anterior} WHERE {condicao_anterior}'), parametros
+                ).rowcount
+                self._contar(progresso, anterior, apagadas)
+
+            if exclusao.entidade != 'empresa' and self.has_payments(exclusao.entidade, exclusao.entidade_id):
+                raise ValueError(
+                    f'{exclusao.entidade.capitalize()} possui agendamentos com pagamentos registrados; '
+                    'permanece inativo e os pagamentos são mantidos'
+                )
+
+            apagadas = db.session.execute(text(f'DELETE FROM {tabela} WHERE {condicao}'), parametros).rowcount
+            self._contar(progresso, tabela, apagadas)
+            exclusao.progresso = json.dumps(progresso)
+            exclusao.total_excluido = sum(item['excluido'] for item in progresso)
+
+            exclusao.status = 'concluida'
+            exclusao.etapa = None
+            exclusao.concluido_em = datetime.utcnow()
+            db.session.commit()
+
+            if versao_empresa is not None:
+                tenant_cache.invalidate(exclusao.entidade_id, versao_empresa + 1)
+
+        except Exception as e:
+            db.session.rollback()
+            exclusao.status = 'erro'
+            exclusao.erro_detalhes = str(e)
+            db.session.commit()
+
+        return exclusao
+
+    def _alcancadas(self, referencias: Dict[str, int]) -> List[Tuple[str, int]]:
+        """(entidade, id) de empresa, cliente e profissional alcançados pelos ids referenciados"""
+        alcancadas = set()
+        if referencias.get('empresa_id'):
+            alcancadas.add(('empresa', referencias['empresa_id']))
+
+        agendamento_id = referencias.get('agendamento_id')
+        if referencias.get('pagamento_id'):
+            pagamento = db.session.get(Pagamento, referencias['pagamento_id'])
+            agendamento_id = agendamento_id or (pagamento.agendamento_id if pagamento else None)
+        if agendamento_id:
+            agendamento = db.session.get(Agendamento, agendamento_id)
+            if agendamento:
+                alcancadas.update((('empresa', agendamento.empresa_id), ('cliente', agendamento.cliente_id),
+                                   ('profissional', agendamento.profissional_id)))
+
+        for parametro, entidade, modelo in (('cliente_id', 'cliente', Cliente),
+                                            ('profissional_id', 'profissional', Profissional),
+                                            ('servico_id', None, Servico)):
+            if not referencias.get(parametro):
+                continue
+            if entidade:
+                alcancadas.add((entidade, referencias[parametro]))
+            registro = db.session.get(modelo, referencias[parametro])
+            if registro:
+                alcancadas.add(('empresa', registro.empresa_id))
+
+        return list(alcancadas)
+
+    def reject_writes(self):
+        """
+        before_request: recusa (409) gravações que alcançam uma entidade com exclusão pendente ou em andamento
+
+        Sem exclusões ativas o custo é uma consulta pelo índice da fila. Caso contrário,
+        as entidades são resolvidas a partir dos ids da rota e do corpo (ex.: o cliente
+        e a empresa de um agendamento), para que nada seja criado depois que a etapa
+        correspondente da exclusão já passou.
+        """
+        if request.method not in ('POST', 'PUT', 'PATCH'):
+            return None
+        if not db.session.query(exists().where(Exclusao.status.in_(STATUS_ATIVOS))).scalar():
+            return None
+
+        corpo = request.get_json(silent=True) if request.is_json else None
+        referencias = {}
+        for origem in (corpo if isinstance(corpo, dict) else {}, request.view_args or {}):
+            for parametro in _REFERENCIAS:
+                valor = origem.get(parametro)
+                if isinstance(valor, str) and valor.isdigit():
+                    valor = int(valor)
+                if isinstance(valor, int) and not isinstance(valor, bool):
+                    referencias[parametro] = valor
+
+        alcancadas = self._alcancadas(referencias)
+        if not alcancadas:
+            return None
+
+        exclusao = Exclusao.query.filter(
+            Exclusao.status.in_(STATUS_ATIVOS),
+            or_(*[and_(Exclusao.entidade == entidade, Exclusao.entidade_id == entidade_id)
+                  for entidade, entidade_id in alcancadas])
+        ).first()
+        if exclusao:
+            return jsonify({
+                'erro': f'{exclusao.entidade.capitalize()} em exclusão; gravações não são aceitas',
+                'exclusao': exclusao.to_dict()
+            }), 409
+        return None
+
+    @staticmethod
+    def _contar(progresso: List[Dict[str, object]], tabela: str, apagadas: int):
+        for item in progresso:
+            if item['tabela'] == tabela:
+                item['excluido'] += apagadas
+                return
+        progresso.append({'tabela': tabela, 'estimado': 0, 'excluido': apagadas})
+
+
+# Instância global das exclusões em massa
+bulk_deleter = BulkDeleter()
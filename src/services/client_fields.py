@@ -0,0 +1,109 @@
+"""
+Campos personalizados indexados dos clientes
+Cada empresa declara as chaves do JSON (campos_personalizados ou preferencias)
+que quer filtrar; os valores ficam em cliente_campos e os filtros campo=valor
+viram consultas pelo índice dessa tabela, sem ler o JSON dos clientes
+"""
+
+import re
+from typing import Dict, List
+
+from sqlalchemy import select
+
+from ..models.campo_indexado import CampoIndexado, ClienteCampo, ORIGENS_CAMPO
+from ..models.cliente import Cliente
+from ..models.schema import preencher_campo_indexado
+from ..models.user import db
+
+
+_NOME_CAMPO = re.compile(r'^[A-Za-z0-9_-]{1,50}$')
+
+
+class ClientFieldIndex:
+    """Declaração dos campos indexados e filtros de clientes por eles"""
+
+    def __init__(self, max_fields: int = 20, max_values: int = 50):
+        # Cada campo indexado custa uma linha por cliente e um custo extra em cada gravação
+        self.max_fields = max_fields
+        self.max_values = max_values
+
+    @staticmethod
+    def normalize_value(valor) -> str:
+        """Valor como gravado no índice: texto sem espaços nas pontas e em minúsculas"""
+        return str(valor).strip().lower()
+
+    def indexed_fields(self, empresa_id: int) -> List[CampoIndexado]:
+        return CampoIndexado.query.filter_by(empresa_id=empresa_id).order_by(CampoIndexado.campo).all()
+
+    def declare(self, empresa_id: int, campo: str, origem: str = 'campos_personalizados') -> CampoIndexado:
+        """
+        Passa a indexar um campo e já indexa os clientes existentes da empresa
+
+        Raises:
+            ValueError: nome ou origem inválidos, campo já indexado ou limite de campos atingido
+        """
+        campo = (campo or '').strip()
+        if not _NOME_CAMPO.match(campo):
+            raise ValueError('Nome de campo inválido: use letras, números, _ ou - (até 50 caracteres)')
+        if origem not in ORIGENS_CAMPO:
+            raise ValueError(f"Origem inválida: use {' ou '.join(ORIGENS_CAMPO)}")
+
+        existentes = {c.campo for c in self.indexed_fields(empresa_id)}
+        if campo in existentes:
+            raise ValueError(f'Campo {campo} já está indexado')
+        if len(existentes) >= self.max_fields:
+            raise ValueError(f'Limite de {self.max_fields} campos indexados por empresa')
+
+        declarado = CampoIndexado(empresa_id=empresa_id, campo=campo, origem=origem)
+        db.session.add(declarado)
+        db.session.flush()
+        preencher_campo_indexado(empresa_id, campo)
+        db.session.commit()
+        return declarado
+
+    def remove(self, empresa_id: int, campo: str) -> bool:
+        """Deixa de indexar o campo e apaga seus valores; False se o campo não estava indexado"""
+        declarado = CampoIndexado.query.filter_by(empresa_id=empresa_id, campo=campo).first()
+        if not declarado:
+            return False
+
+        ClienteCampo.query.filter_by(empresa_id=empresa_id, campo=campo).delete(synchronize_session=False)
+        db.session.delete(declarado)
+        db.session.commit()
+        return True
+
+    def filter_query(self, query, empresa_id: int, filtros: Dict[str, List[str]]):
+        """
+        Restringe uma consulta de Cliente aos que têm todos os campos com um dos valores pedidos
+
+        Vários valores do mesmo campo valem como "ou"; campos diferentes, como "e".
+        Como busca textual, não repete o filtro por empresa_id: cada subconsulta já é
+        restrita à empresa pelo índice de cliente_campos.
+
+        Raises:
+            ValueError: campo sem valor ou que não está indexado para a empresa
+                (o filtro exigiria ler o JSON de todos os clientes)
+        """
+        indexados = {c.campo for c in self.indexed_fields(empresa_id)}
+        for campo, valores in filtros.items():
+            if campo not in indexados:
+                raise ValueError(f'Campo {campo} não está indexado; declare-o em /empresas/{empresa_id}/clientes/campos-indexados')
+
+            valores = {self.normalize_value(v) for v in valores if str(v).strip()}
+            if not valores:
+                raise ValueError(f'Informe um valor para o campo {campo}')
+            if len(valores) > self.max_values:
+                raise ValueError(f'Máximo de {self.max_values} valores por campo')
+
+            encontrados = select(ClienteCampo.cliente_id).where(
+                ClienteCampo.empresa_id == empresa_id,
+                ClienteCampo.campo == campo,
+                ClienteCampo.valor.in_(valores)
+            )
+            query = query.filter(Cliente.id.in_(encontrados))
+
+        return query
+
+
+# Instância global dos campos indexados
+client_fields = ClientFieldIndex()
@@ -0,0 +1,291 @@
+"""
+Importação em massa de clientes a partir de planilhas (CSV ou XLSX)
+Lê o arquivo em fluxo, valida e normaliza cada linha e grava em lotes:
+uma consulta de duplicados e um INSERT em massa por lote
+"""
+
+import csv
+import io
+import itertools
+import os
+import re
+import time
+import unicodedata
+from datetime import date
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+
+from ..models.cliente import Cliente, normalizar_telefone
+from ..models.user import db
+
+try:
+    import openpyxl
+except ImportError:  # importação de .xlsx indisponível; CSV continua funcionando
+    openpyxl = None
+
+
+# Cabeçalhos aceitos (sem acentos, minúsculos) para cada campo do cliente
+COLUNAS = {
+    'nome': 'nome', 'nome completo': 'nome', 'cliente': 'nome',
+    'telefone': 'telefone', 'celular': 'telefone', 'whatsapp': 'telefone', 'fone': 'telefone',
+    'email': 'email', 'e-mail': 'email',
+    'cpf': 'cpf',
+    'data_nascimento': 'data_nascimento', 'data de nascimento': 'data_nascimento', 'nascimento': 'data_nascimento',
+    'endereco': 'endereco',
+    'observacoes': 'observacoes', 'obs': 'observacoes'
+}
+
+# AAAA-MM-DD ou DD/MM/AAAA (também DD-MM-AAAA); o horário exportado pelo Excel é ignorado
+_DATA_ISO = re.compile(r'^(\d{4})-(\d{1,2})-(\d{1,2})\b')
+_DATA_BR = re.compile(r'^(\d{1,2})[/-](\d{1,2})[/-](\d{4})\b')
+
+_EMAIL = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+
+
+class ImportTooLargeError(ValueError):
+    """A planilha passa do limite de linhas da importação pela rota"""
+
+
+def _cabecalho(valor) -> Optional[str]:
+    texto = unicodedata.normalize('NFKD', str(valor or '')).encode('ascii', 'ignore').decode('ascii')
+    return COLUNAS.get(texto.strip().lower())
+
+
+def _data(valor: str) -> Optional[date]:
+    # Regex em vez de strptime: uma tentativa por formato custa caro em 100 mil linhas
+    encontrado = _DATA_ISO.match(valor)
+    if encontrado:
+        ano, mes, dia = encontrado.groups()
+    else:
+        encontrado = _DATA_BR.match(valor)
+        if not encontrado:
+            return None
+        dia, mes, ano = encontrado.groups()
+    try:
+        return date(int(ano), int(mes), int(dia))
+    except ValueError:
+        return None
+
+
+def _texto(valor) -> Optional[str]:
+    if valor is None:
+        return None
+    if isinstance(valor, float) and valor.is_integer():
+        valor = int(valor)  # telefones e CPFs lidos como número na planilha
+    texto = str(valor).strip()
+    return texto or None
+
+
+class ClientImporter:
+    """Importa clientes de uma planilha para uma empresa"""
+
+    def __init__(self, chunk_size: int = 1000, max_errors: int = 5000, max_rows: Optional[int] = None):
+        self.chunk_size = chunk_size
+        # Erros detalhados no relatório; acima disso só a contagem
+        self.max_errors = max_errors
+        # Linhas aceitas por arquivo (None = sem limite); verificado antes de gravar qualquer lote
+        self.max_rows = max_rows
+
+    @staticmethod
+    def xlsx_available() -> bool:
+        return openpyxl is not None
+
+    def read_rows(self, stream, filename: str) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """
+        Lê a planilha em fluxo, sem carregá-la inteira na memória
+
+        Args:
+            stream: Arquivo binário aberto
+            filename: Nome do arquivo (a extensão define o formato)
+
+        Yields:
+            (número da linha na planilha, dict com os campos reconhecidos)
+
+        Raises:
+            ValueError: formato não suportado ou sem as colunas obrigatórias
+        """
+        if filename.lower().endswith('.xlsx'):
+            linhas = self._xlsx_rows(stream)
+        elif filename.lower().endswith(('.csv', '.txt')):
+            linhas = self._csv_rows(stream)
+        else:
+            raise ValueError('Formato não suportado: envie um arquivo .csv ou .xlsx')
+
+        cabecalho = next(linhas, None)
+        campos = [_cabecalho(coluna) for coluna in cabecalho or []]
+        if 'nome' not in campos or 'telefone' not in campos:
+            raise ValueError('A planilha precisa das colunas nome e telefone')
+
+        for numero, valores in enumerate(linhas, start=2):
+            linha = {}
+            for campo, valor in zip(campos, valores):
+                if campo and campo not in linha:
+                    linha[campo] = _texto(valor)
+            if any(linha.values()):
+                yield numero, linha
+
+    @staticmethod
+    def _csv_rows(stream) -> Iterator[List[Any]]:
+        texto = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+        cabecalho = texto.readline()
+        # Excel em português exporta com ponto e vírgula
+        delimitador = max(',;\t', key=cabecalho.count)
+        return csv.reader(itertools.chain([cabecalho], texto), delimiter=delimitador)
+
+    @staticmethod
+    def _xlsx_rows(stream) -> Iterator[List[Any]]:
+        if openpyxl is None:
+            raise ValueError('Importação de .xlsx indisponível: instale o pacote openpyxl ou envie um CSV')
+
+        workbook = openpyxl.load_workbook(stream, read_only=True, data_only=True)
+        try:
+            for valores in workbook.active.iter_rows(values_only=True):
+                yield list(valores)
+        finally:
+            workbook.close()
+
+    @staticmethod
+    def _validar(linha: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """Linha pronta para gravar ou a mensagem de erro"""
+        if not linha.get('nome'):
+            return None, 'Nome é obrigatório'
+        if not linha.get('telefone'):
+            return None, 'Telefone é obrigatório'
+
+        telefone_normalizado = normalizar_telefone(linha['telefone'])
+        if not telefone_normalizado:
+            return None, f"Telefone inválido: {linha['telefone']}"
+
+        email = linha.get('email')
+        if email and not _EMAIL.match(email):
+            return None, f'Email inválido: {email}'
+
+        data_nascimento = None
+        if linha.get('data_nascimento'):
+            data_nascimento = _data(linha['data_nascimento'])
+            if data_nascimento is None:
+                return None, f"Data de nascimento inválida: {linha['data_nascimento']}"
+
+        return {
+            'nome': linha['nome'][:100],
+            'telefone': linha['telefone'][:20],
+            'telefone_normalizado': telefone_normalizado,
+            'email': email,
+            'cpf': linha.get('cpf'),
+            'data_nascimento': data_nascimento,
+            'endereco': linha.get('endereco'),
+            'observacoes': linha.get('observacoes')
+        }, None
+
+    def _separar_duplicados(self, empresa_id: int, lote: List[Tuple[int, Dict[str, Any]]], vistos: set):
+        """Clientes novos do lote e as linhas rejeitadas (telefone já cadastrado ou repetido), com uma consulta"""
+        existentes = {
+            telefone for (telefone,) in db.session.query(Cliente.telefone_normalizado).filter(
+                Cliente.empresa_id == empresa_id,
+                Cliente.telefone_normalizado.in_({cliente['telefone_normalizado'] for _, cliente in lote})
+            )
+        }
+
+        novos = []
+        rejeitados = []
+        do_lote = set()
+        for numero, cliente in lote:
+            telefone = cliente['telefone_normalizado']
+            if telefone in existentes:
+                rejeitados.append((numero, 'Cliente com este telefone já cadastrado'))
+            elif telefone in vistos or telefone in do_lote:
+                rejeitados.append((numero, 'Telefone repetido na planilha'))
+            else:
+                do_lote.add(telefone)
+                novos.append(dict(cliente, empresa_id=empresa_id))
+        return novos, rejeitados, do_lote
+
+    def _gravar_lote(self, empresa_id: int, lote: List[Tuple[int, Dict[str, Any]]],
+                     vistos: set, relatorio: Dict[str, Any]):
+        """
+        Descarta os telefones já cadastrados e insere o restante em massa
+
+        Um cadastro simultâneo pode gravar um dos telefones entre a consulta e o INSERT
+        (índice único por empresa e telefone): o lote é verificado e gravado de novo e,
+        se falhar outra vez, suas linhas vão para o relatório sem interromper a importação.
+        """
+        for _ in range(2):
+            novos, rejeitados, do_lote = self._separar_duplicados(empresa_id, lote, vistos)
+            try:
+                if novos:
+                    db.session.execute(insert(Cliente.__table__), novos)
+                db.session.commit()
+                break
+            except IntegrityError:
+                db.session.rollback()
+        else:
+            for numero, _ in lote:
+                self._erro(relatorio, numero, 'Lote não gravado: telefone cadastrado ao mesmo tempo por outra requisição')
+            return
+
+        for numero, mensagem in rejeitados:
+            relatorio['duplicados'] += 1
+            self._erro(relatorio, numero, mensagem)
+        vistos.update(do_lote)
+        relatorio['importados'] += len(novos)
+
+    def _erro(self, relatorio: Dict[str, Any], numero: int, mensagem: str):
+        relatorio['total_erros'] += 1
+        if len(relatorio['erros']) < self.max_errors:
+            relatorio['erros'].append({'linha': numero, 'erro': mensagem})
+
+    def import_rows(self, empresa_id: int, linhas: Iterable[Tuple[int, Dict[str, Any]]]) -> Dict[str, Any]:
+        """
+        Valida e grava as linhas lidas da planilha, um lote por vez
+
+        Cada lote é confirmado ao ser gravado: as linhas válidas são importadas mesmo
+        que outras falhem, e o relatório traz a linha e o motivo de cada rejeição.
+
+        Returns:
+            Dict com linhas, importados, duplicados, total_erros e erros ({linha, erro})
+        """
+        inicio = time.monotonic()
+        relatorio = {'linhas': 0, 'importados': 0, 'duplicados': 0, 'total_erros': 0, 'erros': []}
+        vistos = set()
+        lote = []
+
+        for numero, linha in linhas:
+            relatorio['linhas'] += 1
+            cliente, erro = self._validar(linha)
+            if erro:
+                self._erro(relatorio, numero, erro)
+                continue
+
+            lote.append((numero, cliente))
+            if len(lote) >= self.chunk_size:
+                self._gravar_lote(empresa_id, lote, vistos, relatorio)
+                lote = []
+
+        if lote:
+            self._gravar_lote(empresa_id, lote, vistos, relatorio)
+
+        relatorio['duracao_segundos'] = round(time.monotonic() - inicio, 2)
+        return relatorio
+
+    def import_file(self, empresa_id: int, stream, filename: str) -> Dict[str, Any]:
+        """
+        Importa a planilha inteira
+
+        Raises:
+            ImportTooLargeError: a planilha passa de max_rows linhas (nada é gravado)
+        """
+        linhas = self.read_rows(stream, filename)
+        if self.max_rows is not None:
+            # Lidas antes de gravar: um arquivo grande é recusado sem importar metade dele
+            linhas = list(itertools.islice(linhas, self.max_rows + 1))
+            if len(linhas) > self.max_rows:
+                raise ImportTooLargeError(
+                    f'A planilha passa de {self.max_rows} linhas: use o comando flask importar-clientes'
+                )
+        return self.import_rows(empresa_id, linhas)
+
+
+# Instância global do importador, usada pela rota: planilhas maiores vão pelo comando importar-clientes
+client_importer = ClientImporter(max_rows=int(os.environ.get('CLIENTES_IMPORTACAO_MAX_LINHAS', 20000)))
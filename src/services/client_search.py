@@ -0,0 +1,130 @@
+"""
+Busca de clientes pelo índice FTS5 clientes_fts
+Converte o texto digitado em uma consulta por prefixo restrita à empresa e
+ordena os resultados por relevância, com peso maior para o nome
+"""
+
+import re
+import unicodedata
+from typing import List, Optional
+
+from sqlalchemy import column, select, table, text
+
+from ..models.cliente import Cliente
+from ..models.user import db
+
+
+# Tabela virtual criada em models/schema.py (fora do metadata do SQLAlchemy)
+clientes_fts = table('clientes_fts', column('rowid'), column('nome'))
+
+_PALAVRA = re.compile(r'\w+', re.UNICODE)
+_TELEFONE = re.compile(r'^[\d\s().+-]+$')
+
+
+def _normalizar(texto: str) -> List[str]:
+    """Palavras em minúsculas e sem acentos, como o tokenizador do índice as grava"""
+    texto = unicodedata.normalize('NFKD', texto or '')
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    return _PALAVRA.findall(texto.lower())
+
+
+class ClientSearch:
+    """Busca por prefixo em nome, email e telefone dos clientes de uma empresa"""
+
+    def __init__(self, max_ranked: int = 200):
+        # Acima deste número de resultados o texto ainda é curto demais para a
+        # relevância ajudar, e a busca devolve os clientes mais recentes
+        self.max_ranked = max_ranked
+
+    @staticmethod
+    def match_expression(empresa_id: int, termo: str) -> Optional[str]:
+        """
+        Expressão MATCH do FTS5 para o texto digitado
+
+        Cada palavra vira um prefixo ("ana"* "sil"*) e todas precisam aparecer;
+        um texto com formato de telefone vira um único prefixo de dígitos na coluna telefone.
+        Retorna None quando não há nada pesquisável.
+        """
+        termo = (termo or '').strip()
+        if not termo:
+            return None
+
+        busca = None
+        if _TELEFONE.match(termo):
+            digitos = re.sub(r'\D', '', termo)
+            if len(digitos) >= 3:
+                busca = f'telefone : "{digitos}"*'
+
+        if busca is None:
+            palavras = _PALAVRA.findall(termo)
+            if not palavras:
+                return None
+            busca = ' '.join(f'"{palavra}"*' for palavra in palavras)
+
+        return f'empresa : "e{int(empresa_id)}" AND ({busca})'
+
+    @staticmethod
+    def _match(expressao: str):
+        return text('clientes_fts MATCH :expressao').bindparams(expressao=expressao)
+
+    @staticmethod
+    def _score(palavras_busca: List[str], nome: str) -> int:
+        """Relevância pelo nome: palavra inteira > início do nome > prefixo de outra palavra"""
+        palavras_nome = _normalizar(nome)
+        score = 0
+        for palavra in palavras_busca:
+            if palavra in palavras_nome:
+                score += 3
+            elif palavras_nome and palavras_nome[0].startswith(palavra):
+                score += 2
+            elif any(p.startswith(palavra) for p in palavras_nome):
+                score += 1
+        return score
+
+    def search_ids(self, empresa_id: int, termo: str, limit: int = 10) -> List[int]:
+        """Ids dos clientes encontrados, do mais relevante para o menos relevante"""
+        expressao = self.match_expression(empresa_id, termo)
+        if not expressao:
+            return []
+
+        # O índice devolve os resultados do mais recente para o mais antigo sem ordenar;
+        # o bm25 do FTS5 não serve aqui porque recontaria os documentos da empresa a cada busca
+        rows = db.session.execute(
+            select(clientes_fts.c.rowid, clientes_fts.c.nome).where(self._match(expressao))
+            .order_by(clientes_fts.c.rowid.desc()).limit(self.max_ranked + 1)
+        ).all()
+
+        if len(rows) > self.max_ranked:
+            return [row.rowid for row in rows[:limit]]
+
+        palavras = _normalizar(termo)
+        # sorted é estável: empates continuam do mais recente para o mais antigo
+        ranked = sorted(rows, key=lambda row: self._score(palavras, row.nome), reverse=True)
+        return [row.rowid for row in ranked[:limit]]
+
+    def search(self, empresa_id: int, termo: str, limit: int = 10) -> List[Cliente]:
+        """Clientes encontrados, do mais relevante para o menos relevante"""
+        ids = self.search_ids(empresa_id, termo, limit)
+        if not ids:
+            return []
+
+        clientes = {cliente.id: cliente for cliente in Cliente.query.filter(Cliente.id.in_(ids))}
+        return [clientes[cliente_id] for cliente_id in ids if cliente_id in clientes]
+
+    def filter_query(self, query, empresa_id: int, termo: str):
+        """
+        Restringe uma consulta de Cliente aos encontrados pela busca, dos mais recentes para os mais antigos
+
+        A empresa já é filtrada pelo índice; repetir o filtro por empresa_id na consulta
+        leva o SQLite a percorrer todos os clientes da empresa pelo índice da tabela.
+        """
+        expressao = self.match_expression(empresa_id, termo)
+        if not expressao:
+            return query.filter(db.false())
+
+        encontrados = select(clientes_fts.c.rowid).where(self._match(expressao))
+        return query.filter(Cliente.id.in_(encontrados)).order_by(Cliente.id.desc())
+
+
+# Instância global da busca de clientes
+client_search = ClientSearch()
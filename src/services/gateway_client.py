@@ -0,0 +1,164 @@
+"""
+Cliente HTTP dos gateways de pagamento
+Uma sessão com pool de conexões por gateway, timeouts de conexão e leitura,
+circuit breaker e métricas de latência e erros
+"""
+
+import threading
+import time
+from collections import deque
+from typing import Dict, Any, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class GatewayUnavailableError(Exception):
+    """O circuito do gateway está aberto: a chamada falha sem ir à rede"""
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker por gateway
+
+    Abre após `failure_threshold` falhas consecutivas e rejeita as chamadas por
+    `reset_timeout` segundos; depois libera uma única chamada de teste (meio-aberto),
+    que fecha o circuito se tiver sucesso ou o reabre se falhar.
+    """
+
+    CLOSED = 'fechado'
+    OPEN = 'aberto'
+    HALF_OPEN = 'meio_aberto'
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_progress = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._trial_in_progress = False
+            if self.state == self.HALF_OPEN and not self._trial_in_progress:
+                self._trial_in_progress = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._trial_in_progress = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self._trial_in_progress = False
+
+
+class GatewayClient:
+    """Cliente HTTP de um gateway, com sessão reaproveitada entre as requisições"""
+
+    def __init__(self, name: str, base_url: str, token: Optional[str] = None,
+                 connect_timeout: float = 3.05, read_timeout: float = 10.0, pool_size: int = 10,
+                 failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if token:
+            self.session.headers['Authorization'] = f'Bearer {token}'
+
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=500)
+        self._stats = {'requests': 0, 'errors': 0, 'timeouts': 0, 'rejected': 0}
+
+    def _record(self, latency: Optional[float] = None, **counters):
+        with self._lock:
+            if latency is not None:
+                self._latencies.append(latency)
+            for key, value in counters.items():
+                self._stats[key] += value
+
+    def request(self, method: str, path: str, **kwargs) -> Dict[str, Any]:
+        """
+        Executa uma requisição ao gateway e retorna o JSON da resposta
+
+        Falhas de rede, timeouts e respostas 5xx contam para o circuit breaker;
+        respostas 4xx são erros da requisição e não do gateway.
+
+        Raises:
+            GatewayUnavailableError: circuito aberto
+            requests.RequestException: falha da requisição
+        """
+        if not self.breaker.allow():
+            self._record(rejected=1)
+            raise GatewayUnavailableError(f'Gateway {self.name} indisponível (circuito aberto)')
+
+        kwargs.setdefault('timeout', self.timeout)
+        start = time.monotonic()
+        try:
+            response = self.session.request(method, f'{self.base_url}/{path.lstrip("/")}', **kwargs)
+        except requests.Timeout:
+            self._record(time.monotonic() - start, requests=1, errors=1, timeouts=1)
+            self.breaker.record_failure()
+            raise
+        except requests.RequestException:
+            self._record(time.monotonic() - start, requests=1, errors=1)
+            self.breaker.record_failure()
+            raise
+
+        latency = time.monotonic() - start
+        if response.status_code >= 500:
+            self._record(latency, requests=1, errors=1)
+            self.breaker.record_failure()
+        else:
+            self._record(latency, requests=1)
+            self.breaker.record_success()
+
+        response.raise_for_status()
+        return response.json()
+
+    def get(self, path: str, **kwargs) -> Dict[str, Any]:
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path: str, **kwargs) -> Dict[str, Any]:
+        return self.request('POST', path, **kwargs)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            latencies = sorted(self._latencies)
+            stats = dict(self._stats)
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return round(latencies[min(int(len(latencies) * p), len(latencies) - 1)] * 1000, 1)
+
+        stats.update({
+            'gateway': self.name,
+            'circuito': self.breaker.state,
+            'falhas_consecutivas': self.breaker.failures,
+            'latencia_ms': {
+                'p50': percentile(0.5),
+                'p95': percentile(0.95),
+                'max': round(latencies[-1] * 1000, 1) if latencies else None
+            },
+            'taxa_erro': round(stats['errors'] / stats['requests'] * 100, 2) if stats['requests'] else 0
+        })
+        return stats
@@ -3,14 +3,34 @@ Serviço de notificações por email e WhatsApp
 Gerencia lembretes automáticos e comunicações
 """
 
-import smtplib
-import requests
+import hashlib
+import os
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from datetime import datetime, timedelta
 from typing import Dict, Any, List, Optional
 from flask import current_app
+from sqlalchemy import case, func, insert, literal, select, union_all, update
 import json
+from ..models.agendamento import Agendamento
+from ..models.cliente import Cliente, normalizar_telefone
+from ..models.empresa import Empresa
+from ..models.pagamento import Notificacao, Pagamento
+from ..models.profissional import Profissional
+from ..models.servico import Servico
+from ..models.user import db
+from .smtp_pool import SMTPConnectionPool
+from .template_service import template_registry
+from .whatsapp_dispatcher import WhatsAppDispatcher
+
+
+# Telefone de envio: o normalizado (E.164) e, para cadastros ainda não migrados, o digitado
+TELEFONE_ENVIO = func.coalesce(Cliente.telefone_normalizado, Cliente.telefone)
+
+
+def seconds_after(base, seconds):
+    """Expressão SQL de `base` acrescido de `seconds` segundos"""
+    return func.datetime(base, func.printf('+%d seconds', seconds))
 
 
 class NotificationService:
@@ -19,11 +39,57 @@ class NotificationService:
     def __init__(self):
         self.email_enabled = True
         self.whatsapp_enabled = True
-        self.smtp_server = "smtp.gmail.com"
-        self.smtp_port = 587
-        self.email_user = "sistema@agendaonline.com"
-        self.email_password = "senha_app"  # Em produção, usar variáveis de ambiente
-        self.whatsapp_api_url = "https://api.whatsapp.com/send"  # API simulada
+        self.smtp_server = os.environ.get('SMTP_SERVER', "smtp.gmail.com")
+        self.smtp_port = int(os.environ.get('SMTP_PORT', 587))
+        self.email_user = os.environ.get('SMTP_USER', "sistema@agendaonline.com")
+        self.email_password = os.environ.get('SMTP_PASSWORD', "senha_app")
+        self.whatsapp_api_url = os.environ.get('WHATSAPP_API_URL', "https://api.whatsapp.com/send")
+        self.whatsapp_token = os.environ.get('WHATSAPP_TOKEN')  # usado quando a empresa não tem token próprio
+        
+        # Envio SMTP real apenas com EMAIL_MODO=smtp; caso contrário o envio é simulado
+        self.smtp_pool = None
+        if os.environ.get('EMAIL_MODO') == 'smtp':
+            self.smtp_pool = SMTPConnectionPool(
+                self.smtp_server,
+                self.smtp_port,
+                self.email_user,
+                self.email_password,
+                starttls=os.environ.get('SMTP_STARTTLS', '1') == '1',
+                max_size=int(os.environ.get('SMTP_POOL_SIZE', 4)),
+                idle_timeout=float(os.environ.get('SMTP_IDLE_TIMEOUT', 60))
+            )
+        
+        # Mensagens para o mesmo destinatário dentro da janela são agrupadas em um único
+        # envio; conteúdo idêntico dentro da janela de duplicidade não é reenviado
+        self.coalesce_window = int(os.environ.get('NOTIFICACAO_JANELA_AGRUPAMENTO', 60))
+        self.duplicate_window = int(os.environ.get('NOTIFICACAO_JANELA_DUPLICIDADE', 3600))
+        
+        # Envio real pela API apenas com WHATSAPP_MODO=api; caso contrário o envio é simulado
+        self.whatsapp_dispatcher = None
+        if os.environ.get('WHATSAPP_MODO') == 'api':
+            self.whatsapp_dispatcher = WhatsAppDispatcher(
+                self.whatsapp_api_url,
+                max_workers=int(os.environ.get('WHATSAPP_CONCORRENCIA', 8)),
+                rate_per_token=float(os.environ.get('WHATSAPP_TAXA', 20))
+            )
+    
+    def _build_email_message(self, to_email: str, subject: str, body: str, html_body: str = None) -> MIMEMultipart:
+        """Monta a mensagem MIME do email"""
+        msg = MIMEMultipart('alternative')
+        msg['From'] = self.email_user
+        msg['To'] = to_email
+        msg['Subject'] = subject
+        
+        # Adicionar corpo em texto
+        text_part = MIMEText(body, 'plain', 'utf-8')
+        msg.attach(text_part)
+        
+        # Adicionar corpo em HTML se fornecido
+        if html_body:
+            html_part = MIMEText(html_body, 'html', 'utf-8')
+            msg.attach(html_part)
+        
+        return msg
     
     def send_email(self, to_email: str, subject: str, body: str, html_body: str = None) -> Dict[str, Any]:
         """
@@ -38,312 +104,754 @@ class NotificationService:
         Returns:
             Dict com resultado do envio
         """
-        try:
-            # Criar mensagem
-            msg = MIMEMultipart('alternative')
-            msg['From'] = self.email_user
-            msg['To'] = to_email
-            msg['Subject'] = subject
-            
-            # Adicionar corpo em texto
-            text_part = MIMEText(body, 'plain', 'utf-8')
-            msg.attach(text_part)
-            
-            # Adicionar corpo em HTML se fornecido
-            if html_body:
-                html_part = MIMEText(html_body, 'html', 'utf-8')
-                msg.attach(html_part)
-            
-            # Simular envio (em produção, usar SMTP real)
-            print(f"[EMAIL SIMULADO] Para: {to_email}")
-            print(f"[EMAIL SIMULADO] Assunto: {subject}")
-            print(f"[EMAIL SIMULADO] Corpo: {body}")
-            
-            return {
-                'success': True,
-                'message': 'Email enviado com sucesso',
-                'sent_at': datetime.now().isoformat()
-            }
-            
-        except Exception as e:
-            return {
-                'success': False,
-                'message': f'Erro ao enviar email: {str(e)}',
-                'error': str(e)
-            }
+        return self.send_emails([{
+            'to_email': to_email,
+            'subject': subject,
+            'body': body,
+            'html_body': html_body
+        }])[0]
     
-    def send_whatsapp(self, phone: str, message: str) -> Dict[str, Any]:
+    def send_emails(self, emails: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Envia vários emails reaproveitando a mesma conexão SMTP do pool
+        
+        Args:
+            emails: Lista de dicts com to_email, subject, body e html_body (opcional)
+        
+        Returns:
+            Lista com o resultado de cada envio, na mesma ordem
+        """
+        results = [None] * len(emails)
+        messages = []
+        
+        for index, email in enumerate(emails):
+            try:
+                messages.append((index, self._build_email_message(
+                    email['to_email'], email['subject'], email['body'], email.get('html_body')
+                )))
+            except Exception as e:
+                results[index] = {
+                    'success': False,
+                    'message': f'Erro ao enviar email: {str(e)}',
+                    'error': str(e)
+                }
+        
+        if self.smtp_pool:
+            try:
+                sent = self.smtp_pool.send_messages([msg for _, msg in messages])
+            except Exception as e:
+                sent = [{'success': False, 'error': str(e)} for _ in messages]
+        else:
+            # Simular envio (configure EMAIL_MODO=smtp para usar SMTP real)
+            sent = []
+            for index, msg in messages:
+                print(f"[EMAIL SIMULADO] Para: {emails[index]['to_email']}")
+                print(f"[EMAIL SIMULADO] Assunto: {emails[index]['subject']}")
+                print(f"[EMAIL SIMULADO] Corpo: {emails[index]['body']}")
+                sent.append({'success': True})
+        
+        for (index, _), result in zip(messages, sent):
+            if result['success']:
+                results[index] = {
+                    'success': True,
+                    'message': 'Email enviado com sucesso',
+                    'sent_at': datetime.now().isoformat()
+                }
+            else:
+                results[index] = {
+                    'success': False,
+                    'message': f"Erro ao enviar email: {result['error']}",
+                    'error': result['error']
+                }
+        
+        return results
+    
+    @staticmethod
+    def _format_phone(phone: str) -> str:
+        """Telefone no formato internacional; os já normalizados (+55...) passam direto"""
+        if phone.startswith('+'):
+            return phone
+        normalizado = normalizar_telefone(phone)
+        if not normalizado:
+            raise ValueError(f'Telefone inválido: {phone}')
+        return normalizado
+    
+    def send_whatsapp(self, phone: str, message: str, token: str = None) -> Dict[str, Any]:
         """
         Envia mensagem via WhatsApp
         
         Args:
             phone: Número do telefone (formato: +5511999999999)
             message: Mensagem a ser enviada
+            token: Token da API da empresa (padrão: WHATSAPP_TOKEN)
         
         Returns:
             Dict com resultado do envio
         """
-        try:
-            # Formatar número de telefone
-            if not phone.startswith('+'):
-                phone = f"+55{phone.replace('(', '').replace(')', '').replace('-', '').replace(' ', '')}"
+        return self.send_whatsapp_batch([{'phone': phone, 'message': message, 'token': token}])[0]
+    
+    def send_whatsapp_batch(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Envia várias mensagens WhatsApp; com a API ativa, em paralelo e com limite por token
+        
+        Args:
+            messages: Lista de dicts com phone, message e token
+        
+        Returns:
+            Lista com o resultado de cada mensagem, na mesma ordem
+        """
+        results = []
+        pending = []
+        
+        for item in messages:
+            try:
+                phone = self._format_phone(item['phone'])
+            except Exception as e:
+                results.append({
+                    'success': False,
+                    'message': f'Erro ao enviar WhatsApp: {str(e)}',
+                    'error': str(e)
+                })
+                continue
+            
+            if self.whatsapp_dispatcher:
+                results.append(None)
+                pending.append((len(results) - 1, {
+                    'phone': phone,
+                    'message': item['message'],
+                    'token': item.get('token') or self.whatsapp_token
+                }))
+                continue
             
             # Simular envio via API do WhatsApp
             print(f"[WHATSAPP SIMULADO] Para: {phone}")
-            print(f"[WHATSAPP SIMULADO] Mensagem: {message}")
+            print(f"[WHATSAPP SIMULADO] Mensagem: {item['message']}")
             
-            return {
+            results.append({
                 'success': True,
                 'message': 'WhatsApp enviado com sucesso',
                 'sent_at': datetime.now().isoformat(),
                 'phone': phone
-            }
-            
-        except Exception as e:
-            return {
-                'success': False,
-                'message': f'Erro ao enviar WhatsApp: {str(e)}',
-                'error': str(e)
-            }
+            })
+        
+        if pending:
+            sent = self.whatsapp_dispatcher.send_batch([item for _, item in pending])
+            for (index, _), result in zip(pending, sent):
+                results[index] = result
+        
+        return results
     
-    def send_appointment_confirmation(self, agendamento: Dict[str, Any]) -> Dict[str, Any]:
-        """Envia confirmação de agendamento"""
+    def _appointment_context(self, agendamento: Dict[str, Any]) -> Dict[str, Any]:
+        """Variáveis disponíveis nos modelos de confirmação e lembrete"""
         cliente = agendamento.get('cliente', {})
         profissional = agendamento.get('profissional', {})
         servico = agendamento.get('servico', {})
+        empresa = agendamento.get('empresa', {})
         
         # Formatar data e hora
         data_hora = datetime.fromisoformat(agendamento['data_hora'])
-        data_formatada = data_hora.strftime('%d/%m/%Y às %H:%M')
         
-        # Preparar mensagens
-        subject = "Agendamento Confirmado - AgendaOnline"
-        
-        email_body = f"""
-Olá {cliente.get('nome', 'Cliente')},
-
-Seu agendamento foi confirmado com sucesso!
-
-📅 Data e Hora: {data_formatada}
-👤 Profissional: {profissional.get('nome', 'N/A')}
-💼 Serviço: {servico.get('nome', 'N/A')}
-💰 Valor: R$ {servico.get('preco', 0):.2f}
-
-Endereço:
-{agendamento.get('empresa', {}).get('endereco', 'Endereço não informado')}
-
-Em caso de dúvidas, entre em contato conosco.
+        return {
+            'cliente_nome': cliente.get('nome', 'Cliente'),
+            'data_formatada': data_hora.strftime('%d/%m/%Y às %H:%M'),
+            'profissional_nome': profissional.get('nome', 'N/A'),
+            'servico_nome': servico.get('nome', 'N/A'),
+            'valor': servico.get('preco', 0),
+            'empresa_nome': empresa.get('nome', ''),
+            'endereco': empresa.get('endereco') or 'Endereço não informado'
+        }
+    
+    def _build_messages(self, empresa_id: Optional[int], tipo: str, contexto: Dict[str, Any]):
+        """
+        Monta assunto, corpo do email e mensagem de WhatsApp a partir dos modelos da empresa
 
-Atenciosamente,
-Equipe AgendaOnline
+        Um modelo da empresa que falha ao renderizar é substituído pelo modelo padrão do canal.
         """
+        renderizadas = template_registry.render_batch([
+            {'empresa_id': empresa_id, 'tipo': tipo, 'canal': canal, 'contexto': contexto}
+            for canal in ('email', 'whatsapp')
+        ])
+        (subject, email_body, _), (_, whatsapp_message, _) = [
+            template_registry.render(None, tipo, canal, contexto) if erro else (assunto, corpo, erro)
+            for canal, (assunto, corpo, erro) in zip(('email', 'whatsapp'), renderizadas)
+        ]
+        return subject, email_body, whatsapp_message
+    
+    def _build_confirmation_messages(self, agendamento: Dict[str, Any]):
+        """Monta assunto, corpo do email e mensagem de WhatsApp da confirmação"""
+        return self._build_messages(agendamento.get('empresa_id'), 'confirmacao', self._appointment_context(agendamento))
+    
+    def _payment_context(self, pagamento: Dict[str, Any]) -> Dict[str, Any]:
+        """Variáveis disponíveis nos modelos de pagamento"""
+        agendamento = pagamento.get('agendamento', {})
+        cliente = agendamento.get('cliente', {})
         
-        whatsapp_message = f"""
-🎉 *Agendamento Confirmado!*
-
-Olá {cliente.get('nome', 'Cliente')}!
-
-📅 *Data:* {data_formatada}
-👤 *Profissional:* {profissional.get('nome', 'N/A')}
-💼 *Serviço:* {servico.get('nome', 'N/A')}
-💰 *Valor:* R$ {servico.get('preco', 0):.2f}
-
-Nos vemos em breve! 😊
+        return {
+            'cliente_nome': cliente.get('nome', 'Cliente'),
+            'valor': pagamento['amount'],
+            'metodo': (pagamento.get('gateway') or '').upper(),
+            'data_agendamento': agendamento.get('data_hora', 'N/A')
+        }
+    
+    @staticmethod
+    def _payment_template_type(status: str) -> str:
+        return 'pagamento_aprovado' if status == 'paid' else 'pagamento_problema'
+    
+    def load_appointment_data(self, agendamento_ids) -> Dict[int, Dict[str, Any]]:
+        """Carrega em uma única consulta os dados usados nas mensagens de vários agendamentos"""
+        if not agendamento_ids:
+            return {}
+        
+        rows = db.session.query(
+            Agendamento.id,
+            Agendamento.data_hora,
+            Agendamento.empresa_id,
+            Cliente.nome.label('cliente_nome'),
+            Cliente.email.label('cliente_email'),
+            TELEFONE_ENVIO.label('cliente_telefone'),
+            Profissional.nome.label('profissional_nome'),
+            Servico.nome.label('servico_nome'),
+            Servico.preco.label('servico_preco'),
+            Empresa.nome.label('empresa_nome'),
+            Empresa.endereco.label('empresa_endereco')
+        ).join(Cliente, Cliente.id == Agendamento.cliente_id).join(
+            Profissional, Profissional.id == Agendamento.profissional_id
+        ).join(Servico, Servico.id == Agendamento.servico_id).join(
+            Empresa, Empresa.id == Agendamento.empresa_id
+        ).filter(Agendamento.id.in_(list(agendamento_ids))).all()
+        
+        return {
+            row.id: {
+                'id': row.id,
+                'data_hora': row.data_hora.isoformat(),
+                'empresa_id': row.empresa_id,
+                'cliente': {
+                    'nome': row.cliente_nome,
+                    'email': row.cliente_email,
+                    'telefone': row.cliente_telefone
+                },
+                'profissional': {
+                    'nome': row.profissional_nome
+                },
+                'servico': {
+                    'nome': row.servico_nome,
+                    'preco': float(row.servico_preco)
+                },
+                'empresa': {
+                    'nome': row.empresa_nome,
+                    'endereco': row.empresa_endereco
+                }
+            }
+            for row in rows
+        }
+    
+    @staticmethod
+    def content_hash(empresa_id: Optional[int], canal: str, destinatario: str,
+                     assunto: Optional[str], mensagem: str, mensagem_html: Optional[str] = None) -> str:
+        """Hash que identifica mensagens idênticas para o mesmo destinatário"""
+        conteudo = '\x1f'.join([str(empresa_id or ''), canal, destinatario, assunto or '', mensagem, mensagem_html or ''])
+        return hashlib.sha256(conteudo.encode('utf-8')).hexdigest()
+    
+    def _find_duplicate(self, hash_conteudo: str) -> Optional[int]:
+        """Notificação recente com o mesmo conteúdo que foi ou será enviada"""
+        row = db.session.query(Notificacao.id).filter(
+            Notificacao.hash_conteudo == hash_conteudo,
+            Notificacao.criado_em >= datetime.utcnow() - timedelta(seconds=self.duplicate_window),
+            Notificacao.status.in_(['pendente', 'processando', 'enviado', 'entregue', 'agrupada'])
+        ).first()
+        return row.id if row else None
+    
+    def _coalesce_into_pending(self, empresa_id: Optional[int], canal: str, destinatario: str,
+                               assunto: Optional[str], mensagem: str, send_at: datetime) -> Optional[int]:
         """
+        Anexa a mensagem a uma notificação pendente para o mesmo destinatário e empresa
+        com envio previsto dentro da janela de agrupamento
         
-        results = []
+        Returns:
+            Id da notificação que recebeu a mensagem, ou None se não havia nenhuma
+        """
+        window = timedelta(seconds=self.coalesce_window)
+        candidates = db.session.query(Notificacao.id).filter(
+            Notificacao.empresa_id == empresa_id,
+            Notificacao.canal == canal,
+            Notificacao.destinatario == destinatario,
+            Notificacao.status == 'pendente',
+            Notificacao.enviar_em >= send_at - window,
+            Notificacao.enviar_em <= send_at + window,
+            Notificacao.mensagem != '',
+            Notificacao.mensagem_html.is_(None)
+        ).order_by(Notificacao.enviar_em).limit(3).all()
         
-        # Enviar email se disponível
-        if cliente.get('email') and self.email_enabled:
-            email_result = self.send_email(
-                cliente['email'],
-                subject,
-                email_body
+        separator = '\n\n' + '-' * 20 + '\n\n'
+        for (host_id,) in candidates:
+            # A condição de status evita anexar a uma notificação já reservada pelo worker
+            result = db.session.execute(
+                update(Notificacao).where(
+                    Notificacao.id == host_id,
+                    Notificacao.status == 'pendente'
+                ).values(
+                    mensagem=Notificacao.mensagem + separator + mensagem,
+                    assunto=case(
+                        (func.coalesce(Notificacao.assunto, '') == (assunto or ''), Notificacao.assunto),
+                        else_="Atualizações dos seus agendamentos - AgendaOnline"
+                    ) if canal == 'email' else Notificacao.assunto,
+                    atualizado_em=datetime.utcnow()
+                ).execution_options(synchronize_session=False)
             )
-            results.append({'type': 'email', 'result': email_result})
+            if result.rowcount:
+                return host_id
         
-        # Enviar WhatsApp se disponível
-        if cliente.get('telefone') and self.whatsapp_enabled:
-            whatsapp_result = self.send_whatsapp(
-                cliente['telefone'],
-                whatsapp_message
-            )
-            results.append({'type': 'whatsapp', 'result': whatsapp_result})
+        return None
+    
+    def load_payment_data(self, pagamento_ids) -> Dict[int, Dict[str, Any]]:
+        """Carrega em uma única consulta os dados usados nas mensagens de vários pagamentos"""
+        if not pagamento_ids:
+            return {}
+        
+        rows = db.session.query(
+            Pagamento.id,
+            Pagamento.valor,
+            Pagamento.gateway,
+            Pagamento.status,
+            Agendamento.id.label('agendamento_id'),
+            Agendamento.data_hora,
+            Agendamento.empresa_id,
+            Cliente.nome.label('cliente_nome'),
+            Cliente.email.label('cliente_email'),
+            TELEFONE_ENVIO.label('cliente_telefone')
+        ).join(Agendamento, Agendamento.id == Pagamento.agendamento_id).join(
+            Cliente, Cliente.id == Agendamento.cliente_id
+        ).filter(Pagamento.id.in_(list(pagamento_ids))).all()
         
         return {
-            'agendamento_id': agendamento.get('id'),
-            'notifications_sent': results,
-            'total_sent': len([r for r in results if r['result']['success']])
+            row.id: {
+                'id': row.id,
+                'amount': float(row.valor),
+                'gateway': row.gateway,
+                'status': row.status,
+                'agendamento': {
+                    'id': row.agendamento_id,
+                    'data_hora': row.data_hora.isoformat(),
+                    'empresa_id': row.empresa_id,
+                    'cliente': {
+                        'nome': row.cliente_nome,
+                        'email': row.cliente_email,
+                        'telefone': row.cliente_telefone
+                    }
+                }
+            }
+            for row in rows
         }
     
-    def send_appointment_reminder(self, agendamento: Dict[str, Any], hours_before: int = 24) -> Dict[str, Any]:
-        """Envia lembrete de agendamento"""
-        cliente = agendamento.get('cliente', {})
-        profissional = agendamento.get('profissional', {})
-        servico = agendamento.get('servico', {})
-        
-        # Formatar data e hora
-        data_hora = datetime.fromisoformat(agendamento['data_hora'])
-        data_formatada = data_hora.strftime('%d/%m/%Y às %H:%M')
+    def enqueue(self, tipo: str, canal: str, destinatario: str, mensagem: str, agendamento_id: Optional[int],
+                empresa_id: int = None, assunto: str = None, enviar_em: datetime = None,
+                mensagem_html: str = None) -> Notificacao:
+        """
+        Enfileira uma notificação para envio pelo worker
         
-        # Preparar mensagens
-        subject = "Lembrete: Seu agendamento é amanhã - AgendaOnline"
+        A notificação é apenas adicionada à sessão; o commit fica a cargo de quem chama.
+        Uma mensagem vazia é montada pelo worker no momento do envio, a partir do
+        agendamento; mensagens avulsas (sem agendamento) precisam vir com o conteúdo.
         
-        email_body = f"""
-Olá {cliente.get('nome', 'Cliente')},
-
-Este é um lembrete do seu agendamento:
-
-📅 Data e Hora: {data_formatada}
-👤 Profissional: {profissional.get('nome', 'N/A')}
-💼 Serviço: {servico.get('nome', 'N/A')}
-💰 Valor: R$ {servico.get('preco', 0):.2f}
-
-Endereço:
-{agendamento.get('empresa', {}).get('endereco', 'Endereço não informado')}
-
-Caso precise cancelar ou reagendar, entre em contato conosco com antecedência.
-
-Atenciosamente,
-Equipe AgendaOnline
+        Mensagens com conteúdo passam pelo agrupamento: envios imediatos aguardam a janela
+        de agrupamento, uma mensagem idêntica a outra recente fica como 'duplicada' e uma
+        mensagem para um destinatário com envio pendente na janela é anexada a ele e fica
+        como 'agrupada'. Em ambos os casos agrupada_em_id aponta a notificação enviada.
+        Emails com versão HTML não são anexados a outros nem recebem anexos.
         """
+        status = 'pendente'
+        host_id = None
+        hash_conteudo = None
         
-        whatsapp_message = f"""
-⏰ *Lembrete de Agendamento*
-
-Olá {cliente.get('nome', 'Cliente')}!
-
-Seu agendamento é amanhã:
-
-📅 *{data_formatada}*
-👤 *Profissional:* {profissional.get('nome', 'N/A')}
-💼 *Serviço:* {servico.get('nome', 'N/A')}
-
-Nos vemos em breve! 😊
-
-Para cancelar ou reagendar, responda esta mensagem.
-        """
+        if mensagem:
+            hash_conteudo = self.content_hash(empresa_id, canal, destinatario, assunto, mensagem, mensagem_html)
+            if enviar_em is None and self.coalesce_window > 0:
+                enviar_em = datetime.now() + timedelta(seconds=self.coalesce_window)
+            
+            host_id = self._find_duplicate(hash_conteudo)
+            if host_id:
+                status = 'duplicada'
+            elif self.coalesce_window > 0 and not mensagem_html:
+                host_id = self._coalesce_into_pending(
+                    empresa_id, canal, destinatario, assunto, mensagem, enviar_em or datetime.now()
+                )
+                if host_id:
+                    status = 'agrupada'
         
-        results = []
+        notificacao = Notificacao(
+            tipo=tipo,
+            canal=canal,
+            destinatario=destinatario,
+            assunto=assunto,
+            mensagem=mensagem,
+            mensagem_html=mensagem_html,
+            hash_conteudo=hash_conteudo,
+            status=status,
+            tentativas=0,
+            enviar_em=enviar_em or datetime.now(),
+            agendamento_id=agendamento_id,
+            empresa_id=empresa_id,
+            agrupada_em_id=host_id
+        )
+        db.session.add(notificacao)
+        return notificacao
+    
+    def _enqueue_messages(self, tipo: str, agendamento: Dict[str, Any], subject: Optional[str],
+                          email_body: str, whatsapp_message: str, enviar_em: datetime = None) -> List[Notificacao]:
+        """Enfileira a mensagem nos canais disponíveis para o cliente"""
+        cliente = agendamento.get('cliente', {})
+        notificacoes = []
         
-        # Enviar email se disponível
         if cliente.get('email') and self.email_enabled:
-            email_result = self.send_email(
-                cliente['email'],
-                subject,
-                email_body
-            )
-            results.append({'type': 'email', 'result': email_result})
+            notificacoes.append(self.enqueue(
+                tipo, 'email', cliente['email'], email_body, agendamento['id'],
+                agendamento.get('empresa_id'), subject, enviar_em
+            ))
         
-        # Enviar WhatsApp se disponível
         if cliente.get('telefone') and self.whatsapp_enabled:
-            whatsapp_result = self.send_whatsapp(
-                cliente['telefone'],
-                whatsapp_message
-            )
-            results.append({'type': 'whatsapp', 'result': whatsapp_result})
+            notificacoes.append(self.enqueue(
+                tipo, 'whatsapp', cliente['telefone'], whatsapp_message, agendamento['id'],
+                agendamento.get('empresa_id'), None, enviar_em
+            ))
+        
+        return notificacoes
+    
+    def enqueue_appointment_confirmation(self, agendamento: Dict[str, Any]) -> List[Notificacao]:
+        """Enfileira a confirmação de agendamento"""
+        subject, email_body, whatsapp_message = self._build_confirmation_messages(agendamento)
+        return self._enqueue_messages('confirmacao', agendamento, subject, email_body, whatsapp_message)
+    
+    def schedule_reminder(self, agendamento_id: int, send_at: datetime) -> Dict[str, Any]:
+        """Agenda um lembrete para ser enviado pelo worker"""
+        agendamento = self.load_appointment_data([agendamento_id]).get(agendamento_id)
+        if not agendamento:
+            raise ValueError(f"Agendamento não encontrado: {agendamento_id}")
+        
+        horas_antes = round((datetime.fromisoformat(agendamento['data_hora']) - send_at).total_seconds() / 3600)
+        
+        # A mensagem fica vazia e é montada no envio, refletindo os dados atuais do agendamento
+        notificacoes = self._enqueue_messages(f'lembrete_{horas_antes}h', agendamento, None, '', '', send_at)
+        db.session.flush()
         
         return {
-            'agendamento_id': agendamento.get('id'),
-            'notifications_sent': results,
-            'total_sent': len([r for r in results if r['result']['success']])
+            'reminder_id': notificacoes[0].id if notificacoes else None,
+            'reminder_ids': [n.id for n in notificacoes],
+            'agendamento_id': agendamento_id,
+            'scheduled_for': send_at.isoformat(),
+            'status': 'scheduled'
         }
     
-    def send_payment_notification(self, pagamento: Dict[str, Any]) -> Dict[str, Any]:
-        """Envia notificação de pagamento"""
-        agendamento = pagamento.get('agendamento', {})
-        cliente = agendamento.get('cliente', {})
+    def schedule_automatic_reminders(self, empresa_id: int, hours_before_list: List[int]) -> Dict[str, Any]:
+        """
+        Agenda lembretes para todos os agendamentos futuros da empresa
+        
+        Cada antecedência gera um único INSERT ... SELECT sobre agendamentos + clientes.
+        Lembretes já existentes para o mesmo agendamento, tipo e canal são ignorados,
+        então a operação pode ser repetida sem duplicar notificações.
+        """
+        now = datetime.now()
+        # criado_em em UTC, como o padrão do modelo: a janela de duplicidade e as métricas o comparam com utcnow
+        criado_em = datetime.utcnow()
+        status_futuros = ['agendado', 'confirmado']
         
-        if pagamento['status'] == 'paid':
-            subject = "Pagamento Confirmado - AgendaOnline"
+        total_agendamentos = db.session.query(func.count(Agendamento.id)).filter(
+            Agendamento.empresa_id == empresa_id,
+            Agendamento.data_hora > now,
+            Agendamento.status.in_(status_futuros)
+        ).scalar()
+        
+        colunas = [
+            Notificacao.tipo, Notificacao.canal, Notificacao.destinatario, Notificacao.mensagem,
+            Notificacao.status, Notificacao.tentativas, Notificacao.enviar_em,
+            Notificacao.agendamento_id, Notificacao.empresa_id,
+            Notificacao.criado_em, Notificacao.atualizado_em
+        ]
+        canais = []
+        if self.email_enabled:
+            canais.append(('email', Cliente.email))
+        if self.whatsapp_enabled:
+            canais.append(('whatsapp', TELEFONE_ENVIO))
+        
+        por_antecedencia = {}
+        for hours_before in hours_before_list:
+            tipo = f'lembrete_{hours_before}h'
+            selects = []
             
-            email_body = f"""
-Olá {cliente.get('nome', 'Cliente')},
-
-Seu pagamento foi confirmado com sucesso!
-
-💰 Valor: R$ {pagamento['amount']:.2f}
-💳 Método: {pagamento['gateway'].upper()}
-📅 Agendamento: {agendamento.get('data_hora', 'N/A')}
-
-Obrigado pela preferência!
-
-Atenciosamente,
-Equipe AgendaOnline
-            """
+            for canal, destinatario in canais:
+                existente = db.session.query(Notificacao.id).filter(
+                    Notificacao.agendamento_id == Agendamento.id,
+                    Notificacao.tipo == tipo,
+                    Notificacao.canal == canal
+                ).exists()
+                
+                selects.append(select(
+                    literal(tipo), literal(canal), destinatario, literal(''),
+                    literal('pendente'), literal(0),
+                    func.datetime(Agendamento.data_hora, f'-{hours_before} hours'),
+                    Agendamento.id, Agendamento.empresa_id,
+                    literal(criado_em), literal(now)
+                ).join(Cliente, Cliente.id == Agendamento.cliente_id).where(
+                    Agendamento.empresa_id == empresa_id,
+                    # send_at > now, escrito sobre data_hora para usar o índice
+                    Agendamento.data_hora > now + timedelta(hours=hours_before),
+                    Agendamento.status.in_(status_futuros),
+                    destinatario.isnot(None),
+                    destinatario != '',
+                    ~existente
+                ))
             
-            whatsapp_message = f"""
-✅ *Pagamento Confirmado!*
-
-Olá {cliente.get('nome', 'Cliente')}!
-
-💰 *Valor:* R$ {pagamento['amount']:.2f}
-💳 *Método:* {pagamento['gateway'].upper()}
-
-Seu agendamento está confirmado! 🎉
-            """
-        else:
-            subject = "Problema com Pagamento - AgendaOnline"
+            if not selects:
+                por_antecedencia[str(hours_before)] = 0
+                continue
             
-            email_body = f"""
-Olá {cliente.get('nome', 'Cliente')},
-
-Identificamos um problema com seu pagamento.
-
-💰 Valor: R$ {pagamento['amount']:.2f}
-💳 Método: {pagamento['gateway'].upper()}
-📅 Agendamento: {agendamento.get('data_hora', 'N/A')}
-
-Por favor, entre em contato conosco para resolver a situação.
-
-Atenciosamente,
-Equipe AgendaOnline
-            """
+            result = db.session.execute(
+                insert(Notificacao).from_select(colunas, union_all(*selects))
+            )
+            por_antecedencia[str(hours_before)] = result.rowcount
+        
+        return {
+            'total_agendamentos': total_agendamentos,
+            'total_lembretes': sum(por_antecedencia.values()),
+            'lembretes_por_antecedencia': por_antecedencia
+        }
+    
+    def enqueue_payment_notification(self, pagamento_ids: List[int], status: str) -> int:
+        """
+        Enfileira o aviso de um ou mais pagamentos em um único INSERT ... SELECT sobre
+        pagamento, agendamento e cliente, sem carregar os objetos
+        
+        A mensagem fica vazia e é montada pelo worker. Avisos já existentes para o mesmo
+        pagamento, tipo e canal são ignorados, então webhooks repetidos não duplicam o envio.
+        
+        Returns:
+            Quantidade de notificações enfileiradas
+        """
+        if not pagamento_ids:
+            return 0
+        
+        now = datetime.now()
+        criado_em = datetime.utcnow()  # UTC, como o padrão do modelo
+        tipo = self._payment_template_type(status)
+        
+        colunas = [
+            Notificacao.tipo, Notificacao.canal, Notificacao.destinatario, Notificacao.mensagem,
+            Notificacao.status, Notificacao.tentativas, Notificacao.enviar_em,
+            Notificacao.agendamento_id, Notificacao.pagamento_id, Notificacao.empresa_id,
+            Notificacao.criado_em, Notificacao.atualizado_em
+        ]
+        canais = []
+        if self.email_enabled:
+            canais.append(('email', Cliente.email))
+        if self.whatsapp_enabled:
+            canais.append(('whatsapp', TELEFONE_ENVIO))
+        
+        selects = []
+        for canal, destinatario in canais:
+            existente = db.session.query(Notificacao.id).filter(
+                Notificacao.pagamento_id == Pagamento.id,
+                Notificacao.tipo == tipo,
+                Notificacao.canal == canal
+            ).exists()
             
-            whatsapp_message = f"""
-⚠️ *Problema com Pagamento*
-
-Olá {cliente.get('nome', 'Cliente')}!
-
-Identificamos um problema com seu pagamento de R$ {pagamento['amount']:.2f}.
-
-Entre em contato conosco para resolver.
-            """
+            selects.append(select(
+                literal(tipo), literal(canal), destinatario, literal(''),
+                literal('pendente'), literal(0), literal(now),
+                Agendamento.id, Pagamento.id, Agendamento.empresa_id,
+                literal(criado_em), literal(now)
+            ).join(Agendamento, Agendamento.id == Pagamento.agendamento_id).join(
+                Cliente, Cliente.id == Agendamento.cliente_id
+            ).where(
+                Pagamento.id.in_(list(pagamento_ids)),
+                destinatario.isnot(None),
+                destinatario != '',
+                ~existente
+            ))
         
-        results = []
+        if not selects:
+            return 0
         
-        # Enviar notificações
-        if cliente.get('email') and self.email_enabled:
-            email_result = self.send_email(
-                cliente['email'],
-                subject,
-                email_body
-            )
-            results.append({'type': 'email', 'result': email_result})
+        result = db.session.execute(insert(Notificacao).from_select(colunas, union_all(*selects)))
+        return result.rowcount
+    
+    def render_pending_messages(self, notificacoes: List[Dict[str, Any]]) -> None:
+        """
+        Monta em uma única renderização em lote as mensagens ainda vazias do lote do worker
+        (lembretes e avisos de pagamento), carregando os dados com uma consulta por tipo
+        """
+        pendentes = [n for n in notificacoes if not n['mensagem']]
+        de_pagamento = [n for n in pendentes if n.get('pagamento_id')]
+        de_agendamento = [n for n in pendentes if not n.get('pagamento_id')]
         
-        if cliente.get('telefone') and self.whatsapp_enabled:
-            whatsapp_result = self.send_whatsapp(
-                cliente['telefone'],
-                whatsapp_message
+        pagamentos = self.load_payment_data({n['pagamento_id'] for n in de_pagamento})
+        agendamentos = self.load_appointment_data({n['agendamento_id'] for n in de_agendamento})
+        
+        itens = []
+        contextos = {}
+        for notificacao in de_pagamento:
+            pagamento = pagamentos.get(notificacao['pagamento_id'])
+            if not pagamento:
+                continue
+            chave = ('pagamento', pagamento['id'])
+            if chave not in contextos:
+                contextos[chave] = self._payment_context(pagamento)
+            itens.append((notificacao, pagamento['agendamento']['empresa_id'], contextos[chave]))
+        
+        for notificacao in de_agendamento:
+            agendamento = agendamentos.get(notificacao['agendamento_id'])
+            if not agendamento:
+                continue
+            chave = ('agendamento', agendamento['id'])
+            if chave not in contextos:
+                contextos[chave] = self._appointment_context(agendamento)
+            itens.append((notificacao, agendamento['empresa_id'], contextos[chave]))
+        
+        renderizadas = template_registry.render_batch([
+            {'empresa_id': empresa_id, 'tipo': n['tipo'], 'canal': n['canal'], 'contexto': contexto}
+            for n, empresa_id, contexto in itens
+        ])
+        for (notificacao, _, _), (subject, body, erro) in zip(itens, renderizadas):
+            if erro:
+                # Só esta notificação falha; dispatch registra o erro do modelo
+                notificacao['erro_renderizacao'] = erro
+                continue
+            if notificacao['canal'] == 'email':
+                notificacao['assunto'] = subject
+            notificacao['mensagem'] = body
+    
+    def _whatsapp_tokens(self, empresa_ids) -> Dict[int, str]:
+        """Carrega o token de WhatsApp de cada empresa em uma única consulta"""
+        empresa_ids = {empresa_id for empresa_id in empresa_ids if empresa_id}
+        if not empresa_ids:
+            return {}
+        rows = db.session.query(Empresa.id, Empresa.whatsapp_token).filter(Empresa.id.in_(empresa_ids))
+        return {empresa_id: token for empresa_id, token in rows if token}
+    
+    def dispatch_batch(self, notificacoes: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Envia um lote da fila
+        
+        Os emails saem juntos pela mesma conexão SMTP e as mensagens WhatsApp em
+        paralelo, cada uma com o token (e o limite de taxa) da sua empresa.
+        """
+        results = [None] * len(notificacoes)
+        
+        emails = [
+            (index, notificacao) for index, notificacao in enumerate(notificacoes)
+            if notificacao['canal'] == 'email' and notificacao['mensagem']
+        ]
+        sent = self.send_emails([
+            {'to_email': n['destinatario'], 'subject': n['assunto'] or '', 'body': n['mensagem'],
+             'html_body': n.get('mensagem_html')}
+            for _, n in emails
+        ])
+        for (index, _), result in zip(emails, sent):
+            results[index] = result
+        
+        whatsapps = [
+            (index, notificacao) for index, notificacao in enumerate(notificacoes)
+            if notificacao['canal'] == 'whatsapp' and notificacao['mensagem']
+        ]
+        tokens = self._whatsapp_tokens(n.get('empresa_id') for _, n in whatsapps)
+        sent = self.send_whatsapp_batch([
+            {'phone': n['destinatario'], 'message': n['mensagem'], 'token': tokens.get(n.get('empresa_id'))}
+            for _, n in whatsapps
+        ])
+        for (index, _), result in zip(whatsapps, sent):
+            results[index] = result
+        
+        for index, notificacao in enumerate(notificacoes):
+            if results[index] is None:
+                results[index] = self.dispatch(notificacao)
+        
+        return results
+    
+    def dispatch(self, notificacao: Dict[str, Any]) -> Dict[str, Any]:
+        """Envia uma notificação da fila pelo seu canal"""
+        if notificacao.get('erro_renderizacao'):
+            return {
+                'success': False,
+                'message': 'Erro no modelo de mensagem',
+                'error': notificacao['erro_renderizacao']
+            }
+        
+        if not notificacao['mensagem']:
+            return {
+                'success': False,
+                'message': 'Mensagem vazia',
+                'error': 'Agendamento da notificação não encontrado'
+            }
+        
+        if notificacao['canal'] == 'email':
+            return self.send_email(
+                notificacao['destinatario'], notificacao['assunto'] or '', notificacao['mensagem'],
+                notificacao.get('mensagem_html')
             )
-            results.append({'type': 'whatsapp', 'result': whatsapp_result})
+        elif notificacao['canal'] == 'whatsapp':
+            return self.send_whatsapp(notificacao['destinatario'], notificacao['mensagem'])
         
         return {
-            'payment_id': pagamento.get('id'),
-            'notifications_sent': results,
-            'total_sent': len([r for r in results if r['result']['success']])
+            'success': False,
+            'message': f"Canal não suportado: {notificacao['canal']}",
+            'error': f"Canal não suportado: {notificacao['canal']}"
         }
     
-    def schedule_reminder(self, agendamento_id: int, send_at: datetime) -> Dict[str, Any]:
-        """Agenda um lembrete para ser enviado"""
-        # Em um sistema real, isso seria salvo no banco de dados
-        # e processado por um job scheduler (Celery, etc.)
+    def requeue_dead_letters(self, empresa_id: int = None, tipo: str = None, canal: str = None,
+                             spread_seconds: int = 300) -> int:
+        """
+        Devolve para a fila as notificações que esgotaram as tentativas
+        
+        O reenvio é feito em um único UPDATE, zerando as tentativas e sorteando o
+        enviar_em de cada linha dentro de `spread_seconds` para não enviar tudo de uma vez.
+        
+        Returns:
+            Quantidade de notificações devolvidas para a fila
+        """
+        now = datetime.now()
+        query = db.session.query(Notificacao).filter(Notificacao.status == 'erro')
+        if empresa_id:
+            query = query.filter(Notificacao.empresa_id == empresa_id)
+        if tipo:
+            query = query.filter(Notificacao.tipo == tipo)
+        if canal:
+            query = query.filter(Notificacao.canal == canal)
+        
+        return query.update({
+            'status': 'pendente',
+            'tentativas': 0,
+            'enviar_em': seconds_after(literal(now), func.abs(func.random()) % (max(int(spread_seconds), 0) + 1)),
+            'atualizado_em': now
+        }, synchronize_session=False)
+    
+    def get_queue_metrics(self, empresa_id: int = None, since: datetime = None) -> Dict[str, Any]:
+        """Contagem de notificações por canal e status, com os envios evitados pelo agrupamento"""
+        query = db.session.query(
+            Notificacao.canal,
+            Notificacao.status,
+            func.count(Notificacao.id)
+        )
+        if empresa_id:
+            query = query.filter(Notificacao.empresa_id == empresa_id)
+        if since:
+            query = query.filter(Notificacao.criado_em >= since)
+        
+        canais = {}
+        for canal, status, total in query.group_by(Notificacao.canal, Notificacao.status):
+            metricas = canais.setdefault(canal, {'total': 0, 'por_status': {}, 'envios_economizados': 0})
+            metricas['total'] += total
+            metricas['por_status'][status] = total
+            if status in ('agrupada', 'duplicada'):
+                metricas['envios_economizados'] += total
+        
+        total = sum(m['total'] for m in canais.values())
+        economizados = sum(m['envios_economizados'] for m in canais.values())
         
         return {
-            'reminder_id': f"reminder_{agendamento_id}_{int(send_at.timestamp())}",
-            'agendamento_id': agendamento_id,
-            'scheduled_for': send_at.isoformat(),
-            'status': 'scheduled'
+            'total_notificacoes': total,
+            'envios_economizados': economizados,
+            'agrupadas': sum(m['por_status'].get('agrupada', 0) for m in canais.values()),
+            'duplicadas': sum(m['por_status'].get('duplicada', 0) for m in canais.values()),
+            'taxa_economia': round(economizados / total * 100, 2) if total else 0,
+            'por_canal': canais
         }
     
     def get_notification_preferences(self, cliente_id: int) -> Dict[str, Any]:
@@ -3,12 +3,39 @@ Serviço de integração com gateways de pagamento
 Suporte para Pix, PagSeguro e Mercado Pago
 """
 
+import hashlib
+import os
+import threading
+import time
 import uuid
 import json
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
 from datetime import datetime, timedelta
-from typing import Dict, Any, Optional
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from typing import Dict, Any, List, Optional
 import requests
 from flask import current_app
+from sqlalchemy import func
+
+from ..models.taxa_gateway import TaxaGateway
+from ..models.user import db
+from .gateway_client import GatewayClient
+from .pix_service import build_brcode
+
+
+# Status que não mudam mais no gateway e por isso nunca são consultados de novo
+FINAL_STATUSES = {'paid', 'cancelled', 'expired'}
+
+GATEWAYS = ['pix', 'pagseguro', 'mercadopago']
+
+CENTAVOS = Decimal('0.01')
+
+# Tabela usada pelas empresas que não cadastraram as próprias taxas
+TAXAS_PADRAO = {
+    'pix': {'percentual': Decimal('0'), 'fixo': Decimal('0'), 'acrescimo_parcela': Decimal('0'), 'parcelas_max': 1},
+    'pagseguro': {'percentual': Decimal('3.99'), 'fixo': Decimal('0'), 'acrescimo_parcela': Decimal('0'), 'parcelas_max': 12},
+    'mercadopago': {'percentual': Decimal('4.99'), 'fixo': Decimal('0'), 'acrescimo_parcela': Decimal('0'), 'parcelas_max': 12}
+}
 
 
 class PaymentService:
@@ -18,6 +45,35 @@ class PaymentService:
         self.pix_enabled = True
         self.pagseguro_enabled = True
         self.mercadopago_enabled = True
+        
+        # Cache de consultas de status: (gateway, payment_id) -> (expira_em, resultado)
+        self.status_ttl = float(os.environ.get('PAGAMENTO_STATUS_TTL', 5))
+        self.status_cache_max = 10000
+        self._status_cache = {}
+        self._status_inflight = {}
+        self._status_lock = threading.Lock()
+        self.status_stats = {'gateway_calls': 0, 'cache_hits': 0, 'coalesced': 0}
+        
+        # Tabelas de taxas por empresa: empresa_id -> (versão, tabela)
+        self._fee_tables = {}
+        self._fee_lock = threading.Lock()
+        
+        # Clientes HTTP dos gateways com URL configurada (<GATEWAY>_API_URL);
+        # os demais continuam simulados
+        self.gateway_clients = {}
+        for gateway in GATEWAYS:
+            base_url = os.environ.get(f'{gateway.upper()}_API_URL')
+            if base_url:
+                self.gateway_clients[gateway] = GatewayClient(
+                    gateway,
+                    base_url,
+                    token=os.environ.get(f'{gateway.upper()}_API_TOKEN'),
+                    connect_timeout=float(os.environ.get('GATEWAY_TIMEOUT_CONEXAO', 3.05)),
+                    read_timeout=float(os.environ.get('GATEWAY_TIMEOUT_LEITURA', 10)),
+                    pool_size=int(os.environ.get('GATEWAY_POOL', 10)),
+                    failure_threshold=int(os.environ.get('GATEWAY_FALHAS_CIRCUITO', 5)),
+                    reset_timeout=float(os.environ.get('GATEWAY_CIRCUITO_SEGUNDOS', 30))
+                )
     
     def create_payment(self, payment_data: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -38,20 +94,48 @@ class PaymentService:
         gateway = payment_data.get('gateway', 'pix')
         
         if gateway == 'pix':
-            return self._create_pix_payment(payment_data)
+            result = self._create_pix_payment(payment_data)
         elif gateway == 'pagseguro':
-            return self._create_pagseguro_payment(payment_data)
+            result = self._create_pagseguro_payment(payment_data)
         elif gateway == 'mercadopago':
-            return self._create_mercadopago_payment(payment_data)
+            result = self._create_mercadopago_payment(payment_data)
         else:
             raise ValueError(f"Gateway não suportado: {gateway}")
+        
+        client = self.gateway_clients.get(gateway)
+        if client:
+            remote = client.post('/payments', json={
+                'reference': result['payment_id'],
+                'amount': payment_data['amount'],
+                'currency': 'BRL',
+                'description': payment_data.get('description'),
+                'customer': payment_data.get('customer')
+            })
+            result['payment_id'] = str(remote.get('payment_id') or remote.get('id') or result['payment_id'])
+            result['status'] = remote.get('status', result['status'])
+        
+        return result
     
     def _create_pix_payment(self, data: Dict[str, Any]) -> Dict[str, Any]:
-        """Cria pagamento PIX"""
-        payment_id = str(uuid.uuid4())
+        """
+        Cria pagamento PIX
+        
+        O BR Code (Copia e Cola) é montado localmente com a chave PIX da empresa,
+        informada em data['merchant'] (chave_pix, nome, cidade); o QR Code é servido
+        pela rota /pagamentos/<id>/qrcode.<png|svg>.
+        """
+        merchant = data.get('merchant') or {}
+        if not merchant.get('chave_pix'):
+            raise ValueError("Empresa sem chave PIX cadastrada")
         
-        # Simular geração de QR Code PIX
-        pix_code = f"00020126580014BR.GOV.BCB.PIX0136{payment_id}520400005303986540{data['amount']:.2f}5802BR5925{data['customer']['nome'][:25]}6009SAO PAULO62070503***6304"
+        payment_id = str(uuid.uuid4())
+        pix_code = build_brcode(
+            merchant['chave_pix'],
+            merchant.get('nome'),
+            merchant.get('cidade'),
+            data['amount'],
+            payment_id
+        )
         
         return {
             'payment_id': payment_id,
@@ -60,7 +144,6 @@ class PaymentService:
             'amount': data['amount'],
             'currency': 'BRL',
             'pix_code': pix_code,
-            'qr_code_url': f"https://api.qrserver.com/v1/create-qr-code/?size=200x200&data={pix_code}",
             'expires_at': (datetime.now() + timedelta(minutes=30)).isoformat(),
             'created_at': datetime.now().isoformat(),
             'agendamento_id': data.get('agendamento_id')
@@ -105,9 +188,24 @@ class PaymentService:
         }
     
     def check_payment_status(self, payment_id: str, gateway: str) -> Dict[str, Any]:
-        """Verifica status de um pagamento"""
-        # Em um sistema real, consultaria a API do gateway
-        # Por enquanto, simular diferentes status
+        """
+        Verifica status de um pagamento
+        
+        Raises:
+            GatewayUnavailableError: circuito do gateway aberto
+            requests.RequestException: falha ou timeout na consulta
+        """
+        client = self.gateway_clients.get(gateway)
+        if client:
+            remote = client.get(f'/payments/{payment_id}')
+            return {
+                'payment_id': payment_id,
+                'gateway': gateway,
+                'status': remote.get('status'),
+                'updated_at': remote.get('updated_at') or datetime.now().isoformat()
+            }
+        
+        # Gateway sem URL configurada: simular diferentes status
         import random
         
         statuses = ['pending', 'paid', 'cancelled', 'expired']
@@ -120,20 +218,93 @@ class PaymentService:
             'updated_at': datetime.now().isoformat()
         }
     
+    def get_payment_status(self, payment_id: str, gateway: str) -> Dict[str, Any]:
+        """
+        Consulta o status com cache de curta duração e coalescência das consultas simultâneas
+        
+        Chamadas concorrentes para o mesmo pagamento aguardam uma única consulta ao
+        gateway; o resultado fica em cache por `status_ttl` segundos, ou indefinidamente
+        quando o status é final. Pagamentos sem id externo são consultados sem cache, já
+        que não há chave que os distinga. A espera por uma consulta em andamento é
+        limitada aos timeouts de conexão e leitura do cliente do gateway.
+        """
+        if not payment_id:
+            self.status_stats['gateway_calls'] += 1
+            return self.check_payment_status(payment_id, gateway)
+        
+        key = (gateway, payment_id)
+        
+        with self._status_lock:
+            cached = self._status_cache.get(key)
+            if cached and cached[0] > time.monotonic():
+                self.status_stats['cache_hits'] += 1
+                return cached[1]
+            
+            inflight = self._status_inflight.get(key)
+            leader = inflight is None
+            if leader:
+                inflight = self._status_inflight[key] = Future()
+            else:
+                self.status_stats['coalesced'] += 1
+        
+        if not leader:
+            client = self.gateway_clients.get(gateway)
+            espera = sum(client.timeout) if client else float(os.environ.get('GATEWAY_TIMEOUT_LEITURA', 10))
+            try:
+                return inflight.result(timeout=espera)
+            except FutureTimeoutError:
+                raise requests.Timeout(
+                    f'Consulta de status do pagamento {payment_id} no gateway {gateway} sem resposta em {espera:g}s'
+                )
+        
+        try:
+            self.status_stats['gateway_calls'] += 1
+            result = self.check_payment_status(payment_id, gateway)
+        except Exception as e:
+            with self._status_lock:
+                del self._status_inflight[key]
+            inflight.set_exception(e)
+            raise
+        
+        expires_at = float('inf') if result.get('status') in FINAL_STATUSES else time.monotonic() + self.status_ttl
+        with self._status_lock:
+            if len(self._status_cache) >= self.status_cache_max:
+                now = time.monotonic()
+                self._status_cache = {k: v for k, v in self._status_cache.items() if v[0] > now}
+            self._status_cache[key] = (expires_at, result)
+            del self._status_inflight[key]
+        
+        inflight.set_result(result)
+        return result
+    
     def process_webhook(self, gateway: str, webhook_data: Dict[str, Any]) -> Dict[str, Any]:
-        """Processa webhook de notificação de pagamento"""
+        """
+        Processa webhook de notificação de pagamento
+        
+        O resultado inclui event_id, que identifica a entrega para descartar repetições:
+        o id do evento enviado pelo gateway ou, na falta dele, um hash do corpo recebido.
+        """
         if gateway == 'pix':
-            return self._process_pix_webhook(webhook_data)
+            result = self._process_pix_webhook(webhook_data)
         elif gateway == 'pagseguro':
-            return self._process_pagseguro_webhook(webhook_data)
+            result = self._process_pagseguro_webhook(webhook_data)
         elif gateway == 'mercadopago':
-            return self._process_mercadopago_webhook(webhook_data)
+            result = self._process_mercadopago_webhook(webhook_data)
         else:
             raise ValueError(f"Gateway não suportado: {gateway}")
+        
+        if not result.get('event_id'):
+            body = json.dumps(webhook_data, sort_keys=True, separators=(',', ':'), default=str)
+            result['event_id'] = hashlib.sha256(body.encode('utf-8')).hexdigest()
+        else:
+            result['event_id'] = str(result['event_id'])
+        
+        return result
     
     def _process_pix_webhook(self, data: Dict[str, Any]) -> Dict[str, Any]:
         """Processa webhook PIX"""
         return {
+            'event_id': data.get('endToEndId') or data.get('event_id'),
             'payment_id': data.get('payment_id'),
             'status': data.get('status', 'paid'),
             'amount': data.get('amount'),
@@ -143,6 +314,7 @@ class PaymentService:
     def _process_pagseguro_webhook(self, data: Dict[str, Any]) -> Dict[str, Any]:
         """Processa webhook PagSeguro"""
         return {
+            'event_id': data.get('notificationCode') or data.get('event_id'),
             'payment_id': data.get('payment_id'),
             'status': data.get('status', 'paid'),
             'amount': data.get('amount'),
@@ -152,12 +324,21 @@ class PaymentService:
     def _process_mercadopago_webhook(self, data: Dict[str, Any]) -> Dict[str, Any]:
         """Processa webhook Mercado Pago"""
         return {
+            'event_id': data.get('id') or data.get('event_id'),
             'payment_id': data.get('payment_id'),
             'status': data.get('status', 'paid'),
             'amount': data.get('amount'),
             'paid_at': datetime.now().isoformat()
         }
     
+    def get_gateway_metrics(self) -> list:
+        """Latência, erros e estado do circuito de cada gateway"""
+        return [
+            self.gateway_clients[gateway].metrics() if gateway in self.gateway_clients
+            else {'gateway': gateway, 'simulado': True}
+            for gateway in GATEWAYS
+        ]
+    
     def get_available_gateways(self) -> list:
         """Retorna lista de gateways disponíveis"""
         gateways = []
@@ -191,22 +372,124 @@ class PaymentService:
         
         return gateways
     
-    def calculate_fees(self, amount: float, gateway: str) -> Dict[str, float]:
-        """Calcula taxas do gateway"""
-        fees = {
-            'pix': 0.0,  # PIX sem taxa
-            'pagseguro': amount * 0.0399,  # 3.99%
-            'mercadopago': amount * 0.0499  # 4.99%
-        }
+    def get_fee_table(self, empresa_id: Optional[int]) -> Dict[str, Dict[str, Any]]:
+        """
+        Tabela de taxas da empresa (padrão para os gateways que ela não personalizou)
+        
+        Fica em cache por processo e é recarregada quando a versão gravada muda
+        (última alteração e quantidade de taxas personalizadas, lidas em uma consulta),
+        de modo que uma edição feita em outro worker vale na próxima cotação.
+        """
+        versao = None
+        if empresa_id:
+            versao = tuple(db.session.query(
+                func.max(TaxaGateway.atualizado_em), func.count(TaxaGateway.id)
+            ).filter(TaxaGateway.empresa_id == empresa_id).one())
+        
+        with self._fee_lock:
+            cached = self._fee_tables.get(empresa_id)
+        if cached and cached[0] == versao:
+            return cached[1]
+        
+        table = {gateway: dict(taxas) for gateway, taxas in TAXAS_PADRAO.items()}
+        if empresa_id:
+            for taxa in TaxaGateway.query.filter_by(empresa_id=empresa_id):
+                table[taxa.gateway] = {
+                    'percentual': Decimal(taxa.percentual),
+                    'fixo': Decimal(taxa.fixo),
+                    'acrescimo_parcela': Decimal(taxa.acrescimo_parcela),
+                    'parcelas_max': taxa.parcelas_max
+                }
         
-        fee = fees.get(gateway, 0.0)
-        net_amount = amount - fee
+        with self._fee_lock:
+            self._fee_tables[empresa_id] = (versao, table)
+        return table
+    
+    def invalidate_fee_table(self, empresa_id: int):
+        """Descarta a tabela deste processo (os demais detectam a alteração pela versão)"""
+        with self._fee_lock:
+            self._fee_tables.pop(empresa_id, None)
+    
+    def quote_fees(self, empresa_id: Optional[int], items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Calcula as taxas de vários valores de uma vez, em Decimal
+        
+        Args:
+            empresa_id: Empresa cuja tabela de taxas será usada (None = tabela padrão)
+            items: Lista de dicts com amount, gateway e installments (opcional, padrão 1)
+        
+        Returns:
+            Lista de cotações na mesma ordem; itens inválidos trazem 'erro' em vez dos valores
+        """
+        table = self.get_fee_table(empresa_id)
+        quotes = []
+        
+        for item in items:
+            if not isinstance(item, dict):
+                quotes.append({'gateway': None, 'erro': 'Item deve ser um objeto com amount e gateway'})
+                continue
+            
+            gateway = item.get('gateway')
+            if not isinstance(gateway, str):
+                quotes.append({'gateway': None, 'erro': 'Gateway deve ser um texto'})
+                continue
+            
+            taxas = table.get(gateway)
+            try:
+                amount = Decimal(str(item['amount']))
+                parcelas = Decimal(str(item.get('installments') or 1))
+                # NaN e infinito passariam pelo quantize e quebrariam as comparações abaixo
+                if not amount.is_finite() or not parcelas.is_finite() or parcelas != parcelas.to_integral_value():
+                    raise ValueError('valor ou parcelas inválidos')
+                amount = amount.quantize(CENTAVOS, ROUND_HALF_UP)
+                installments = int(parcelas)
+            except (KeyError, TypeError, ValueError, InvalidOperation):
+                quotes.append({'gateway': gateway, 'erro': 'Valor ou parcelas inválidos'})
+                continue
+            
+            if taxas is None:
+                quotes.append({'gateway': gateway, 'erro': f'Gateway não suportado: {gateway}'})
+                continue
+            if amount <= 0 or not 1 <= installments <= taxas['parcelas_max']:
+                quotes.append({
+                    'gateway': gateway,
+                    'erro': f"Valor deve ser positivo e parcelas entre 1 e {taxas['parcelas_max']}"
+                })
+                continue
+            
+            percentual = taxas['percentual'] + taxas['acrescimo_parcela'] * (installments - 1)
+            fee = (amount * percentual / 100 + taxas['fixo']).quantize(CENTAVOS, ROUND_HALF_UP)
+            
+            quotes.append({
+                'gateway': gateway,
+                'installments': installments,
+                'gross_amount': amount,
+                'fee': fee,
+                'net_amount': amount - fee,
+                'installment_amount': (amount / installments).quantize(CENTAVOS, ROUND_HALF_UP),
+                'fee_percentage': (fee / amount * 100).quantize(CENTAVOS, ROUND_HALF_UP)
+            })
+        
+        return quotes
+    
+    def calculate_fees(self, amount: float, gateway: str, empresa_id: Optional[int] = None) -> Dict[str, float]:
+        """
+        Calcula taxas do gateway
+        
+        Raises:
+            ValueError: a tabela da empresa não permite cotar o valor (ex.: parcelas_max = 0)
+        """
+        if gateway not in TAXAS_PADRAO or amount <= 0:
+            return {'gross_amount': amount, 'fee': 0.0, 'net_amount': amount, 'fee_percentage': 0}
         
+        quote = self.quote_fees(empresa_id, [{'amount': amount, 'gateway': gateway}])[0]
+        if 'erro' in quote:
+            raise ValueError(quote['erro'])
         return {
-            'gross_amount': amount,
-            'fee': fee,
-            'net_amount': net_amount,
-            'fee_percentage': (fee / amount * 100) if amount > 0 else 0
+            'gross_amount': float(quote['gross_amount']),
+            'fee': float(quote['fee']),
+            'net_amount': float(quote['net_amount']),
+            'fee_percentage': float(quote['fee_percentage'])
         }
 
 
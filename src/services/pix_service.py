@@ -0,0 +1,151 @@
+"""
+Geração local do PIX Copia e Cola (BR Code) e do QR Code
+Monta o payload EMV com CRC16-CCITT por tabela e renderiza o QR em PNG/SVG
+no próprio processo, sem depender de serviços externos
+"""
+
+import io
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Optional, Tuple
+
+try:
+    import segno
+except ImportError:  # renderização do QR Code indisponível; o código Copia e Cola continua funcionando
+    segno = None
+
+
+def _crc16_table():
+    table = []
+    for byte in range(256):
+        crc = byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else (crc << 1)
+        table.append(crc & 0xFFFF)
+    return table
+
+
+_CRC16_TABLE = _crc16_table()
+
+
+def crc16(data: bytes) -> int:
+    """CRC16-CCITT (polinômio 0x1021, valor inicial 0xFFFF), exigido pelo campo 63 do BR Code"""
+    crc = 0xFFFF
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFF) ^ _CRC16_TABLE[(crc >> 8) ^ byte]
+    return crc
+
+
+def _tlv(field_id: str, value: str) -> str:
+    return f'{field_id}{len(value):02d}{value}'
+
+
+def _ascii(texto: str, limite: int) -> str:
+    """Remove acentos e caracteres fora do conjunto aceito pelos bancos e aplica o limite do campo"""
+    texto = unicodedata.normalize('NFKD', texto or '').encode('ascii', 'ignore').decode('ascii')
+    texto = re.sub(r'[^A-Za-z0-9 .,/-]', '', texto).strip().upper()
+    return texto[:limite]
+
+
+def txid(payment_id: str) -> str:
+    """Identificador da transação: até 25 caracteres alfanuméricos"""
+    return re.sub(r'[^A-Za-z0-9]', '', payment_id)[:25] or '***'
+
+
+@lru_cache(maxsize=4096)
+def merchant_fields(chave: str, nome: str, cidade: str) -> Tuple[str, str]:
+    """
+    Trechos fixos do payload de um recebedor, calculados uma vez por empresa
+
+    Returns:
+        (campos 00 a 53, campos 58 a 60); o valor (54) fica entre os dois
+    """
+    conta = _tlv('00', 'br.gov.bcb.pix') + _tlv('01', chave.strip())
+    prefixo = (
+        _tlv('00', '01')
+        + _tlv('26', conta)
+        + _tlv('52', '0000')
+        + _tlv('53', '986')
+    )
+    recebedor = (
+        _tlv('58', 'BR')
+        + _tlv('59', _ascii(nome, 25) or 'RECEBEDOR')
+        + _tlv('60', _ascii(cidade, 15) or 'SAO PAULO')
+    )
+    return prefixo, recebedor
+
+
+def build_brcode(chave: str, nome: str, cidade: str, valor: Optional[float], payment_id: str) -> str:
+    """Monta o PIX Copia e Cola de uma cobrança, já com o CRC"""
+    prefixo, recebedor = merchant_fields(chave, nome, cidade)
+    payload = (
+        prefixo
+        + (_tlv('54', f'{valor:.2f}') if valor else '')
+        + recebedor
+        + _tlv('62', _tlv('05', txid(payment_id)))
+        + '6304'
+    )
+    return payload + f'{crc16(payload.encode("utf-8")):04X}'
+
+
+class QRCodeCache:
+    """Imagens de QR Code já renderizadas, por (pagamento, formato), com descarte do uso mais antigo"""
+
+    CONTENT_TYPES = {'png': 'image/png', 'svg': 'image/svg+xml'}
+
+    def __init__(self, max_items: int = 1000):
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'renders': 0, 'hits': 0}
+
+    @staticmethod
+    def available() -> bool:
+        return segno is not None
+
+    @staticmethod
+    def _render(code: str, formato: str) -> bytes:
+        qr = segno.make(code, error='m', micro=False)
+        buffer = io.BytesIO()
+        if formato == 'png':
+            qr.save(buffer, kind='png', scale=6, border=2)
+        else:
+            qr.save(buffer, kind='svg', scale=6, border=2, xmldecl=False)
+        return buffer.getvalue()
+
+    def get(self, pagamento_id: int, code: str, formato: str) -> bytes:
+        """
+        Imagem do QR Code do pagamento
+
+        Raises:
+            RuntimeError: biblioteca segno não instalada
+            ValueError: formato não suportado
+        """
+        if formato not in self.CONTENT_TYPES:
+            raise ValueError(f'Formato não suportado: {formato}')
+        if segno is None:
+            raise RuntimeError('Geração de QR Code indisponível: instale o pacote segno')
+
+        key = (pagamento_id, formato)
+        with self._lock:
+            cached = self._items.get(key)
+            if cached and cached[0] == code:
+                self._items.move_to_end(key)
+                self.stats['hits'] += 1
+                return cached[1]
+
+        image = self._render(code, formato)
+        with self._lock:
+            self.stats['renders'] += 1
+            self._items[key] = (code, image)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+        return image
+
+
+# Instância global do cache de QR Codes
+qrcode_cache = QRCodeCache()
@@ -0,0 +1,148 @@
+"""
+Pool de conexões SMTP persistentes
+Mantém conexões autenticadas abertas e reaproveita cada uma para vários emails
+"""
+
+import smtplib
+import threading
+import time
+from contextlib import contextmanager
+from email.message import Message
+from typing import Dict, Any, List, Optional
+
+
+class SMTPConnectionPool:
+    """Pool de conexões SMTP com limite de tamanho, expiração por ociosidade e reconexão"""
+
+    def __init__(self, host: str, port: int, username: Optional[str] = None, password: Optional[str] = None,
+                 starttls: bool = True, max_size: int = 4, idle_timeout: float = 60.0, timeout: float = 10.0):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+
+        self._idle = []  # pilha de (conexão, último uso)
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self.stats = {'connections_opened': 0, 'connections_reused': 0, 'reconnects': 0, 'messages_sent': 0}
+
+    def _connect(self) -> smtplib.SMTP:
+        conn = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        conn.ehlo()
+        if self.starttls:
+            conn.starttls()
+            conn.ehlo()
+        if self.username:
+            conn.login(self.username, self.password)
+        self.stats['connections_opened'] += 1
+        return conn
+
+    @staticmethod
+    def _close(conn: smtplib.SMTP):
+        try:
+            conn.quit()
+        except Exception:
+            conn.close()
+
+    def _acquire(self) -> smtplib.SMTP:
+        self._slots.acquire()
+        try:
+            now = time.monotonic()
+            while True:
+                with self._lock:
+                    if not self._idle:
+                        break
+                    conn, last_used = self._idle.pop()
+                if now - last_used < self.idle_timeout:
+                    self.stats['connections_reused'] += 1
+                    return conn
+                self._close(conn)
+            return self._connect()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _release(self, conn: Optional[smtplib.SMTP]):
+        if conn is not None:
+            with self._lock:
+                self._idle.append((conn, time.monotonic()))
+        self._slots.release()
+
+    @staticmethod
+    def is_connection_error(error: Exception) -> bool:
+        """Indica se o erro é de transporte (conexão perdida) e não uma recusa do servidor"""
+        if isinstance(error, smtplib.SMTPServerDisconnected):
+            return True
+        # SMTPException herda de OSError; as demais recusas não invalidam a conexão
+        return isinstance(error, OSError) and not isinstance(error, smtplib.SMTPException)
+
+    @contextmanager
+    def connection(self):
+        """Empresta uma conexão do pool; conexões com erro de transporte são descartadas"""
+        conn = self._acquire()
+        try:
+            yield conn
+        except Exception as e:
+            if self.is_connection_error(e):
+                self._close(conn)
+                conn = None
+            raise
+        finally:
+            self._release(conn)
+
+    def send_messages(self, messages: List[Message]) -> List[Dict[str, Any]]:
+        """
+        Envia vários emails pela mesma conexão autenticada
+
+        Se a conexão cair no meio do lote, uma nova é aberta e o envio continua a partir
+        da mensagem que falhou (uma nova tentativa por mensagem).
+
+        Returns:
+            Lista com o resultado de cada mensagem, na mesma ordem
+        """
+        results = []
+        index = 0
+        retried = -1
+
+        while index < len(messages):
+            connected = False
+            try:
+                with self.connection() as conn:
+                    connected = True
+                    while index < len(messages):
+                        try:
+                            refused = conn.send_message(messages[index])
+                            results.append({'success': True, 'refused': list(refused)})
+                            self.stats['messages_sent'] += 1
+                        except smtplib.SMTPException as e:
+                            if self.is_connection_error(e):
+                                raise
+                            results.append({'success': False, 'error': str(e)})
+                        index += 1
+            except OSError as e:
+                if retried != index:
+                    retried = index
+                    self.stats['reconnects'] += 1
+                elif connected:
+                    results.append({'success': False, 'error': str(e)})
+                    index += 1
+                else:
+                    # Não foi possível abrir conexão (servidor fora ou login recusado): falhar o restante
+                    results.extend({'success': False, 'error': str(e)} for _ in messages[index:])
+                    index = len(messages)
+
+        return results
+
+    def send_message(self, msg: Message) -> Dict[str, Any]:
+        return self.send_messages([msg])[0]
+
+    def close_all(self):
+        """Fecha todas as conexões ociosas"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._close(conn)
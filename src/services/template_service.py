@@ -0,0 +1,321 @@
+"""
+Registro de modelos de mensagens de notificação
+Compila os templates Jinja2 uma única vez e os mantém em cache por
+(empresa_id, tipo, canal), com modelos padrão para empresas sem personalização
+"""
+
+import threading
+from typing import Dict, Any, List, Optional, Tuple
+
+from jinja2 import StrictUndefined, TemplateError
+from jinja2.sandbox import SandboxedEnvironment
+
+from ..models.modelo_notificacao import ModeloNotificacao
+from ..models.user import db
+
+
+TIPOS = ['confirmacao', 'lembrete', 'pagamento_aprovado', 'pagamento_problema']
+CANAIS = ['email', 'whatsapp']
+
+MODELOS_PADRAO = {
+    ('confirmacao', 'email'): (
+        "Agendamento Confirmado - AgendaOnline",
+        """
+Olá {{ cliente_nome }},
+
+Seu agendamento foi confirmado com sucesso!
+
+📅 Data e Hora: {{ data_formatada }}
+👤 Profissional: {{ profissional_nome }}
+💼 Serviço: {{ servico_nome }}
+💰 Valor: R$ {{ valor|moeda }}
+
+Endereço:
+{{ endereco }}
+
+Em caso de dúvidas, entre em contato conosco.
+
+Atenciosamente,
+Equipe AgendaOnline
+        """
+    ),
+    ('confirmacao', 'whatsapp'): (
+        None,
+        """
+🎉 *Agendamento Confirmado!*
+
+Olá {{ cliente_nome }}!
+
+📅 *Data:* {{ data_formatada }}
+👤 *Profissional:* {{ profissional_nome }}
+💼 *Serviço:* {{ servico_nome }}
+💰 *Valor:* R$ {{ valor|moeda }}
+
+Nos vemos em breve! 😊
+        """
+    ),
+    ('lembrete', 'email'): (
+        "Lembrete: Seu agendamento é amanhã - AgendaOnline",
+        """
+Olá {{ cliente_nome }},
+
+Este é um lembrete do seu agendamento:
+
+📅 Data e Hora: {{ data_formatada }}
+👤 Profissional: {{ profissional_nome }}
+💼 Serviço: {{ servico_nome }}
+💰 Valor: R$ {{ valor|moeda }}
+
+Endereço:
+{{ endereco }}
+
+Caso precise cancelar ou reagendar, entre em contato conosco com antecedência.
+
+Atenciosamente,
+Equipe AgendaOnline
+        """
+    ),
+    ('lembrete', 'whatsapp'): (
+        None,
+        """
+⏰ *Lembrete de Agendamento*
+
+Olá {{ cliente_nome }}!
+
+Seu agendamento é amanhã:
+
+📅 *{{ data_formatada }}*
+👤 *Profissional:* {{ profissional_nome }}
+💼 *Serviço:* {{ servico_nome }}
+
+Nos vemos em breve! 😊
+
+Para cancelar ou reagendar, responda esta mensagem.
+        """
+    ),
+    ('pagamento_aprovado', 'email'): (
+        "Pagamento Confirmado - AgendaOnline",
+        """
+Olá {{ cliente_nome }},
+
+Seu pagamento foi confirmado com sucesso!
+
+💰 Valor: R$ {{ valor|moeda }}
+💳 Método: {{ metodo }}
+📅 Agendamento: {{ data_agendamento }}
+
+Obrigado pela preferência!
+
+Atenciosamente,
+Equipe AgendaOnline
+            """
+    ),
+    ('pagamento_aprovado', 'whatsapp'): (
+        None,
+        """
+✅ *Pagamento Confirmado!*
+
+Olá {{ cliente_nome }}!
+
+💰 *Valor:* R$ {{ valor|moeda }}
+💳 *Método:* {{ metodo }}
+
+Seu agendamento está confirmado! 🎉
+            """
+    ),
+    ('pagamento_problema', 'email'): (
+        "Problema com Pagamento - AgendaOnline",
+        """
+Olá {{ cliente_nome }},
+
+Identificamos um problema com seu pagamento.
+
+💰 Valor: R$ {{ valor|moeda }}
+💳 Método: {{ metodo }}
+📅 Agendamento: {{ data_agendamento }}
+
+Por favor, entre em contato conosco para resolver a situação.
+
+Atenciosamente,
+Equipe AgendaOnline
+            """
+    ),
+    ('pagamento_problema', 'whatsapp'): (
+        None,
+        """
+⚠️ *Problema com Pagamento*
+
+Olá {{ cliente_nome }}!
+
+Identificamos um problema com seu pagamento de R$ {{ valor|moeda }}.
+
+Entre em contato conosco para resolver.
+            """
+    ),
+}
+
+
+# Contexto de exemplo de cada tipo, com as mesmas variáveis que o serviço de notificações
+# fornece; usado para validar os modelos das empresas antes de gravar
+_CONTEXTO_AGENDAMENTO = {
+    'cliente_nome': 'Maria Silva',
+    'data_formatada': '10/03/2025 às 14:30',
+    'profissional_nome': 'Ana',
+    'servico_nome': 'Corte',
+    'valor': 50.0,
+    'empresa_nome': 'Salão Exemplo',
+    'endereco': 'Rua Exemplo, 100'
+}
+_CONTEXTO_PAGAMENTO = {
+    'cliente_nome': 'Maria Silva',
+    'valor': 50.0,
+    'metodo': 'PIX',
+    'data_agendamento': '2025-03-10T14:30:00'
+}
+CONTEXTOS_EXEMPLO = {
+    'confirmacao': _CONTEXTO_AGENDAMENTO,
+    'lembrete': _CONTEXTO_AGENDAMENTO,
+    'pagamento_aprovado': _CONTEXTO_PAGAMENTO,
+    'pagamento_problema': _CONTEXTO_PAGAMENTO,
+}
+
+
+def _moeda(valor) -> str:
+    return f"{float(valor or 0):.2f}"
+
+
+class TemplateRegistry:
+    """Cache de templates compilados por (empresa_id, tipo, canal)"""
+
+    def __init__(self):
+        # Ambiente isolado: os templates são editados pelas empresas
+        self.env = SandboxedEnvironment(autoescape=False)
+        self.env.filters['moeda'] = _moeda
+        # Na validação, variáveis inexistentes (ex.: {{ cliente.nome }}) são erro em vez de texto vazio
+        self.env_validacao = SandboxedEnvironment(autoescape=False, undefined=StrictUndefined)
+        self.env_validacao.filters['moeda'] = _moeda
+
+        self._padrao = {
+            chave: self._compilar(assunto, corpo)
+            for chave, (assunto, corpo) in MODELOS_PADRAO.items()
+        }
+        self._cache = {}  # (empresa_id, tipo, canal) -> (versão, assunto, corpo)
+        self._lock = threading.Lock()
+        self.stats = {'compilacoes': 0, 'acertos': 0}
+
+    @staticmethod
+    def normalizar_tipo(tipo: str) -> str:
+        """Os lembretes são gravados como lembrete_<h>h e compartilham o modelo 'lembrete'"""
+        return 'lembrete' if tipo.startswith('lembrete') else tipo
+
+    def _compilar(self, assunto: Optional[str], corpo: str):
+        return (
+            self.env.from_string(assunto) if assunto else None,
+            self.env.from_string(corpo)
+        )
+
+    def validar(self, tipo: str, assunto: Optional[str], corpo: str):
+        """
+        Compila e renderiza o modelo com o contexto de exemplo do tipo antes de gravar
+
+        Raises:
+            TemplateSyntaxError: erro de sintaxe
+            ValueError: variável inexistente ou erro ao renderizar
+        """
+        self._compilar(assunto, corpo)
+        contexto = CONTEXTOS_EXEMPLO[self.normalizar_tipo(tipo)]
+        for texto in (assunto, corpo):
+            if not texto:
+                continue
+            try:
+                self.env_validacao.from_string(texto).render(contexto)
+            except TemplateError as e:
+                raise ValueError(
+                    f"Modelo inválido: {e}. Variáveis disponíveis: {', '.join(sorted(contexto))}"
+                ) from e
+
+    def _versoes(self, chaves) -> Dict[Tuple[int, str, str], Any]:
+        """Versão (atualizado_em) dos modelos personalizados das chaves informadas, em uma consulta"""
+        empresas = {empresa_id for empresa_id, _, _ in chaves if empresa_id}
+        if not empresas:
+            return {}
+
+        rows = db.session.query(
+            ModeloNotificacao.empresa_id,
+            ModeloNotificacao.tipo,
+            ModeloNotificacao.canal,
+            ModeloNotificacao.atualizado_em
+        ).filter(
+            ModeloNotificacao.empresa_id.in_(empresas),
+            ModeloNotificacao.tipo.in_({tipo for _, tipo, _ in chaves})
+        )
+        return {(row.empresa_id, row.tipo, row.canal): row.atualizado_em for row in rows}
+
+    def _templates(self, chave: Tuple[int, str, str], versao):
+        """Templates compilados da chave; recompila apenas quando a versão gravada mudou"""
+        if versao is None:
+            return self._padrao[chave[1:]]
+
+        with self._lock:
+            entrada = self._cache.get(chave)
+        if entrada and entrada[0] == versao:
+            self.stats['acertos'] += 1
+            return entrada[1:]
+
+        modelo = ModeloNotificacao.query.filter_by(empresa_id=chave[0], tipo=chave[1], canal=chave[2]).first()
+        if not modelo:
+            return self._padrao[chave[1:]]
+
+        assunto, corpo = self._compilar(modelo.assunto, modelo.corpo)
+        self.stats['compilacoes'] += 1
+        with self._lock:
+            self._cache[chave] = (modelo.atualizado_em, assunto, corpo)
+        return assunto, corpo
+
+    def render_batch(self, itens: List[Dict[str, Any]]) -> List[Tuple[Optional[str], Optional[str], Optional[str]]]:
+        """
+        Renderiza várias mensagens de uma vez
+
+        Args:
+            itens: Lista de dicts com empresa_id, tipo, canal e contexto
+
+        Returns:
+            Lista de (assunto, corpo, erro) na mesma ordem; o assunto é None sem modelo de
+            assunto. Um modelo que falha ao renderizar afeta só os seus itens, que voltam
+            com assunto e corpo None e a mensagem do erro
+        """
+        chaves = [(item.get('empresa_id'), self.normalizar_tipo(item['tipo']), item['canal']) for item in itens]
+        versoes = self._versoes(set(chaves))
+        compilados = {chave: self._templates(chave, versoes.get(chave)) for chave in set(chaves)}
+
+        resultado = []
+        for chave, item in zip(chaves, itens):
+            assunto, corpo = compilados[chave]
+            try:
+                resultado.append((
+                    assunto.render(item['contexto']) if assunto else None,
+                    corpo.render(item['contexto']),
+                    None
+                ))
+            except Exception as e:
+                resultado.append((None, None, f'Erro ao renderizar o modelo {chave[1]}/{chave[2]}: {e}'))
+        return resultado
+
+    def render(self, empresa_id: Optional[int], tipo: str, canal: str,
+               contexto: Dict[str, Any]) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+        return self.render_batch([{'empresa_id': empresa_id, 'tipo': tipo, 'canal': canal, 'contexto': contexto}])[0]
+
+    def modelo_padrao(self, tipo: str, canal: str) -> Dict[str, Any]:
+        assunto, corpo = MODELOS_PADRAO[(tipo, canal)]
+        return {'tipo': tipo, 'canal': canal, 'assunto': assunto, 'corpo': corpo, 'padrao': True}
+
+    def invalidate(self, empresa_id: int, tipo: str = None, canal: str = None):
+        """Descarta do cache os modelos editados (os demais processos detectam pela versão)"""
+        with self._lock:
+            for chave in list(self._cache):
+                if chave[0] == empresa_id and tipo in (None, chave[1]) and canal in (None, chave[2]):
+                    del self._cache[chave]
+
+
+# Instância global do registro de modelos
+template_registry = TemplateRegistry()
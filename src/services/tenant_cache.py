@@ -0,0 +1,195 @@
+"""
+Cache das configurações das empresas compartilhado entre os workers
+As configurações ficam em um banco SQLite local (modo WAL, lido por mmap), de
+modo que todos os processos do gunicorn usam a mesma cópia. Cada entrada guarda
+a versão da empresa (Empresa.versao); uma alteração grava uma marca com a nova
+versão, que descarta a entrada e impede que um worker com a leitura antiga a
+grave de volta
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+
+CAMINHO_PADRAO = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database', 'cache_empresas.db')
+
+
+class TenantConfigCache:
+    """Cache de leitura (read-through) das configurações por empresa"""
+
+    def __init__(self, path: Optional[str] = None, ttl: Optional[float] = None, mmap_size: int = 64 * 1024 * 1024):
+        self.path = path or os.environ.get('EMPRESA_CACHE_PATH', CAMINHO_PADRAO)
+        # Entradas e marcas de invalidação expiram: limita o efeito de uma gravação
+        # que não passou pelas rotas (ex.: SQL manual) e de ids reaproveitados
+        self.ttl = ttl if ttl is not None else float(os.environ.get('EMPRESA_CACHE_TTL', 300))
+        self.mmap_size = mmap_size
+        # Contadores de processos que não publicam há mais que isso (ex.: workers
+        # reciclados pelo gunicorn) saem do relatório
+        self.stats_retention = float(os.environ.get('EMPRESA_CACHE_STATS_RETENCAO', 3600))
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'stores': 0, 'invalidations': 0}
+        self._pendentes = 0
+        self._publicado_em = time.monotonic()
+
+    def _conn(self) -> sqlite3.Connection:
+        # Uma conexão por thread e por processo: conexões abertas antes do fork não são reutilizadas
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA mmap_size={int(self.mmap_size)}')
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS configuracoes (
+                empresa_id INTEGER PRIMARY KEY,
+                versao INTEGER NOT NULL,
+                dados TEXT,
+                expira_em REAL NOT NULL
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS estatisticas (
+                pid INTEGER PRIMARY KEY,
+                hits INTEGER NOT NULL,
+                misses INTEGER NOT NULL,
+                stores INTEGER NOT NULL,
+                invalidations INTEGER NOT NULL,
+                atualizado_em REAL NOT NULL
+            )
+        """)
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def _contar(self, evento: str):
+        with self._lock:
+            self._stats[evento] += 1
+            self._pendentes += 1
+            publicar = self._pendentes >= 100 or time.monotonic() - self._publicado_em >= 10
+        if publicar:
+            self._publicar_stats()
+
+    def _publicar_stats(self):
+        """
+        Grava os contadores deste processo no banco do cache, para o relatório somar todos os workers
+
+        Feito a cada 100 eventos ou 10 segundos, não a cada leitura, para que um acerto não vire uma escrita.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            self._pendentes = 0
+            self._publicado_em = time.monotonic()
+        conn = self._conn()
+        agora = time.time()
+        conn.execute('DELETE FROM estatisticas WHERE atualizado_em < ?', (agora - self.stats_retention,))
+        conn.execute("""
+            INSERT INTO estatisticas (pid, hits, misses, stores, invalidations, atualizado_em)
+            VALUES (:pid, :hits, :misses, :stores, :invalidations, :agora)
+            ON CONFLICT (pid) DO UPDATE SET
+                hits = excluded.hits, misses = excluded.misses, stores = excluded.stores,
+                invalidations = excluded.invalidations, atualizado_em = excluded.atualizado_em
+        """, dict(stats, pid=os.getpid(), agora=agora))
+
+    def get(self, empresa_id: int, loader: Callable[[int], Optional[Tuple[int, Dict[str, Any]]]]) -> Optional[Dict[str, Any]]:
+        """
+        Configurações da empresa, lidas do cache ou carregadas e gravadas nele
+
+        Args:
+            empresa_id: ID da empresa
+            loader: Função que lê a empresa do banco e devolve (versão, dados), ou None se não existir
+
+        Returns:
+            Dados da empresa ou None se ela não existir
+        """
+        row = self._conn().execute(
+            'SELECT dados FROM configuracoes WHERE empresa_id = ? AND expira_em > ?',
+            (empresa_id, time.time())
+        ).fetchone()
+        if row and row[0] is not None:
+            self._contar('hits')
+            return json.loads(row[0])
+
+        self._contar('misses')
+        carregado = loader(empresa_id)
+        if carregado is None:
+            return None
+
+        versao, dados = carregado
+        self._gravar(empresa_id, versao, json.dumps(dados, ensure_ascii=False))
+        self._contar('stores')
+        return dados
+
+    def _gravar(self, empresa_id: int, versao: int, dados: Optional[str]):
+        # Só substitui a entrada se a versão não for mais antiga (ou se ela já expirou):
+        # uma leitura anterior à alteração não sobrescreve a marca de invalidação
+        agora = time.time()
+        self._conn().execute("""
+            INSERT INTO configuracoes (empresa_id, versao, dados, expira_em)
+            VALUES (:empresa_id, :versao, :dados, :expira_em)
+            ON CONFLICT (empresa_id) DO UPDATE SET
+                versao = excluded.versao, dados = excluded.dados, expira_em = excluded.expira_em
+            WHERE excluded.versao >= configuracoes.versao OR configuracoes.expira_em <= :agora
+        """, {'empresa_id': empresa_id, 'versao': versao, 'dados': dados,
+              'expira_em': agora + self.ttl, 'agora': agora})
+
+    def invalidate(self, empresa_id: int, versao: int):
+        """
+        Descarta as configurações da empresa em todos os workers
+
+        Deve ser chamado depois do commit, com a nova versão da empresa
+        (para uma empresa excluída, a última versão + 1).
+        """
+        self._gravar(empresa_id, versao, None)
+        self._contar('invalidations')
+
+    def clear(self):
+        self._conn().execute('DELETE FROM configuracoes')
+
+    def stats(self) -> Dict[str, Any]:
+        """Taxa de acerto dos workers ativos na última `stats_retention` e espaço ocupado pelo cache"""
+        self._publicar_stats()
+        conn = self._conn()
+
+        total = conn.execute("""
+            SELECT count(*), coalesce(sum(hits), 0), coalesce(sum(misses), 0),
+                   coalesce(sum(stores), 0), coalesce(sum(invalidations), 0)
+            FROM estatisticas
+        """).fetchone()
+        entradas = conn.execute("""
+            SELECT count(*), count(dados), coalesce(sum(length(dados)), 0)
+            FROM configuracoes WHERE expira_em > ?
+        """, (time.time(),)).fetchone()
+        page_count = conn.execute('PRAGMA page_count').fetchone()[0]
+        page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+        wal = os.path.getsize(self.path + '-wal') if os.path.exists(self.path + '-wal') else 0
+
+        processos, hits, misses, stores, invalidations = total
+        leituras = hits + misses
+        return {
+            'processos': processos,
+            'hits': hits,
+            'misses': misses,
+            'taxa_acerto': round(hits / leituras * 100, 2) if leituras else 0,
+            'gravacoes': stores,
+            'invalidacoes': invalidations,
+            'entradas': entradas[1],
+            'marcas_invalidacao': entradas[0] - entradas[1],
+            'bytes_dados': entradas[2],
+            'bytes_arquivo': page_count * page_size,
+            'bytes_wal': wal,
+            'processo_atual': dict(self._stats, pid=os.getpid()),
+            'ttl_segundos': self.ttl,
+            'retencao_estatisticas_segundos': self.stats_retention
+        }
+
+
+# Instância global do cache de configurações das empresas
+tenant_cache = TenantConfigCache()
@@ -0,0 +1,151 @@
+"""
+Despachante concorrente de mensagens WhatsApp
+Envia lotes com sessões HTTP reaproveitadas, concorrência limitada e
+limite de taxa por token (cada empresa tem o seu)
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class TokenBucket:
+    """Balde de fichas: `rate` envios por segundo com rajadas de até `capacity`"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Bloqueia até haver uma ficha disponível"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+
+                if now >= self._blocked_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = max(self._blocked_until - now, (1 - self._tokens) / self.rate)
+            time.sleep(wait)
+
+    def block(self, seconds: float):
+        """Suspende o balde (ex.: após um 429 com Retry-After) e zera as fichas acumuladas"""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+            self._tokens = 0
+
+
+class WhatsAppDispatcher:
+    """Envia mensagens WhatsApp em paralelo respeitando o limite de cada token"""
+
+    def __init__(self, api_url: str, max_workers: int = 8, rate_per_token: float = 20.0,
+                 max_retries: int = 3, timeout: float = 10.0):
+        self.api_url = api_url
+        self.max_workers = max_workers
+        self.rate_per_token = rate_per_token
+        self.max_retries = max_retries
+        self.timeout = timeout
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='whatsapp')
+        self._local = threading.local()
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._buckets_lock = threading.Lock()
+        self.stats = {'sent': 0, 'failed': 0, 'rate_limited': 0}
+
+    def _session(self) -> requests.Session:
+        """Sessão HTTP por thread, com conexões keep-alive reaproveitadas"""
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self._local.session = session
+        return session
+
+    def _bucket(self, token: str) -> TokenBucket:
+        with self._buckets_lock:
+            bucket = self._buckets.get(token)
+            if bucket is None:
+                bucket = self._buckets[token] = TokenBucket(self.rate_per_token)
+            return bucket
+
+    @staticmethod
+    def _retry_after(response: requests.Response) -> float:
+        try:
+            return max(float(response.headers.get('Retry-After', 1)), 0.0)
+        except ValueError:
+            return 1.0
+
+    def send(self, phone: str, message: str, token: str) -> Dict[str, Any]:
+        """Envia uma mensagem, aguardando o limite do token e repetindo após 429"""
+        bucket = self._bucket(token or '')
+        error = None
+
+        for _ in range(self.max_retries + 1):
+            bucket.acquire()
+            try:
+                response = self._session().post(
+                    self.api_url,
+                    json={'to': phone, 'message': message},
+                    headers={'Authorization': f'Bearer {token}'} if token else {},
+                    timeout=self.timeout
+                )
+            except requests.RequestException as e:
+                error = str(e)
+                break
+
+            if response.status_code == 429:
+                self.stats['rate_limited'] += 1
+                bucket.block(self._retry_after(response))
+                error = 'Limite de envio do provedor excedido (429)'
+                continue
+
+            if response.ok:
+                self.stats['sent'] += 1
+                return {
+                    'success': True,
+                    'message': 'WhatsApp enviado com sucesso',
+                    'sent_at': datetime.now().isoformat(),
+                    'phone': phone
+                }
+
+            error = f'HTTP {response.status_code}: {response.text[:200]}'
+            break
+
+        self.stats['failed'] += 1
+        return {
+            'success': False,
+            'message': f'Erro ao enviar WhatsApp: {error}',
+            'error': error
+        }
+
+    def send_batch(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Envia um lote de mensagens em paralelo
+
+        Args:
+            messages: Lista de dicts com phone, message e token
+
+        Returns:
+            Lista com o resultado de cada mensagem, na mesma ordem
+        """
+        futures = [
+            self._executor.submit(self.send, item['phone'], item['message'], item.get('token'))
+            for item in messages
+        ]
+        return [future.result() for future in futures]
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
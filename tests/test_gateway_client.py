@@ -0,0 +1,187 @@
+"""
+Circuit breaker e timeouts do GatewayClient com uma sessão HTTP simulada
+
+O relógio do módulo é substituído por um relógio falso, para avançar o
+reset_timeout do circuito sem esperar.
+"""
+
+import pytest
+import requests
+
+from src.services import gateway_client
+from src.services.gateway_client import CircuitBreaker, GatewayClient, GatewayUnavailableError
+
+
+class RelogioFalso:
+    def __init__(self):
+        self.agora = 1000.0
+
+    def monotonic(self):
+        return self.agora
+
+    def avancar(self, segundos):
+        self.agora += segundos
+
+
+class RespostaFalsa:
+    def __init__(self, status_code, corpo=None):
+        self.status_code = status_code
+        self.corpo = corpo if corpo is not None else {'status': 'pending'}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f'HTTP {self.status_code}', response=self)
+
+    def json(self):
+        return self.corpo
+
+
+class SessaoFalsa:
+    """Devolve (ou levanta) os resultados na ordem e registra as chamadas"""
+
+    def __init__(self, resultados=()):
+        self.resultados = list(resultados)
+        self.chamadas = []
+
+    def request(self, method, url, **kwargs):
+        self.chamadas.append({'method': method, 'url': url, **kwargs})
+        resultado = self.resultados.pop(0) if self.resultados else RespostaFalsa(200)
+        if isinstance(resultado, Exception):
+            raise resultado
+        return resultado
+
+
+@pytest.fixture
+def relogio(monkeypatch):
+    relogio = RelogioFalso()
+    monkeypatch.setattr(gateway_client, 'time', relogio)
+    return relogio
+
+
+def _cliente(resultados=(), **kwargs):
+    kwargs.setdefault('failure_threshold', 3)
+    kwargs.setdefault('reset_timeout', 30)
+    cliente = GatewayClient('pagseguro', 'https://gateway.exemplo/api/', token='segredo', **kwargs)
+    cliente.session = SessaoFalsa(resultados)
+    return cliente
+
+
+def test_circuito_abre_apos_falhas_consecutivas(relogio):
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+
+    for _ in range(2):
+        assert breaker.allow()
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+
+def test_sucesso_zera_as_falhas(relogio):
+    breaker = CircuitBreaker(failure_threshold=3)
+
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.failures == 1
+
+
+def test_meio_aberto_libera_uma_unica_chamada_de_teste(relogio):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+
+    relogio.avancar(29.9)
+    assert not breaker.allow()
+
+    relogio.avancar(0.1)
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+
+
+def test_chamada_de_teste_com_sucesso_fecha_o_circuito(relogio):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    relogio.avancar(30)
+
+    assert breaker.allow()
+    breaker.record_success()
+
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow() and breaker.allow()
+
+
+def test_chamada_de_teste_com_falha_reabre_o_circuito(relogio):
+    breaker = CircuitBreaker(failure_threshold=5, reset_timeout=30)
+    for _ in range(5):
+        breaker.record_failure()
+    relogio.avancar(30)
+
+    assert breaker.allow()
+    breaker.record_failure()
+
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    relogio.avancar(30)
+    assert breaker.allow()
+
+
+def test_cliente_monta_a_url_e_envia_os_timeouts():
+    cliente = _cliente([RespostaFalsa(200, {'status': 'paid'})], connect_timeout=2, read_timeout=7)
+
+    assert cliente.get('/payments/abc') == {'status': 'paid'}
+
+    chamada = cliente.session.chamadas[0]
+    assert chamada['method'] == 'GET'
+    assert chamada['url'] == 'https://gateway.exemplo/api/payments/abc'
+    assert chamada['timeout'] == (2, 7)
+
+
+def test_timeouts_abrem_o_circuito_e_as_chamadas_seguintes_nao_vao_a_rede(relogio):
+    cliente = _cliente([requests.Timeout('lento')] * 3)
+
+    for _ in range(3):
+        with pytest.raises(requests.Timeout):
+            cliente.get('/payments/abc')
+
+    with pytest.raises(GatewayUnavailableError):
+        cliente.get('/payments/abc')
+
+    assert len(cliente.session.chamadas) == 3
+    metricas = cliente.metrics()
+    assert metricas['circuito'] == CircuitBreaker.OPEN
+    assert metricas['timeouts'] == 3
+    assert metricas['rejected'] == 1
+
+
+def test_respostas_5xx_contam_como_falha_e_4xx_nao(relogio):
+    cliente = _cliente([RespostaFalsa(404)] * 3 + [RespostaFalsa(503)] * 3)
+
+    for _ in range(3):
+        with pytest.raises(requests.HTTPError):
+            cliente.get('/payments/inexistente')
+    assert cliente.breaker.state == CircuitBreaker.CLOSED
+
+    for _ in range(3):
+        with pytest.raises(requests.HTTPError):
+            cliente.get('/payments/abc')
+    assert cliente.breaker.state == CircuitBreaker.OPEN
+
+
+def test_gateway_recuperado_fecha_o_circuito(relogio):
+    cliente = _cliente([requests.ConnectionError('recusada')] * 3 + [RespostaFalsa(200)])
+
+    for _ in range(3):
+        with pytest.raises(requests.ConnectionError):
+            cliente.get('/payments/abc')
+    with pytest.raises(GatewayUnavailableError):
+        cliente.get('/payments/abc')
+
+    relogio.avancar(30)
+    assert cliente.get('/payments/abc') == {'status': 'pending'}
+    assert cliente.breaker.state == CircuitBreaker.CLOSED
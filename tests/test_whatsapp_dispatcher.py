@@ -0,0 +1,169 @@
+"""
+Limite de taxa do WhatsAppDispatcher contra uma API simulada
+
+O relógio do módulo é substituído por um relógio falso: as esperas do balde
+avançam o tempo na hora, sem dormir de verdade.
+"""
+
+import pytest
+
+from src.services import whatsapp_dispatcher
+from src.services.whatsapp_dispatcher import TokenBucket, WhatsAppDispatcher
+
+
+class RelogioFalso:
+    def __init__(self):
+        self.agora = 1000.0
+        self.esperas = []
+
+    def monotonic(self):
+        return self.agora
+
+    def sleep(self, segundos):
+        self.esperas.append(segundos)
+        self.agora += segundos
+
+
+class RespostaFalsa:
+    def __init__(self, status_code, headers=None, text=''):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.text = text
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+
+class SessaoFalsa:
+    """API de WhatsApp simulada: devolve as respostas na ordem e registra as chamadas"""
+
+    def __init__(self, relogio, respostas):
+        self.relogio = relogio
+        self.respostas = list(respostas)
+        self.chamadas = []
+
+    def post(self, url, json=None, headers=None, timeout=None):
+        self.chamadas.append({'em': self.relogio.agora, 'json': json, 'headers': headers})
+        return self.respostas.pop(0) if self.respostas else RespostaFalsa(200)
+
+
+@pytest.fixture
+def relogio(monkeypatch):
+    relogio = RelogioFalso()
+    monkeypatch.setattr(whatsapp_dispatcher, 'time', relogio)
+    return relogio
+
+
+@pytest.fixture
+def despachante():
+    despachante = WhatsAppDispatcher('https://whatsapp.exemplo/enviar', max_workers=1, rate_per_token=5, max_retries=2)
+    yield despachante
+    despachante.shutdown()
+
+
+def _usar_sessao(despachante, sessao):
+    despachante._local.session = sessao
+
+
+def test_balde_libera_rajada_e_depois_espera_a_taxa(relogio):
+    balde = TokenBucket(rate=10, capacity=3)
+
+    for _ in range(3):
+        balde.acquire()
+    assert relogio.esperas == []
+
+    inicio = relogio.agora
+    balde.acquire()
+    assert relogio.agora - inicio == pytest.approx(0.1)
+
+
+def test_balde_bloqueado_espera_o_retry_after(relogio):
+    balde = TokenBucket(rate=10, capacity=5)
+    inicio = relogio.agora
+
+    balde.block(2.5)
+    balde.acquire()
+
+    assert relogio.agora - inicio >= 2.5
+
+
+def test_bloqueio_descarta_as_fichas_acumuladas(relogio):
+    balde = TokenBucket(rate=10, capacity=5)
+    inicio = relogio.agora
+
+    # Balde cheio, mas o 429 zera as fichas: o próximo envio espera a taxa normal
+    balde.block(0)
+    balde.acquire()
+
+    assert relogio.agora - inicio == pytest.approx(0.1)
+
+
+def test_bloqueio_nao_encurta_um_bloqueio_maior(relogio):
+    balde = TokenBucket(rate=10)
+    inicio = relogio.agora
+
+    balde.block(5)
+    balde.block(1)
+    balde.acquire()
+
+    assert relogio.agora - inicio >= 5
+
+
+def test_429_aguarda_retry_after_e_reenvia(relogio, despachante):
+    sessao = SessaoFalsa(relogio, [RespostaFalsa(429, {'Retry-After': '3'}), RespostaFalsa(200)])
+    _usar_sessao(despachante, sessao)
+
+    resultado = despachante.send('+5511999999999', 'Olá', 'token-a')
+
+    assert resultado['success'] is True
+    assert len(sessao.chamadas) == 2
+    assert sessao.chamadas[1]['em'] - sessao.chamadas[0]['em'] >= 3
+    assert sessao.chamadas[0]['headers'] == {'Authorization': 'Bearer token-a'}
+    assert despachante.stats == {'sent': 1, 'failed': 0, 'rate_limited': 1}
+
+
+def test_429_repetido_esgota_as_tentativas(relogio, despachante):
+    sessao = SessaoFalsa(relogio, [RespostaFalsa(429, {'Retry-After': '1'})] * 3)
+    _usar_sessao(despachante, sessao)
+
+    resultado = despachante.send('+5511999999999', 'Olá', 'token-a')
+
+    assert resultado['success'] is False
+    assert '429' in resultado['error']
+    assert len(sessao.chamadas) == despachante.max_retries + 1
+    assert despachante.stats == {'sent': 0, 'failed': 1, 'rate_limited': 3}
+
+
+def test_retry_after_invalido_usa_um_segundo(relogio, despachante):
+    sessao = SessaoFalsa(relogio, [RespostaFalsa(429, {'Retry-After': 'Wed, 21 Oct 2026 07:28:00 GMT'}), RespostaFalsa(200)])
+    _usar_sessao(despachante, sessao)
+
+    assert despachante.send('+5511999999999', 'Olá', 'token-a')['success'] is True
+    assert sessao.chamadas[1]['em'] - sessao.chamadas[0]['em'] >= 1
+
+
+def test_erro_http_nao_e_repetido(relogio, despachante):
+    sessao = SessaoFalsa(relogio, [RespostaFalsa(400, text='número inválido')])
+    _usar_sessao(despachante, sessao)
+
+    resultado = despachante.send('123', 'Olá', 'token-a')
+
+    assert resultado['success'] is False
+    assert resultado['error'] == 'HTTP 400: número inválido'
+    assert len(sessao.chamadas) == 1
+
+
+def test_limite_e_por_token(relogio, despachante):
+    sessao = SessaoFalsa(relogio, [])
+    _usar_sessao(despachante, sessao)
+
+    # 5 envios por segundo: a rajada de um token não atrasa o outro
+    for _ in range(5):
+        despachante.send('+5511999999999', 'Olá', 'token-a')
+    inicio = relogio.agora
+    despachante.send('+5511988888888', 'Olá', 'token-b')
+    assert relogio.agora == inicio
+
+    despachante.send('+5511999999999', 'Olá', 'token-a')
+    assert relogio.agora - inicio == pytest.approx(0.2)